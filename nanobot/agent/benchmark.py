@@ -0,0 +1,348 @@
+"""Vector memory benchmark: synthetic multi-session corpora and comparable JSON results."""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+from nanobot.agent.vectordb import LocalVectorDB, RetentionPolicy, np
+
+# Named corpus sizes (messages)
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+_SYLLABLES = [
+    "ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "ze", "po", "da", "fe", "gu", "hi", "jo",
+    "be", "ci", "dor", "en", "fal", "gri", "hon", "is", "jul", "kem", "lar", "mos", "nid",
+]
+
+
+@dataclass
+class BenchmarkSpec:
+    """What to generate and how to configure the database under test."""
+
+    messages: int
+    messages_per_session: int = 1000
+    burst: int = 20  # Messages a session receives before another one takes a turn
+    active_sessions: int = 32  # Sessions taking turns at any time; a finished one is replaced by a new one
+    vocabulary: int = 50_000
+    batch: int = 256  # Messages per ``add_messages`` call, as the background indexer sends them
+    queries: int = 500
+    query_sessions: int = 32  # Sessions searched; few enough to stay resident, so searches never load a shard
+    seed: int = 0
+    ranking: str = "tfidf"
+    backend: str = "auto"
+    retrieval: str = "lexical"
+    top_k: int = 5
+
+    @property
+    def sessions(self) -> int:
+        return max(1, -(-self.messages // self.messages_per_session))
+
+
+@dataclass
+class BenchmarkResult:
+    spec: dict
+    environment: dict
+    add: dict = field(default_factory=dict)
+    disk: dict = field(default_factory=dict)
+    cold: dict = field(default_factory=dict)
+    search: dict = field(default_factory=dict)
+    memory: dict = field(default_factory=dict)
+
+
+class SyntheticCorpus:
+    """Deterministic chat-like messages spread over many sessions.
+
+    Words follow a Zipf distribution over a pronounceable vocabulary, so a few
+    terms are very common and most are rare, as in real conversations.
+    ``active_sessions`` sessions take turns in bursts of ``burst`` messages and
+    a finished session is replaced by a new one, so the database sees the
+    interleaving of a busy gateway (raise it above the resident shard limit
+    to measure eviction).
+    """
+
+    def __init__(self, spec: BenchmarkSpec):
+        self.spec = spec
+        rng = random.Random(spec.seed)
+        words: set[str] = set()
+        while len(words) < spec.vocabulary:
+            words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+        self.words = sorted(words)
+        rng.shuffle(self.words)
+        weights = [1.0 / (rank + 1) for rank in range(len(self.words))]
+        self._cum_weights = list(_accumulate(weights))
+
+    def session_key(self, i: int) -> str:
+        return f"bench:{i:06d}"
+
+    def messages(self) -> Iterator[tuple[str, dict, int]]:
+        """(session key, message, message index) in arrival order."""
+        spec = self.spec
+        rng = random.Random(spec.seed + 1)
+        remaining = [spec.messages // spec.sessions + (i < spec.messages % spec.sessions)
+                     for i in range(spec.sessions)]
+        next_idx = [0] * spec.sessions
+        active = list(range(min(spec.active_sessions, spec.sessions)))
+        waiting = iter(range(len(active), spec.sessions))
+        start = datetime(2025, 1, 1)
+        produced = 0
+        while active:
+            for i in list(active):
+                for _ in range(min(spec.burst, remaining[i])):
+                    idx = next_idx[i]
+                    role = "tool" if idx % 10 == 9 else ("user" if idx % 2 == 0 else "assistant")
+                    n_words = rng.randint(4, 40) if role != "tool" else rng.randint(20, 120)
+                    msg = {
+                        "role": role,
+                        "content": " ".join(rng.choices(self.words, cum_weights=self._cum_weights, k=n_words)),
+                        "timestamp": (start + timedelta(minutes=produced)).isoformat(),
+                    }
+                    yield self.session_key(i), msg, idx
+                    next_idx[i] += 1
+                    remaining[i] -= 1
+                    produced += 1
+                if not remaining[i]:
+                    active.remove(i)
+                    replacement = next(waiting, None)
+                    if replacement is not None:
+                        active.append(replacement)
+
+    def queries(self) -> list[tuple[str, str]]:
+        """(session key, query) pairs: two to four words, mostly mid-frequency ones."""
+        spec = self.spec
+        rng = random.Random(spec.seed + 2)
+        out = []
+        for _ in range(spec.queries):
+            session = self.session_key(rng.randrange(min(spec.sessions, spec.query_sessions)))
+            words = [self.words[min(int(rng.paretovariate(0.6)) + 20, len(self.words) - 1)]
+                     for _ in range(rng.randint(2, 4))]
+            out.append((session, " ".join(words)))
+        return out
+
+
+def _accumulate(values: list[float]) -> Iterator[float]:
+    total = 0.0
+    for v in values:
+        total += v
+        yield total
+
+
+def open_db(workspace: Path, spec: BenchmarkSpec) -> LocalVectorDB:
+    embedder = None
+    if spec.retrieval != "lexical":
+        from nanobot.agent.embeddings import HashingEmbedder
+        embedder = HashingEmbedder()
+    # No query cache, so every search is measured rather than served from a previous one, and
+    # no age limits, so the synthetic timestamps do not decide how much of the corpus is kept
+    return LocalVectorDB(
+        workspace, ranking=spec.ranking, backend=spec.backend, retrieval=spec.retrieval,
+        embedder=embedder, retention=RetentionPolicy(tool_max_age_days=0), query_cache_size=0,
+    )
+
+
+def rss_bytes() -> tuple[int | None, int | None]:
+    """(current, peak) resident set size of this process, where the platform reports them."""
+    current = peak = None
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if peak is None:
+        try:
+            import resource
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak = maxrss if sys.platform == "darwin" else maxrss * 1024
+        except ImportError:  # Windows
+            pass
+    return current, peak
+
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ms = sorted(s * 1000 for s in samples)
+    if len(ms) == 1:
+        return {"p50_ms": ms[0], "p99_ms": ms[0], "mean_ms": ms[0], "max_ms": ms[0]}
+    cuts = statistics.quantiles(ms, n=100, method="inclusive")
+    return {"p50_ms": cuts[49], "p99_ms": cuts[98], "mean_ms": statistics.fmean(ms), "max_ms": ms[-1]}
+
+
+def _disk_usage(path: Path) -> dict:
+    files = [p for p in path.rglob("*") if p.is_file()]
+    by_kind: dict[str, int] = {}
+    for p in files:
+        kind = p.name.partition(".")[2] or p.name
+        by_kind[kind] = by_kind.get(kind, 0) + p.stat().st_size
+    return {"bytes": sum(by_kind.values()), "files": len(files), "by_kind": by_kind}
+
+
+def _environment() -> dict:
+    commit = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        pass
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__ if np is not None else None,
+        "cpu_count": os.cpu_count(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def _index_corpus(workspace: Path, spec: BenchmarkSpec, corpus: SyntheticCorpus) -> dict:
+    db = open_db(workspace, spec)
+    pending: list[tuple[dict, int]] = []
+    pending_key = None
+    elapsed = 0.0
+    indexed = 0
+
+    def flush():
+        nonlocal elapsed, indexed
+        t0 = time.perf_counter()
+        indexed += db.add_messages(pending_key, pending)
+        elapsed += time.perf_counter() - t0
+        pending.clear()
+
+    for key, msg, idx in corpus.messages():
+        if key != pending_key or len(pending) >= spec.batch:
+            if pending:
+                flush()
+            pending_key = key
+        pending.append((msg, idx))
+    if pending:
+        flush()
+    t0 = time.perf_counter()
+    db.close()  # Waits for background compactions, so they are part of the indexing cost
+    close_s = time.perf_counter() - t0
+    current, peak = rss_bytes()
+    return {
+        "messages": spec.messages,
+        "indexed": indexed,
+        "seconds": elapsed,
+        "close_seconds": close_s,
+        "messages_per_second": spec.messages / (elapsed + close_s) if elapsed + close_s else None,
+        "rss_bytes": current,
+        "peak_rss_bytes": peak,
+    }
+
+
+def search_phase(workspace: str, spec_dict: dict, queries: list[tuple[str, str]]) -> dict:
+    """Cold open, first touch of each session, then timed searches.
+
+    Runs in a fresh process so load time and memory are not flattered by the
+    indexing phase's caches and heap.
+    """
+    logger.disable("nanobot")  # A dedicated worker process: keep its output to the results
+    spec = BenchmarkSpec(**spec_dict)
+    rss_start, _ = rss_bytes()
+    t0 = time.perf_counter()
+    db = open_db(Path(workspace), spec)
+    open_s = time.perf_counter() - t0
+    loads = []
+    for session in dict.fromkeys(key for key, _ in queries):
+        t0 = time.perf_counter()
+        db._shard(session, create=False)
+        loads.append(time.perf_counter() - t0)
+    latencies, hits = [], 0
+    for session, query in queries:
+        t0 = time.perf_counter()
+        results = db.search_messages(session, query, top_k=spec.top_k)
+        latencies.append(time.perf_counter() - t0)
+        hits += bool(results)
+    rss_end, peak = rss_bytes()
+    db.close()
+    return {
+        "cold": {"open_seconds": open_s, "sessions_loaded": len(loads), **{
+            k.replace("_ms", "_session_load_ms"): v for k, v in _percentiles(loads).items()
+        }},
+        "search": {"queries": len(latencies), "with_results": hits, **_percentiles(latencies)},
+        "memory": {
+            "rss_before_open_bytes": rss_start,
+            "rss_after_search_bytes": rss_end,
+            "rss_search_delta_bytes": rss_end - rss_start if rss_end and rss_start else None,
+            "peak_rss_bytes": peak,
+        },
+    }
+
+
+def run_benchmark(spec: BenchmarkSpec, workdir: Path | None = None, keep: bool = False) -> BenchmarkResult:
+    """Index a synthetic corpus into a scratch workspace and measure it."""
+    corpus = SyntheticCorpus(spec)
+    workspace = Path(tempfile.mkdtemp(prefix="nanobot-bench-", dir=workdir))
+    try:
+        result = BenchmarkResult(spec=asdict(spec) | {"sessions": spec.sessions}, environment=_environment())
+        result.add = _index_corpus(workspace, spec, corpus)
+        result.disk = _disk_usage(workspace / "vector_memory")
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            measured = pool.submit(search_phase, str(workspace), asdict(spec), corpus.queries()).result()
+        result.cold, result.search, result.memory = measured["cold"], measured["search"], measured["memory"]
+        result.memory["index_peak_rss_bytes"] = result.add.pop("peak_rss_bytes")
+        result.memory["index_rss_bytes"] = result.add.pop("rss_bytes")
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def save_results(results: list[BenchmarkResult], path: Path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"results": [asdict(r) for r in results]}, f, indent=2)
+
+
+# Metrics compared between runs, and whether higher is better
+COMPARED_METRICS = {
+    ("add", "messages_per_second"): True,
+    ("search", "p50_ms"): False,
+    ("search", "p99_ms"): False,
+    ("cold", "open_seconds"): False,
+    ("cold", "p50_session_load_ms"): False,
+    ("disk", "bytes"): False,
+    ("memory", "rss_search_delta_bytes"): False,
+}
+
+
+def compare(baseline: dict, current: dict) -> list[tuple[str, str, float | None, float | None, float | None]]:
+    """(corpus, metric, baseline, current, relative change) for runs of the same corpus size.
+
+    The relative change is signed so that positive always means better.
+    """
+    rows = []
+    before = {r["spec"]["messages"]: r for r in baseline["results"]}
+    for run in current["results"]:
+        base = before.get(run["spec"]["messages"])
+        if base is None:
+            continue
+        for (section, metric), higher_is_better in COMPARED_METRICS.items():
+            old, new = base[section].get(metric), run[section].get(metric)
+            change = None
+            if old and new is not None:
+                change = (new - old) / old if higher_is_better else (old - new) / old
+            rows.append((str(run["spec"]["messages"]), f"{section}.{metric}", old, new, change))
+    return rows
@@ -0,0 +1,448 @@
+"""Dense embeddings for vector memory: backends, int8 storage and an IVF index."""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+from abc import ABC, abstractmethod
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import httpx
+from loguru import logger
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; dense search falls back to a brute-force scan
+    np = None
+
+if TYPE_CHECKING:
+    from nanobot.config.schema import EmbeddingConfig
+
+
+class EmbeddingBackend(ABC):
+    """Turns texts into L2-normalized float vectors."""
+
+    @property
+    @abstractmethod
+    def dim(self) -> int:
+        """Vector dimension (may require one embedding call to discover)."""
+
+    @property
+    def known_dim(self) -> int | None:
+        """The dimension if it is known without an embedding call, else None."""
+        return self.dim
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """Embed a batch of texts."""
+
+
+def _normalize(vec: list[float]) -> list[float]:
+    norm = math.sqrt(sum(v * v for v in vec))
+    return [v / norm for v in vec] if norm else vec
+
+
+class HashingEmbedder(EmbeddingBackend):
+    """Dependency-free local embedder: signed feature hashing of words and character trigrams.
+
+    Not a semantic model, but trigrams make inflections and typos ("meeting" /
+    "meetings" / "meetng") land close together, which plain term overlap misses.
+    """
+
+    def __init__(self, dim: int = 256):
+        self._dim = dim
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed_one(t) for t in texts]
+
+    def _embed_one(self, text: str) -> list[float]:
+        vec = [0.0] * self._dim
+        for word in re.findall(r"\w+", text.lower()):
+            features = [word] + [f"#{g}" for g in self._trigrams(word)]
+            for feature in features:
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vec[h % self._dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return _normalize(vec)
+
+    @staticmethod
+    def _trigrams(word: str) -> list[str]:
+        padded = f"<{word}>"
+        return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class OpenAIEmbedder(EmbeddingBackend):
+    """Any OpenAI-compatible ``/embeddings`` endpoint (OpenAI, vLLM, Ollama, a local stub...)."""
+
+    def __init__(self, model: str, api_base: str = "https://api.openai.com/v1", api_key: str = "",
+                 timeout: float = 30.0, dim: int | None = None):
+        self.model = model
+        self.url = api_base.rstrip("/") + "/embeddings"
+        self.api_key = api_key
+        self.timeout = timeout
+        self._dim = dim  # From the config, or learned from the first response
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            self._dim = len(self.embed(["dimension probe"])[0])
+        return self._dim
+
+    @property
+    def known_dim(self) -> int | None:
+        return self._dim
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        response = httpx.post(
+            self.url, json={"model": self.model, "input": texts}, headers=headers, timeout=self.timeout,
+        )
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda d: d["index"])
+        vectors = [_normalize(d["embedding"]) for d in data]
+        if vectors:
+            self._dim = len(vectors[0])
+        return vectors
+
+
+class SentenceTransformerEmbedder(EmbeddingBackend):
+    """Local model through the optional ``sentence-transformers`` package."""
+
+    def __init__(self, model: str = "all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ValueError(
+                "The sentence-transformers embedding provider requires "
+                "`pip install sentence-transformers`"
+            ) from e
+        self._model = SentenceTransformer(model)
+
+    @property
+    def dim(self) -> int:
+        return self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [list(map(float, v)) for v in self._model.encode(texts, normalize_embeddings=True)]
+
+
+def create_embedder(config: EmbeddingConfig) -> EmbeddingBackend:
+    """Build the embedding backend selected in ``memory.vector.embedding``."""
+    if config.provider == "openai":
+        return OpenAIEmbedder(
+            model=config.model or "text-embedding-3-small",
+            api_base=config.api_base or "https://api.openai.com/v1",
+            api_key=config.api_key,
+            dim=config.dim or None,
+        )
+    if config.provider == "sentence-transformers":
+        return SentenceTransformerEmbedder(config.model or "all-MiniLM-L6-v2")
+    return HashingEmbedder(config.dim or 256)
+
+
+# Quantized vector file: a header, then one row per document slot holding a
+# float32 scale followed by ``dim`` int8 components (value ~= scale * component).
+_EMB_MAGIC = b"NBEMB"
+_EMB_VERSION = 1
+_EMB_HEADER = struct.Struct("<5sHII1x")  # magic, version, dim, shard epoch (16 bytes)
+
+
+def quantize(vec: list[float]) -> tuple[float, array]:
+    peak = max((abs(v) for v in vec), default=0.0)
+    scale = peak / 127.0 if peak else 1.0
+    return scale, array("b", (max(-127, min(127, round(v / scale))) for v in vec))
+
+
+class DenseStore:
+    """Int8-quantized, memory-mapped vectors for one shard, aligned with its document slots.
+
+    Rows are appended as documents are embedded; ``sync`` catches up with any
+    slots that are still missing (e.g. after an embedding endpoint failure or
+    when dense retrieval is switched on for an existing shard). With NumPy,
+    searches go through an IVF index once the shard is large enough. The file
+    records the shard ``epoch`` it was written for; rows from another epoch
+    belong to different slot numbers and are re-embedded.
+
+    Opening a store never calls the embedder: the dimension comes from the
+    file (or the embedder's configured one), and a file that is out of date
+    is only marked ``stale``. It is rebuilt by the next ``sync``. Searching
+    never builds the IVF index either: ``build_index`` does, and saves it in
+    ``<name>.ivf`` for later loads; until then, or for rows appended since,
+    the rows are scanned.
+    """
+
+    BATCH = 64
+
+    def __init__(self, path: Path, embedder: EmbeddingBackend, epoch: int = 0):
+        self.path = path
+        self.embedder = embedder
+        self.epoch = epoch
+        self.dim = 0
+        self.stale = False  # The file does not match the shard or the embedder, nothing is served from it
+        self._mm: mmap.mmap | None = None
+        self._rows = None  # NumPy structured view over the mapped rows
+        self._mapped_rows = 0
+        self.index_path = path.with_suffix(".ivf")
+        self._ivf: IVFIndex | None = None
+        self._ivf_checked = False  # Whether the index file was looked for since the last unmap
+        self._open()
+
+    @property
+    def row_size(self) -> int:
+        return 4 + self.dim
+
+    def _open(self) -> None:
+        if self.path.exists() and self.path.stat().st_size >= _EMB_HEADER.size:
+            with open(self.path, "rb") as f:
+                magic, version, dim, epoch = _EMB_HEADER.unpack(f.read(_EMB_HEADER.size))
+            known = self.embedder.known_dim
+            if (magic == _EMB_MAGIC and version == _EMB_VERSION and dim and dim == (known or dim)
+                    and epoch == self.epoch):
+                self.dim = dim
+                return
+            logger.info("Stored vectors in {} are out of date, re-embedding in the background", self.path.name)
+        self.stale = True
+
+    def _reset(self) -> None:
+        """Start an empty file for the current epoch (may call the embedder to learn its dimension)."""
+        self._unmap()
+        self.index_path.unlink(missing_ok=True)
+        self.dim = self.embedder.dim
+        with open(self.path, "wb") as f:
+            f.write(_EMB_HEADER.pack(_EMB_MAGIC, _EMB_VERSION, self.dim, self.epoch))
+        self.stale = False
+
+    def __len__(self) -> int:
+        if self.stale:
+            return 0
+        return max(0, (self.path.stat().st_size - _EMB_HEADER.size) // self.row_size)
+
+    def sync(self, contents: list[str], limit: int | None = None) -> int:
+        """Embed and append rows for ``contents[len(self):]``, at most ``limit``; rows past the end are dropped.
+
+        Returns how many rows are still missing.
+        """
+        if self.stale:
+            self._reset()
+        rows = min(len(self), len(contents))
+        expected_size = _EMB_HEADER.size + rows * self.row_size
+        if self.path.stat().st_size != expected_size:
+            # Drop rows for slots that no longer exist and any torn trailing row
+            self._unmap()
+            with open(self.path, "r+b") as f:
+                f.truncate(expected_size)
+        end = len(contents) if limit is None else min(len(contents), rows + limit)
+        for start in range(rows, end, self.BATCH):
+            batch = contents[start:min(start + self.BATCH, end)]
+            try:
+                vectors = self.embedder.embed(batch)
+            except Exception as e:
+                logger.error("Embedding failed, dense rows from {} will be retried: {}", start, e)
+                return len(contents) - start
+            with open(self.path, "ab") as f:
+                for vec in vectors:
+                    scale, q = quantize(vec)
+                    f.write(struct.pack("<f", scale) + q.tobytes())
+        return len(contents) - end
+
+    def retain(self, slots: list[int], epoch: int) -> None:
+        """Keep only the rows of ``slots`` (ascending), renumbered from zero, for a rewritten shard."""
+        if self.stale:
+            self.epoch = epoch  # Nothing to keep; the rebuild writes the new epoch
+            return
+        self._unmap()
+        self.index_path.unlink(missing_ok=True)  # Built for the old slot numbers
+        tmp = self.path.with_suffix(".emb.tmp")
+        rows = len(self)
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            dst.write(_EMB_HEADER.pack(_EMB_MAGIC, _EMB_VERSION, self.dim, epoch))
+            for slot in slots:
+                if slot >= rows:
+                    break  # Not embedded yet; ``sync`` catches up
+                src.seek(_EMB_HEADER.size + slot * self.row_size)
+                dst.write(src.read(self.row_size))
+        os.replace(tmp, self.path)
+        self.epoch = epoch
+
+    def _unmap(self) -> None:
+        self._rows = None
+        self._ivf = None
+        self._ivf_checked = False
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._mapped_rows = 0
+
+    def _map(self) -> int:
+        """(Re)map the file if rows were appended; returns the row count."""
+        rows = len(self)
+        if rows != self._mapped_rows:
+            self._rows = None
+            if self._mm is not None:
+                self._mm.close()
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if np is not None:
+                dtype = np.dtype([("scale", "<f4"), ("q", "i1", (self.dim,))])
+                self._rows = np.frombuffer(self._mm, dtype=dtype, count=rows, offset=_EMB_HEADER.size)
+            self._mapped_rows = rows
+        return rows
+
+    def _index(self) -> IVFIndex | None:
+        """The IVF index, read from its file on first use."""
+        if self._ivf is None and not self._ivf_checked and np is not None:
+            self._ivf_checked = True
+            self._ivf = IVFIndex.load(self.index_path, self.dim, self.epoch, self._map())
+        return self._ivf
+
+    @property
+    def needs_index(self) -> bool:
+        """Whether an IVF index would be used but is missing or too far behind the rows."""
+        if np is None or self.stale:
+            return False
+        rows = self._map()
+        if rows < IVFIndex.MIN_ROWS:
+            return False
+        ivf = self._index()
+        return ivf is None or ivf.stale(rows)
+
+    def build_index(self) -> None:
+        """(Re)build the IVF index over every row and save it next to the vectors."""
+        rows = self._map()
+        self._ivf = IVFIndex.build(self._rows[:rows])
+        self._ivf.save(self.index_path, self.dim, self.epoch)
+
+    def search(self, q: list[float], top_k: int, min_score: float) -> list[tuple[float, int]]:
+        """(score, slot) pairs for the query embedding ``q`` by descending cosine, earlier slots first on ties."""
+        rows = self._map()
+        if not rows:
+            return []
+        if np is None:
+            return self._search_python(q, rows, top_k, min_score)
+        qv = np.asarray(q, dtype=np.float32)
+        ivf = self._index() if rows >= IVFIndex.MIN_ROWS else None
+        slots = ivf.candidates(qv, rows) if ivf is not None else np.arange(rows)
+        picked = self._rows[slots]
+        scores = (picked["q"].astype(np.float32) @ qv) * picked["scale"]
+        keep = scores > min_score
+        slots, scores = slots[keep], scores[keep]
+        order = np.lexsort((slots, -scores))[:top_k]
+        return [(float(scores[i]), int(slots[i])) for i in order]
+
+    def _search_python(self, q: list[float], rows: int, top_k: int, min_score: float):
+        scored = []
+        for slot in range(rows):
+            offset = _EMB_HEADER.size + slot * self.row_size
+            (scale,) = struct.unpack_from("<f", self._mm, offset)
+            comps = array("b", self._mm[offset + 4:offset + self.row_size])
+            score = scale * sum(a * b for a, b in zip(comps, q))
+            if score > min_score:
+                scored.append((score, slot))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return scored[:top_k]
+
+    def close(self) -> None:
+        self._unmap()
+
+
+class IVFIndex:
+    """Inverted-file ANN index: k-means centroids, each with the rows closest to it.
+
+    A query scores only the rows in its ``nprobe`` nearest lists (plus rows
+    appended since the index was built), so cost grows with about
+    ``rows * nprobe / nlist`` instead of ``rows``. Saved as an ``.npz`` file
+    recording the dimension and shard epoch it was built for.
+    """
+
+    MIN_ROWS = 4096
+    TRAIN_SAMPLE = 32768
+    ITERATIONS = 8
+    CHUNK = 16384
+    # About 2 * sqrt(rows) lists and a fixed number of probes, so a query scans
+    # ~8 * sqrt(rows) rows: 8k of 1M (see ``nanobot memory bench`` for recall and latency)
+    LISTS_PER_ROOT = 2
+    NPROBE = 16
+
+    def __init__(self, centroids, order, bounds, count: int):
+        self.count = count
+        self.centroids = centroids
+        self.nlist = len(centroids)
+        self.nprobe = min(self.nlist, self.NPROBE)
+        self._order = order
+        self._bounds = bounds
+
+    @classmethod
+    def build(cls, rows) -> IVFIndex:
+        count = len(rows)
+        nlist = max(16, int(cls.LISTS_PER_ROOT * math.sqrt(count)))
+        rng = np.random.default_rng(0)
+        sample_ids = np.sort(rng.choice(count, size=min(count, cls.TRAIN_SAMPLE), replace=False))
+        sample = cls._dequantize(rows[sample_ids])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(cls.ITERATIONS):
+            assign = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            filled = norms > 0  # A list that lost all its members keeps its centroid
+            centroids[filled] = sums[filled] / norms[filled, None]
+        assign = np.concatenate([
+            cls._assign(cls._dequantize(rows[start:start + cls.CHUNK]), centroids)
+            for start in range(0, count, cls.CHUNK)
+        ])
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        return cls(centroids, order, bounds, count)
+
+    def save(self, path: Path, dim: int, epoch: int) -> None:
+        tmp = path.with_suffix(".ivf.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, meta=np.array([dim, epoch, self.count], dtype=np.int64),
+                     centroids=self.centroids, order=self._order, bounds=self._bounds)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, dim: int, epoch: int, rows: int) -> IVFIndex | None:
+        """The saved index, if there is one built for this dimension, epoch and (at most) row count."""
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                saved_dim, saved_epoch, count = (int(v) for v in data["meta"])
+                if saved_dim != dim or saved_epoch != epoch or count > rows:
+                    return None
+                return cls(data["centroids"], data["order"], data["bounds"], count)
+        except Exception as e:
+            logger.warning("Ignoring unreadable vector index {}: {}", path.name, e)
+            return None
+
+    @classmethod
+    def _assign(cls, vectors, centroids):
+        """Nearest centroid of each vector, a chunk at a time to bound the score matrix."""
+        return np.concatenate([
+            np.argmax(vectors[start:start + cls.CHUNK] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), cls.CHUNK)
+        ])
+
+    @staticmethod
+    def _dequantize(rows):
+        return rows["q"].astype(np.float32) * rows["scale"][:, None]
+
+    def stale(self, rows: int) -> bool:
+        return rows - self.count > max(self.MIN_ROWS, self.count // 4)
+
+    def candidates(self, qv, rows: int):
+        probe = np.argpartition(-(self.centroids @ qv), self.nprobe - 1)[:self.nprobe]
+        parts = [self._order[self._bounds[c]:self._bounds[c + 1]] for c in probe]
+        if rows > self.count:
+            parts.append(np.arange(self.count, rows))
+        return np.sort(np.concatenate(parts))
@@ -0,0 +1,207 @@
+"""Inverted index over the entries of memory/HISTORY.md."""
+
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from nanobot.agent.vectordb import BM25_B, BM25_K1
+
+# An entry starts at a line beginning with its "[YYYY-MM-DD HH:MM]" header
+_HEADER = re.compile(rb"\[(\d{4}-\d{2}-\d{2})(?:[ T](\d{2}:\d{2}))?\]")
+_WORD = re.compile(r"\w+")
+
+# Bytes compared on each update to notice that the file was rewritten rather than appended to
+_FINGERPRINT = 64
+
+
+def _terms(text: str) -> Counter:
+    return Counter(_WORD.findall(text.lower()))
+
+
+def parse_stamp(value: str, end: bool = False) -> str:
+    """Normalize "YYYY-MM-DD[ HH:MM]" to "YYYY-MM-DD HH:MM" (a date alone covers the whole day)."""
+    value = value.strip().replace("T", " ")
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d":
+            return parsed.strftime("%Y-%m-%d ") + ("23:59" if end else "00:00")
+        return parsed.strftime("%Y-%m-%d %H:%M")
+    raise ValueError(f"invalid date '{value}', expected YYYY-MM-DD or YYYY-MM-DD HH:MM")
+
+
+@dataclass
+class HistoryHit:
+    stamp: str | None  # "YYYY-MM-DD HH:MM" from the entry header; None for text before the first header
+    text: str
+    score: float
+
+
+class HistoryIndex:
+    """BM25-ranked search over HISTORY.md entries.
+
+    The file is only ever appended to, so the index remembers how far it has
+    read and each update parses just the new bytes. The last entry stays open
+    (it is re-parsed on the next update) in case it was caught mid-write. If
+    the file shrank or its already-indexed bytes changed, it is re-read from
+    the start. Entry text is not kept in memory; hits are read back from the
+    file by offset.
+    """
+
+    def __init__(self, history_file: Path):
+        self.history_file = history_file
+        self._reset()
+
+    def _reset(self) -> None:
+        self.starts: list[int] = []  # Byte range of each entry in the file
+        self.ends: list[int] = []
+        self.stamps: list[str | None] = []
+        self.lengths: list[int] = []
+        self.postings: dict[str, dict[int, int]] = {}  # term -> {entry: tf}
+        self._entry_terms: Counter | None = None  # Terms of the open (last) entry
+        self._total_length = 0
+        self._head = b""  # Fingerprints of the indexed prefix
+        self._tail = b""
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def _open_start(self) -> int:
+        return self.starts[-1] if self.starts else 0
+
+    def _unchanged(self, f, size: int) -> bool:
+        if size < self.ends[-1]:
+            return False
+        f.seek(0)
+        if f.read(len(self._head)) != self._head:
+            return False
+        f.seek(self._open_start - len(self._tail))
+        return f.read(len(self._tail)) == self._tail
+
+    def update(self) -> int:
+        """Index whatever was appended since the last call; returns the number of entries."""
+        try:
+            f = open(self.history_file, "rb")
+        except FileNotFoundError:
+            self._reset()
+            return 0
+        with f:
+            size = f.seek(0, 2)
+            if self.starts and not self._unchanged(f, size):
+                self._reset()
+            if self.starts and size == self.ends[-1]:
+                return len(self.starts)
+            start = self._open_start
+            if self.starts:
+                self._drop_open_entry()
+            f.seek(start)
+            self._parse(f.read(), start)
+            f.seek(0)
+            self._head = f.read(min(_FINGERPRINT, size))
+            tail_from = max(0, self._open_start - _FINGERPRINT)
+            f.seek(tail_from)
+            self._tail = f.read(self._open_start - tail_from)
+        return len(self.starts)
+
+    def _drop_open_entry(self) -> None:
+        entry = len(self.starts) - 1
+        for term in self._entry_terms or ():
+            posting = self.postings[term]
+            del posting[entry]
+            if not posting:
+                del self.postings[term]
+        self._total_length -= self.lengths.pop()
+        self.starts.pop()
+        self.ends.pop()
+        self.stamps.pop()
+        self._entry_terms = None
+
+    def _parse(self, data: bytes, base: int) -> None:
+        pos = 0
+        start, stamp = 0, None
+        for line in data.splitlines(keepends=True):
+            match = _HEADER.match(line)
+            if match and pos > start:
+                self._add(data[start:pos], base + start, stamp)
+                start = pos
+            if match and pos == start:
+                day, minute = match.group(1).decode(), match.group(2)
+                stamp = f"{day} {minute.decode() if minute else '00:00'}"
+            pos += len(line)
+        if pos > start:
+            self._add(data[start:pos], base + start, stamp)
+
+    def _add(self, raw: bytes, start: int, stamp: str | None) -> None:
+        text = raw.decode("utf-8", errors="replace")
+        if not text.strip():
+            # Blank lines between entries (or before the first) belong to no entry
+            if self.ends and self.ends[-1] == start:
+                self.ends[-1] += len(raw)
+            return
+        entry = len(self.starts)
+        terms = _terms(text)
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[entry] = tf
+        length = sum(terms.values())
+        self.starts.append(start)
+        self.ends.append(start + len(raw))
+        self.stamps.append(stamp)
+        self.lengths.append(length)
+        self._total_length += length
+        self._entry_terms = terms
+
+    def _in_range(self, entry: int, since: str | None, until: str | None) -> bool:
+        if since is None and until is None:
+            return True
+        stamp = self.stamps[entry]
+        if stamp is None:
+            return False
+        return (since is None or stamp >= since) and (until is None or stamp <= until)
+
+    def search(self, query: str = "", since: str | None = None, until: str | None = None,
+               limit: int = 5) -> tuple[list[HistoryHit], int]:
+        """Best ``limit`` entries for ``query`` within [since, until], plus how many matched in all.
+
+        Without query terms, the newest entries in the date range are returned.
+        ``since``/``until`` take "YYYY-MM-DD" or "YYYY-MM-DD HH:MM".
+        """
+        since = parse_stamp(since) if since else None
+        until = parse_stamp(until, end=True) if until else None
+        self.update()
+        n = len(self.starts)
+        terms = _terms(query)
+        if not terms:
+            matched = [e for e in range(n) if self._in_range(e, since, until)]
+            ranked = [(0.0, e) for e in reversed(matched)]
+        else:
+            avg_length = self._total_length / n if n else 1.0
+            scores: dict[int, float] = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1.0 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for entry, tf in posting.items():
+                    if not self._in_range(entry, since, until):
+                        continue
+                    denom = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * self.lengths[entry] / avg_length)
+                    scores[entry] = scores.get(entry, 0.0) + idf * tf * (BM25_K1 + 1.0) / denom
+            # Newer entries first among equal scores
+            ranked = sorted(((s, e) for e, s in scores.items()), key=lambda x: (-x[0], -x[1]))
+        hits = []
+        if ranked[:limit]:
+            with open(self.history_file, "rb") as f:
+                for score, entry in ranked[:limit]:
+                    f.seek(self.starts[entry])
+                    raw = f.read(self.ends[entry] - self.starts[entry])
+                    text = raw.decode("utf-8", errors="replace").strip()
+                    hits.append(HistoryHit(self.stamps[entry], text, score))
+        return hits, len(ranked)
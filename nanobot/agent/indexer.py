@@ -0,0 +1,148 @@
+"""Background indexing for vector memory, off the event loop."""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+
+from nanobot.agent.vectordb import LocalVectorDB
+
+
+class BackgroundIndexer:
+    """Feeds a LocalVectorDB from a worker thread.
+
+    ``add_message`` only queues the message; the worker drains the queue in
+    per-session batches (one log write each). ``search_messages`` applies the
+    session's still-pending writes before searching, so a session always sees
+    its own messages. Every database access goes through one lock, which makes
+    the non-thread-safe LocalVectorDB safe to share with the worker.
+
+    Dense vectors are embedded, and their IVF indexes built, by the worker
+    too, a step at a time whenever no writes are waiting, so neither a search
+    nor loading a shard with stale vectors waits for (or fails with) the
+    embedding endpoint. Queries are embedded before taking the lock.
+    """
+
+    BATCH = 256
+    # Dense vectors embedded per step (one embedding request), so a search waits for at most one
+    EMBED_BATCH = 64
+
+    def __init__(self, db: LocalVectorDB):
+        self.db = db
+        db.embed_inline = False  # The worker embeds instead
+        self._db_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending: OrderedDict[str, list[tuple[dict, int]]] = OrderedDict()
+        self._embedding = False  # Resident shards may be missing dense vectors
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="vector-indexer", daemon=True)
+        self._thread.start()
+
+    def add_message(self, session_key: str, msg: dict, msg_idx: int) -> None:
+        """Queue a message for indexing and return immediately."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BackgroundIndexer is closed")
+            self._pending.setdefault(session_key, []).append((msg, msg_idx))
+            self._cond.notify()
+
+    def pending(self, session_key: str | None = None) -> int:
+        """Number of queued, not yet indexed messages (for one session or all)."""
+        with self._cond:
+            if session_key is not None:
+                return len(self._pending.get(session_key, ()))
+            return sum(len(items) for items in self._pending.values())
+
+    def search_messages(self, session_key: str, query: str, top_k: int = 4) -> list[dict]:
+        """Search after applying this session's pending writes (read-your-writes)."""
+        # Embedded before taking the lock: with a remote embedder this is a network call
+        query_embedding = self.db.embed_query(query) if self.db.retrieval != "lexical" else None
+        with self._db_lock:
+            with self._cond:
+                items = self._pending.pop(session_key, None)
+            if items:
+                self._apply(session_key, items)
+            results = self.db.search_messages(session_key, query, top_k=top_k, query_embedding=query_embedding)
+        if self.db.embedder is not None:
+            self._wake_embedding()  # The search may have loaded a shard
+        return results
+
+    def clear_session(self, session_key: str) -> None:
+        """Drop the session's queued writes and everything already indexed for it."""
+        with self._db_lock:
+            with self._cond:
+                self._pending.pop(session_key, None)
+            self.db.clear_session(session_key)
+
+    def flush(self) -> None:
+        """Index everything queued so far."""
+        with self._db_lock:
+            while True:
+                with self._cond:
+                    if not self._pending:
+                        return
+                    session_key, items = self._pending.popitem(last=False)
+                self._apply(session_key, items)
+
+    def close(self) -> None:
+        """Stop the worker, index what is left and close the database."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self.db.close()
+
+    def _wake_embedding(self) -> None:
+        with self._cond:
+            self._embedding = True
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._embedding and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            # Take the batch under the db lock so a search can never miss
+            # writes that were dequeued but not yet applied.
+            with self._db_lock:
+                with self._cond:
+                    batch = self._take_batch() if self._pending else None
+                    if batch is None:
+                        self._embedding = False
+                if batch is not None:
+                    self._apply(*batch)
+                    embedding = self.db.embedder is not None
+                else:
+                    embedding = self._embed_batch()
+            if embedding:
+                self._wake_embedding()
+
+    def _embed_batch(self) -> bool:
+        """Embed one batch of missing dense vectors; returns whether there may be more."""
+        try:
+            return self.db.embed_pending(self.EMBED_BATCH)
+        except Exception as e:
+            logger.error("Failed to embed vector memory documents: {}", e)
+            return False
+
+    def _take_batch(self) -> tuple[str, list[tuple[dict, int]]]:
+        """Pop up to BATCH items of the oldest session; leftovers go to the back (round-robin)."""
+        session_key, items = self._pending.popitem(last=False)
+        if len(items) > self.BATCH:
+            self._pending[session_key] = items[self.BATCH:]
+            items = items[:self.BATCH]
+        return session_key, items
+
+    def _apply(self, session_key: str, items: list[tuple[dict, int]]) -> None:
+        try:
+            self.db.add_messages(session_key, items)
+        except Exception as e:
+            logger.error("Failed to index {} message(s) for {}: {}", len(items), session_key, e)
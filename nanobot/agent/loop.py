@@ -5,9 +5,10 @@ from __future__ import annotations
 import asyncio
 import json
 import re
+from collections import deque
 from contextlib import AsyncExitStack
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Awaitable, Callable
+from typing import TYPE_CHECKING, Awaitable, Callable
 
 from loguru import logger
 
@@ -16,6 +17,7 @@ from nanobot.agent.memory import MemoryStore
 from nanobot.agent.subagent import SubagentManager
 from nanobot.agent.tools.cron import CronTool
 from nanobot.agent.tools.filesystem import EditFileTool, ListDirTool, ReadFileTool, WriteFileTool
+from nanobot.agent.tools.history import SearchHistoryTool
 from nanobot.agent.tools.message import MessageTool
 from nanobot.agent.tools.registry import ToolRegistry
 from nanobot.agent.tools.shell import ExecTool
@@ -25,9 +27,10 @@ from nanobot.bus.events import InboundMessage, OutboundMessage
 from nanobot.bus.queue import MessageBus
 from nanobot.providers.base import LLMProvider
 from nanobot.session.manager import Session, SessionManager
+from nanobot.session.message import Message
 
 if TYPE_CHECKING:
-    from nanobot.config.schema import ChannelsConfig, ExecToolConfig
+    from nanobot.config.schema import ChannelsConfig, ExecToolConfig, VectorMemoryConfig
     from nanobot.cron.service import CronService
 
 
@@ -53,6 +56,7 @@ class AgentLoop:
         temperature: float = 0.1,
         max_tokens: int = 4096,
         memory_window: int = 100,
+        max_concurrent_sessions: int = 4,
         brave_api_key: str | None = None,
         exec_config: ExecToolConfig | None = None,
         cron_service: CronService | None = None,
@@ -60,8 +64,9 @@ class AgentLoop:
         session_manager: SessionManager | None = None,
         mcp_servers: dict | None = None,
         channels_config: ChannelsConfig | None = None,
+        vector_config: VectorMemoryConfig | None = None,
     ):
-        from nanobot.config.schema import ExecToolConfig
+        from nanobot.config.schema import ExecToolConfig, VectorMemoryConfig
         self.bus = bus
         self.channels_config = channels_config
         self.provider = provider
@@ -71,16 +76,20 @@ class AgentLoop:
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.memory_window = memory_window
+        self.max_concurrent_sessions = max(1, max_concurrent_sessions)
         self.brave_api_key = brave_api_key
         self.exec_config = exec_config or ExecToolConfig()
         self.cron_service = cron_service
         self.restrict_to_workspace = restrict_to_workspace
+        self.vector_config = vector_config or VectorMemoryConfig()
 
         self.context = ContextBuilder(workspace)
         self.sessions = session_manager or SessionManager(workspace)
         
         from nanobot.agent.vectordb import LocalVectorDB
-        self.vectordb = LocalVectorDB(workspace)
+        self.vectordb = LocalVectorDB.from_config(workspace, self.vector_config)
+        from nanobot.agent.indexer import BackgroundIndexer
+        self.indexer = BackgroundIndexer(self.vectordb)
         
         self.tools = ToolRegistry()
         self.subagents = SubagentManager(
@@ -96,6 +105,10 @@ class AgentLoop:
         )
 
         self._running = False
+        # Messages consumed for a session that already has a worker (subagent reports)
+        self._session_queues: dict[str, deque[InboundMessage]] = {}
+        self._session_workers: dict[str, asyncio.Task] = {}
+        self._turn_slots = asyncio.Semaphore(self.max_concurrent_sessions)
         self._mcp_servers = mcp_servers or {}
         self._mcp_stack: AsyncExitStack | None = None
         self._mcp_connected = False
@@ -115,6 +128,7 @@ class AgentLoop:
             timeout=self.exec_config.timeout,
             restrict_to_workspace=self.restrict_to_workspace,
         ))
+        self.tools.register(SearchHistoryTool(workspace=self.workspace))
         self.tools.register(WebSearchTool(api_key=self.brave_api_key))
         self.tools.register(WebFetchTool())
         self.tools.register(MessageTool(send_callback=self.bus.publish_outbound))
@@ -190,16 +204,11 @@ class AgentLoop:
         while iteration < self.max_iterations:
             iteration += 1
             
-            # Check for interrupt messages on the bus dynamically
+            # Check for interrupt messages queued for this session dynamically
             if session_key:
-                interruptions = []
-                for q_msg in list(self.bus.inbound._queue):
-                    if getattr(q_msg, 'session_key', f"{q_msg.channel}:{q_msg.chat_id}") == session_key:
-                        interruptions.append(q_msg)
-                        
+                interruptions = self.bus.drain_for_session(session_key)
                 if interruptions:
                     for q_msg in interruptions:
-                        self.bus.inbound._queue.remove(q_msg)
                         if on_progress:
                             await on_progress("Recibí tu nueva indicación. Ajustando mi línea de pensamiento...", tool_hint=False)
                         
@@ -268,34 +277,97 @@ class AgentLoop:
         return final_content, tools_used, messages
 
     async def run(self) -> None:
-        """Run the agent loop, processing messages from the bus."""
+        """
+        Run the agent loop, processing messages from the bus.
+
+        Each session gets a worker, which holds the session on the bus and
+        takes its messages one at a time in the order they arrived, so
+        messages sent during a turn stay on the bus until the turn folds them
+        in or the worker gets to them. Up to
+        ``max_concurrent_sessions`` sessions are processed at once, so a long
+        turn in one chat does not hold up the others.
+        """
         self._running = True
         await self._connect_mcp()
         logger.info("Agent loop started")
 
-        while self._running:
-            try:
-                msg = await asyncio.wait_for(
-                    self.bus.consume_inbound(),
-                    timeout=1.0
-                )
+        try:
+            while self._running:
                 try:
-                    response = await self._process_message(msg)
-                    if response is not None:
-                        await self.bus.publish_outbound(response)
-                    elif msg.channel == "cli":
-                        await self.bus.publish_outbound(OutboundMessage(
-                            channel=msg.channel, chat_id=msg.chat_id, content="", metadata=msg.metadata or {},
-                        ))
-                except Exception as e:
-                    logger.error("Error processing message: {}", e)
-                    await self.bus.publish_outbound(OutboundMessage(
-                        channel=msg.channel,
-                        chat_id=msg.chat_id,
-                        content=f"Sorry, I encountered an error: {str(e)}"
-                    ))
-            except asyncio.TimeoutError:
-                continue
+                    msg = await asyncio.wait_for(
+                        self.bus.consume_inbound(),
+                        timeout=1.0
+                    )
+                except asyncio.TimeoutError:
+                    continue
+                self._dispatch(msg)
+        except asyncio.CancelledError:
+            for task in self._session_workers.values():
+                task.cancel()
+            raise
+        # Stopped: let the turns in progress finish
+        if self._session_workers:
+            await asyncio.gather(*self._session_workers.values(), return_exceptions=True)
+
+    @staticmethod
+    def _routing_key(msg: InboundMessage) -> str:
+        """The session a message is processed in (system messages: the session they report back to)."""
+        if msg.channel == "system":
+            return msg.chat_id if ":" in msg.chat_id else f"cli:{msg.chat_id}"
+        return msg.session_key
+
+    def _dispatch(self, msg: InboundMessage) -> None:
+        """Hand a message to its session's worker, starting one if the session has none."""
+        key = self._routing_key(msg)
+        queue = self._session_queues.get(key)
+        if queue is None:
+            queue = self._session_queues[key] = deque()
+        queue.append(msg)
+        if key not in self._session_workers:
+            # Held from here on, so the session's next messages wait on the bus for the worker
+            self.bus.hold_session(key)
+            self._session_workers[key] = asyncio.create_task(self._session_worker(key, queue))
+
+    async def _session_worker(self, key: str, queue: deque[InboundMessage]) -> None:
+        """Process a session's messages in order, then exit."""
+        try:
+            while self._running:
+                async with self._turn_slots:
+                    msg = self._next_message(key, queue)
+                    if msg is None:  # Nothing left (or all folded into the last turn)
+                        break
+                    await self._handle_message(msg)
+        finally:
+            # No await since the last check, so nothing can have been published in between
+            self.bus.release_session(key)
+            self._session_workers.pop(key, None)
+            if not queue:
+                self._session_queues.pop(key, None)
+
+    def _next_message(self, key: str, queue: deque[InboundMessage]) -> InboundMessage | None:
+        """The session's oldest message, from its worker queue or still on the bus, by arrival."""
+        waiting = self.bus.peek_for_session(key)
+        if queue and (waiting is None or queue[0].arrival < waiting.arrival):
+            return queue.popleft()
+        return self.bus.next_for_session(key)
+
+    async def _handle_message(self, msg: InboundMessage) -> None:
+        """Process one message from the bus and publish the reply."""
+        try:
+            response = await self._process_message(msg)
+            if response is not None:
+                await self.bus.publish_outbound(response)
+            elif msg.channel == "cli":
+                await self.bus.publish_outbound(OutboundMessage(
+                    channel=msg.channel, chat_id=msg.chat_id, content="", metadata=msg.metadata or {},
+                ))
+        except Exception as e:
+            logger.error("Error processing message: {}", e)
+            await self.bus.publish_outbound(OutboundMessage(
+                channel=msg.channel,
+                chat_id=msg.chat_id,
+                content=f"Sorry, I encountered an error: {str(e)}"
+            ))
 
     async def close_mcp(self) -> None:
         """Close MCP connections."""
@@ -306,6 +378,19 @@ class AgentLoop:
                 pass  # MCP SDK cancel scope cleanup is noisy but harmless
             self._mcp_stack = None
 
+    async def close(self) -> None:
+        """Close MCP connections, write unsaved sessions and index any vector memory writes still queued."""
+        await self.close_mcp()
+        await asyncio.to_thread(self.indexer.close)
+        await self.sessions.close()
+        stats = self.sessions.cache_stats()
+        logger.debug("Session cache: {} sessions (~{} KiB), {} hits, {} misses, {} evictions",
+                     stats["sessions"], stats["bytes"] // 1024, stats["hits"], stats["misses"],
+                     stats["evictions"])
+        stats = self.vectordb.cache_stats()
+        logger.debug("Vector memory query cache: {} hits, {} misses ({:.0%} hit rate)",
+                     stats["hits"], stats["misses"], stats["hit_rate"])
+
     def stop(self) -> None:
         """Stop the agent loop."""
         self._running = False
@@ -343,7 +428,7 @@ class AgentLoop:
             recent_texts = {m.get("content", "") for m in recent_history}
             
             past_context = ""
-            raw_vector = self.vectordb.search_messages(key, msg.content, top_k=5)
+            raw_vector = await asyncio.to_thread(self.indexer.search_messages, key, msg.content, 5)
             for vm in raw_vector:
                 clean_content = vm.get("content", "").replace("[From Past Context]: ", "")
                 if not any(clean_content in t for t in recent_texts):
@@ -362,10 +447,10 @@ class AgentLoop:
             final_content, _, all_msgs = await self._run_agent_loop(messages, session_key=key)
             
             from datetime import datetime
-            pure_user_msg = {"role": "user", "content": msg.content, "timestamp": datetime.now().isoformat()}
+            pure_user_msg = Message("user", msg.content, timestamp=datetime.now())
             start_idx = len(session.messages)
             session.messages.append(pure_user_msg)
-            self.vectordb.add_message(session.key, pure_user_msg, start_idx)
+            self.indexer.add_message(session.key, pure_user_msg, start_idx)
             
             self._save_turn(session, all_msgs, 2 + len(history))
             self.sessions.save(session)
@@ -407,6 +492,7 @@ class AgentLoop:
             session.clear()
             self.sessions.save(session)
             self.sessions.invalidate(session.key)
+            await asyncio.to_thread(self.indexer.clear_session, session.key)
             return OutboundMessage(channel=msg.channel, chat_id=msg.chat_id,
                                   content="New session started.")
         if cmd == "/help":
@@ -422,6 +508,9 @@ class AgentLoop:
                 try:
                     async with lock:
                         await self._consolidate_memory(session)
+                    # Persist last_consolidated now: the session may be evicted from the
+                    # cache before the next turn saves it
+                    self.sessions.save(session)
                 finally:
                     self._consolidating.discard(session.key)
                     self._prune_consolidation_lock(session.key, lock)
@@ -441,7 +530,7 @@ class AgentLoop:
         recent_texts = {m.get("content", "") for m in recent_history}
         
         past_context = ""
-        raw_vector = self.vectordb.search_messages(session.key, msg.content, top_k=5)
+        raw_vector = await asyncio.to_thread(self.indexer.search_messages, session.key, msg.content, 5)
         for vm in raw_vector:
             clean_content = vm.get("content", "").replace("[From Past Context]: ", "")
             # Basic dedup to prevent duplicating immediate history
@@ -480,12 +569,12 @@ class AgentLoop:
         logger.info("Response to {}:{}: {}", msg.channel, msg.sender_id, preview)
         
         from datetime import datetime
-        pure_user_msg = {"role": "user", "content": msg.content, "timestamp": datetime.now().isoformat()}
+        pure_user_msg = Message("user", msg.content, timestamp=datetime.now())
         if msg.media:
             pure_user_msg["media"] = msg.media
         start_idx = len(session.messages)
         session.messages.append(pure_user_msg)
-        self.vectordb.add_message(session.key, pure_user_msg, start_idx)
+        self.indexer.add_message(session.key, pure_user_msg, start_idx)
 
         self._save_turn(session, all_msgs, 2 + len(history))
         self.sessions.save(session)
@@ -500,22 +589,24 @@ class AgentLoop:
         )
 
     _TOOL_RESULT_MAX_CHARS = 500
+    # Keys of a turn's messages that are not kept in the session
+    _UNSAVED_KEYS = ("reasoning_content", "is_from_vector")
 
     def _save_turn(self, session: Session, messages: list[dict], skip: int) -> None:
         """Save new-turn messages into session, truncating large tool results."""
         from datetime import datetime
         start_idx = len(session.messages)
         for i, m in enumerate(messages[skip:]):
-            entry = {k: v for k, v in m.items() if k != "reasoning_content" and k != "is_from_vector"}
-            if entry.get("role") == "tool" and isinstance(entry.get("content"), str):
-                content = entry["content"]
+            entry = Message.from_dict(m, skip=self._UNSAVED_KEYS)
+            if entry.role == "tool" and isinstance(entry.content, str):
+                content = entry.content
                 if len(content) > self._TOOL_RESULT_MAX_CHARS:
-                    entry["content"] = content[:self._TOOL_RESULT_MAX_CHARS] + "\n... (truncated)"
-            entry.setdefault("timestamp", datetime.now().isoformat())
+                    entry.content = content[:self._TOOL_RESULT_MAX_CHARS] + "\n... (truncated)"
+            entry.setdefault("timestamp", datetime.now())
             session.messages.append(entry)
             
-            # Store in vector database
-            self.vectordb.add_message(session.key, entry, start_idx + i)
+            # Queued for the background vector indexer
+            self.indexer.add_message(session.key, entry, start_idx + i)
             
         session.updated_at = datetime.now()
 
@@ -0,0 +1,136 @@
+"""Offline rebuild of vector memory from the saved sessions."""
+
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+from nanobot.agent.vectordb import LocalVectorDB, message_documents
+from nanobot.session.base import SessionStorage
+from nanobot.session.manager import open_storage
+
+
+@dataclass
+class ReindexReport:
+    sessions: int = 0  # Sessions rebuilt in this run
+    skipped: int = 0  # Unchanged since an earlier (possibly interrupted) run
+    failed: list[str] = field(default_factory=list)
+    messages: int = 0
+    documents: int = 0
+
+
+# Session storage opened by a worker process, reused for every session it tokenizes
+_storage: SessionStorage | None = None
+
+
+def _tokenize_session(workspace: str, backend: str, key: str) -> tuple[int, list]:
+    """Worker: stream one session's messages and tokenize them into vector documents."""
+    global _storage
+    if _storage is None:
+        _storage = open_storage(Path(workspace), backend)
+    seen = 0
+
+    def numbered():
+        nonlocal seen
+        for seen, msg in enumerate(_storage.iter_messages(key), 1):  # Archived history included
+            yield msg, seen - 1
+
+    docs = message_documents(numbered())
+    return seen, docs
+
+
+class Reindexer:
+    """Rebuilds ``vector_memory`` from the saved sessions.
+
+    Sessions are loaded and tokenized in a process pool; the main process
+    writes each session's shard in one pass as results arrive. Progress is kept
+    in ``vector_memory/reindex.json`` (one entry per finished session, with the
+    storage stamp it had, e.g. file size and mtime), so an interrupted run
+    picks up where it stopped and a later run only redoes sessions that changed.
+    """
+
+    def __init__(self, workspace: Path, db: LocalVectorDB, workers: int | None = None,
+                 backend: str = "jsonl"):
+        self.workspace = workspace
+        self.db = db
+        self.backend = backend
+        self.storage = open_storage(workspace, backend)
+        self.workers = workers or os.cpu_count() or 1
+        self.state_file = db.db_path / "reindex.json"
+
+    def _load_state(self) -> dict[str, dict]:
+        try:
+            return json.loads(self.state_file.read_text(encoding="utf-8")).get("sessions", {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("Ignoring unreadable reindex progress file: {}", e)
+            return {}
+
+    def _save_state(self, sessions: dict[str, dict]) -> None:
+        tmp = self.state_file.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"sessions": sessions}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.state_file)
+
+    def pending(self, restart: bool = False) -> tuple[list[str], list[str], dict[str, dict], dict[str, dict]]:
+        """(sessions still to rebuild, sessions up to date, progress recorded so far, current stamps)."""
+        sessions = {} if restart else self._load_state()
+        stamps = self.storage.stamps()
+        todo, current = [], []
+        for key in sorted(stamps):
+            done = sessions.get(key)
+            if done is None or done.get("stamp") != stamps[key]:
+                todo.append(key)
+            else:
+                current.append(key)
+        return todo, current, sessions, stamps
+
+    def run(self, restart: bool = False,
+            progress: Callable[[str, int, int], None] | None = None) -> ReindexReport:
+        """Rebuild every pending session; ``progress(key, done, total)`` is called after each one."""
+        todo, current, sessions, stamps = self.pending(restart)
+        report = ReindexReport(skipped=len(current))
+        if restart:
+            self._save_state(sessions)
+        if not todo:
+            return report
+        queue = iter(todo)
+        in_flight: dict[Future, str] = {}
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            def submit() -> None:
+                key = next(queue, None)
+                if key is not None:
+                    in_flight[pool.submit(_tokenize_session, str(self.workspace), self.backend, key)] = key
+
+            # A few sessions per worker in flight: the pool stays busy without tokenized
+            # sessions piling up in memory faster than shards are written.
+            for _ in range(self.workers * 2):
+                submit()
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = in_flight.pop(future)
+                    submit()
+                    try:
+                        n_messages, docs = future.result()
+                        kept = self.db.rebuild_session(key, docs)
+                    except Exception as e:
+                        logger.error("Failed to reindex {}: {}", key, e)
+                        report.failed.append(key)
+                    else:
+                        sessions[key] = {"stamp": stamps[key], "documents": kept}
+                        self._save_state(sessions)
+                        report.sessions += 1
+                        report.messages += n_messages
+                        report.documents += kept
+                    done += 1
+                    if progress is not None:
+                        progress(key, done, len(todo))
+        return report
@@ -0,0 +1,71 @@
+"""History search tool."""
+
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any
+
+from nanobot.agent.history import HistoryIndex
+from nanobot.agent.tools.base import Tool
+
+# Longest entry text returned per hit
+MAX_ENTRY_CHARS = 2000
+
+
+class SearchHistoryTool(Tool):
+    """Search the consolidated event log in memory/HISTORY.md."""
+
+    def __init__(self, workspace: Path):
+        self.index = HistoryIndex(workspace / "memory" / "HISTORY.md")
+        self._lock = threading.Lock()  # Searches run in worker threads and update the index
+
+    @property
+    def name(self) -> str:
+        return "search_history"
+
+    @property
+    def description(self) -> str:
+        return (
+            "Search your history log (memory/HISTORY.md) of past conversations and events. "
+            "Returns the best-matching entries with their [YYYY-MM-DD HH:MM] timestamps. "
+            "Leave query empty to list the most recent entries in a date range."
+        )
+
+    @property
+    def parameters(self) -> dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Keywords to search for"},
+                "since": {"type": "string", "description": "Only entries at or after this date (YYYY-MM-DD or YYYY-MM-DD HH:MM)"},
+                "until": {"type": "string", "description": "Only entries at or before this date (YYYY-MM-DD or YYYY-MM-DD HH:MM)"},
+                "limit": {"type": "integer", "description": "Entries to return (1-20)", "minimum": 1, "maximum": 20},
+            },
+        }
+
+    def _search(self, query: str, since: str | None, until: str | None, limit: int):
+        with self._lock:
+            return self.index.search(query, since=since, until=until, limit=limit)
+
+    async def execute(
+        self,
+        query: str = "",
+        since: str | None = None,
+        until: str | None = None,
+        limit: int = 5,
+        **kwargs: Any,
+    ) -> str:
+        try:
+            # Reading and indexing what was appended to HISTORY.md is file I/O: keep it off the event loop
+            hits, total = await asyncio.to_thread(self._search, query, since, until, limit)
+        except ValueError as e:
+            return f"Error: {e}"
+        if not hits:
+            return "No matching history entries."
+        lines = [f"{len(hits)} of {total} matching entries:" if total > len(hits) else f"{total} matching entries:"]
+        for hit in hits:
+            text = hit.text
+            if len(text) > MAX_ENTRY_CHARS:
+                text = text[:MAX_ENTRY_CHARS] + "... (truncated)"
+            lines.append(text)
+        return "\n\n".join(lines)
@@ -1,118 +1,1683 @@
 import os
 import re
+import heapq
 import json
 import math
+import mmap
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import chain
 from pathlib import Path
+from typing import TYPE_CHECKING
+
 from loguru import logger
 
+from nanobot.agent.embeddings import DenseStore, EmbeddingBackend
+from nanobot.utils.helpers import ensure_dir, safe_filename
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure-Python scorer is always available
+    np = None
+
+if TYPE_CHECKING:
+    from nanobot.config.schema import VectorMemoryConfig
+
+
+RANKING_MODES = ("tfidf", "bm25")
+BACKENDS = ("auto", "python", "numpy")
+RETRIEVAL_MODES = ("lexical", "dense", "hybrid")
+
+# Reciprocal rank fusion constant for hybrid retrieval
+RRF_K = 60
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Marker AgentLoop puts on retrieved messages; text carrying it is an echo, not new content
+PAST_CONTEXT_MARKER = "[From Past Context]"
+
+
+@dataclass
+class RetentionPolicy:
+    """What vector memory keeps per session (zero disables a limit)."""
+
+    max_documents: int = 0
+    max_age_days: float = 0
+    tool_max_age_days: float = 0
+    collapse_duplicates: bool = False  # A new message replaces an older one with the same terms
+    dead_ratio: float = 0.3  # Rewrite a shard once this share of its documents is dead
+
+
+def _log_tf(tf: int) -> float:
+    return 1.0 + math.log(tf)
+
+
+def _tokenize(text: str) -> dict:
+    """Simple tokenization and frequency count for TF vectors."""
+    words = re.findall(r'\w+', text.lower())
+    freq = {}
+    for w in words:
+        if len(w) > 2:  # ignore extremely short stop words roughly
+            freq[w] = freq.get(w, 0) + 1
+    return freq
+
+
+def _position(doc_id: str) -> int:
+    """Message index encoded in a document id ("<session key>_<index>")."""
+    return int(doc_id.rsplit("_", 1)[-1])
+
+
+def _message_time(msg: dict) -> float:
+    """Epoch seconds of a session message's ``timestamp``, or now if it has none."""
+    try:
+        return datetime.fromisoformat(msg["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+def message_documents(items) -> list[tuple[int, str, str, dict, float]]:
+    """``(position, role, content, vector, timestamp)`` documents for ``(message, index)`` pairs.
+
+    Messages without text, and retrieved context repeated back (which is not
+    new information), are skipped.
+    """
+    docs = []
+    for msg, msg_idx in items:
+        if not msg.get("content") or not isinstance(msg["content"], str):
+            continue
+        content = msg["content"].strip()
+        if not content or PAST_CONTEXT_MARKER in content:
+            continue
+        vector = _tokenize(content)
+        if not vector:
+            continue
+        docs.append((msg_idx, msg.get("role", "user"), content, vector, _message_time(msg)))
+    return docs
+
+
+class _SessionIndex:
+    """Inverted index over one session's documents: a mapped snapshot plus newer documents.
+
+    Terms have integer ids; ids below ``n_base_terms`` come from the snapshot,
+    later ones are listed in ``new_terms``. Document ``slot`` has message index
+    ``positions[slot]``. Slots below ``n_base`` live in the snapshot (``base``),
+    whose vocabulary, contents, vectors and postings are read lazily from the
+    mapping; documents indexed since then are kept in RAM. A term's postings
+    are its snapshot row followed by ``new_postings[term_id]``, and their
+    length is its document frequency, so corpus statistics stay current
+    without a separate pass. The small per-document columns (positions, times,
+    norms, lengths, roles, dead flags) are always in RAM.
+
+    Removed documents are only flagged in ``dead`` (and skipped when ranking);
+    they keep counting in corpus statistics until the shard is rewritten.
+    """
+
+    def __init__(self, base: "_MappedSnapshot | None" = None):
+        self.base = base
+        self.n_base = base.count if base is not None else 0
+        self.n_base_terms = base.n_terms if base is not None else 0
+        self.vocab: dict[str, int] = {}  # New terms, and snapshot terms already looked up
+        self.new_terms: list[str] = []
+        if base is not None:
+            self.positions = base.array("positions", "I")
+            self.times = base.array("times", "d")
+            self.norms = base.array("norms", "d")  # Norm of the log-tf document vector
+            self.lengths = base.array("lengths", "I")  # Token count, for BM25
+            self.role_codes = base.array("role_codes", "B")
+            self.role_table = base.strings("roles")
+            self.dead = bytearray(base.raw("dead"))
+            self.total_length = base.total_length
+        else:
+            self.positions = array("I")
+            self.times = array("d")
+            self.norms = array("d")
+            self.lengths = array("I")
+            self.role_codes = array("B")
+            self.role_table: list[str] = []
+            self.dead = bytearray()
+            self.total_length = 0
+        self._role_ids = {role: i for i, role in enumerate(self.role_table)}
+        self.n_dead = self.dead.count(1)
+        self.head = 0  # Every slot before ``head`` is dead
+        while self.head < len(self.dead) and self.dead[self.head]:
+            self.head += 1
+        # Documents indexed since the snapshot
+        self.new_contents: list[str] = []
+        self.vec_start = array("Q", [0])
+        self.vec_terms = array("I")
+        self.vec_tfs = array("I")
+        self.new_postings: dict[int, tuple[array, array]] = {}  # term id -> (slots, tfs)
+        self.new_slots: dict[int, int] = {}  # message index -> slot
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def live(self) -> int:
+        return len(self.positions) - self.n_dead
+
+    @property
+    def n_terms(self) -> int:
+        return self.n_base_terms + len(self.new_terms)
+
+    def term_id(self, term: str) -> int | None:
+        term_id = self.vocab.get(term)
+        if term_id is None and self.base is not None:
+            term_id = self.base.find_term(term)
+            if term_id is not None:
+                self.vocab[term] = term_id
+        return term_id
+
+    def term(self, term_id: int) -> str:
+        if term_id < self.n_base_terms:
+            return self.base.term(term_id)
+        return self.new_terms[term_id - self.n_base_terms]
+
+    def slot_of(self, position: int) -> int | None:
+        """Slot of the live document for a message index, if any."""
+        slot = self.new_slots.get(position)
+        if slot is None and self.base is not None:
+            slot = self.base.find_position(position)
+        if slot is None or self.dead[slot]:
+            return None
+        return slot
+
+    def live_positions(self) -> list[int]:
+        return [self.positions[slot] for slot in range(len(self)) if not self.dead[slot]]
+
+    def role(self, slot: int) -> str:
+        return self.role_table[self.role_codes[slot]]
+
+    def content(self, slot: int) -> str:
+        if slot < self.n_base:
+            return self.base.content(slot)
+        return self.new_contents[slot - self.n_base]
+
+    @property
+    def contents(self) -> "_Contents":
+        return _Contents(self)
+
+    def add(self, position: int, role: str, content: str, vector: dict | None = None,
+            timestamp: float = 0.0) -> bool:
+        """Index a document; returns False if its message index is already present."""
+        if self.slot_of(position) is not None:
+            return False
+        if vector is None:
+            vector = _tokenize(content)
+        role_id = self._role_ids.get(role)
+        if role_id is None:
+            role_id = self._role_ids[role] = len(self.role_table)
+            self.role_table.append(role)
+        slot = len(self.positions)
+        self.new_slots[position] = slot
+        self.positions.append(position)
+        self.role_codes.append(role_id)
+        self.new_contents.append(content)
+        self.times.append(timestamp)
+        self.dead.append(0)
+        norm_sq = 0.0
+        for term, tf in vector.items():
+            term_id = self.term_id(term)
+            if term_id is None:
+                term_id = self.vocab[term] = self.n_terms
+                self.new_terms.append(term)
+            self.vec_terms.append(term_id)
+            self.vec_tfs.append(tf)
+            postings = self.new_postings.get(term_id)
+            if postings is None:
+                postings = self.new_postings[term_id] = (array("I"), array("I"))
+            postings[0].append(slot)
+            postings[1].append(tf)
+            norm_sq += _log_tf(tf) ** 2
+        self.vec_start.append(len(self.vec_terms))
+        length = sum(vector.values())
+        self.norms.append(math.sqrt(norm_sq))
+        self.lengths.append(length)
+        self.total_length += length
+        return True
+
+    def remove(self, position: int) -> bool:
+        """Mark the document for a message index dead; returns False if there is none."""
+        slot = self.slot_of(position)
+        if slot is None:
+            return False
+        self.new_slots.pop(position, None)
+        self.kill(slot)
+        return True
+
+    def kill(self, slot: int) -> None:
+        """Mark a slot dead (it must be live)."""
+        self.dead[slot] = 1
+        self.n_dead += 1
+        while self.head < len(self.dead) and self.dead[self.head]:
+            self.head += 1
+
+    def vector_ids(self, slot: int):
+        """(term ids, counts) of a document's vector."""
+        if slot < self.n_base:
+            return self.base.vector_ids(slot)
+        lo, hi = self.vec_start[slot - self.n_base], self.vec_start[slot - self.n_base + 1]
+        return self.vec_terms[lo:hi], self.vec_tfs[lo:hi]
+
+    def vector(self, slot: int) -> dict[str, int]:
+        term_ids, tfs = self.vector_ids(slot)
+        return {self.term(t): tf for t, tf in zip(term_ids, tfs)}
+
+    def document(self, slot: int, key: str) -> dict:
+        return {
+            "id": f"{key}_{self.positions[slot]}",
+            "session": key,
+            "role": self.role(slot),
+            "content": self.content(slot),
+            "vector": self.vector(slot),
+            "timestamp": self.times[slot],
+        }
+
+    def postings(self, term_id: int):
+        """(slot, count) pairs of a term, in slot order."""
+        new = self.new_postings.get(term_id)
+        if term_id >= self.n_base_terms:
+            return zip(*new) if new else iter(())
+        base = zip(*self.base.postings(term_id))
+        return chain(base, zip(*new)) if new else base
+
+    def df(self, term_id: int) -> int:
+        new = self.new_postings.get(term_id)
+        df = len(new[0]) if new else 0
+        if term_id < self.n_base_terms:
+            df += self.base.df(term_id)
+        return df
+
+    def idf(self, term_id: int) -> float:
+        """Smoothed inverse document frequency (never negative)."""
+        return math.log((len(self) + 1) / (self.df(term_id) + 1)) + 1.0
+
+    def score_tfidf(self, query_vec: dict) -> dict[int, float]:
+        """Cosine between log-tf document vectors and the tf-idf weighted query (lnc.ltc)."""
+        weights = {}
+        for term, tf in query_vec.items():
+            term_id = self.term_id(term)
+            if term_id is not None:
+                weights[term_id] = _log_tf(tf) * self.idf(term_id)
+        query_norm = math.sqrt(sum(w * w for w in weights.values()))
+        scores: dict[int, float] = {}
+        for term_id, q_w in weights.items():
+            for slot, d_tf in self.postings(term_id):
+                scores[slot] = scores.get(slot, 0.0) + q_w * _log_tf(d_tf)
+        for slot in scores:
+            scores[slot] /= query_norm * self.norms[slot]
+        return scores
+
+    def score_bm25(self, query_vec: dict) -> dict[int, float]:
+        """Okapi BM25 over the postings of the query terms."""
+        n = len(self)
+        avg_length = self.total_length / n if n else 0.0
+        scores: dict[int, float] = {}
+        for term in query_vec:
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            df = self.df(term_id)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for slot, d_tf in self.postings(term_id):
+                denom = d_tf + BM25_K1 * (1.0 - BM25_B + BM25_B * self.lengths[slot] / avg_length)
+                scores[slot] = scores.get(slot, 0.0) + idf * d_tf * (BM25_K1 + 1.0) / denom
+        return scores
+
+
+class _Contents:
+    """Read-only sequence view of an index's document texts (for dense embedding sync)."""
+
+    def __init__(self, index: _SessionIndex):
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._index.content(slot) for slot in range(*item.indices(len(self)))]
+        return self._index.content(item)
+
+
+class _NumpyPostings:
+    """Term-major CSR postings for vectorized scoring.
+
+    Row ``t`` holds term ``t``'s postings for the first ``count`` documents:
+    slots in ``indices[indptr[t]:indptr[t + 1]]`` and counts in ``tfs``. A query
+    is scored as one sparse mat-vec: the selected rows are scaled by the query
+    weights and summed per slot with ``bincount``. When nothing was indexed
+    since the snapshot, the matrix is the snapshot's own postings, used in
+    place from the mapping. Documents added after the matrix was built are
+    read from the in-RAM postings directly, so the matrix only has to be
+    rebuilt once that tail grows large.
+
+    Per slot, contributions are added in query-term order with the same float64
+    operations as ``_SessionIndex``, so scores (and rankings) are identical to
+    the pure-Python scorer.
+    """
+
+    def __init__(self, index: _SessionIndex):
+        self.count = len(index)
+        base = index.base
+        if base is not None:
+            indptr = np.frombuffer(base.view("post_start", "Q"), dtype=np.uint64).astype(np.int64)
+            indices = np.frombuffer(base.view("post_slots", "I"), dtype=np.uint32)
+            tfs = np.frombuffer(base.view("post_tfs", "I"), dtype=np.uint32)
+        else:
+            indptr = np.zeros(1, dtype=np.int64)
+            indices = tfs = np.empty(0, dtype=np.uint32)
+        if not index.new_postings:
+            self.n_terms = index.n_base_terms
+            self.indptr, self.indices, self.tfs = indptr, indices, tfs
+        else:
+            # Merge snapshot and newer postings; a stable sort by term keeps each row in slot order
+            self.n_terms = index.n_terms
+            new_ids = list(index.new_postings)
+            new_dfs = np.fromiter((len(index.new_postings[t][0]) for t in new_ids), dtype=np.int64, count=len(new_ids))
+            rows = np.concatenate([
+                np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr)),
+                np.repeat(np.array(new_ids, dtype=np.int64), new_dfs),
+            ])
+            order = np.argsort(rows, kind="stable")
+            self.indices = np.concatenate(
+                [indices, *(np.frombuffer(index.new_postings[t][0], dtype=np.uint32) for t in new_ids)]
+            )[order]
+            self.tfs = np.concatenate(
+                [tfs, *(np.frombuffer(index.new_postings[t][1], dtype=np.uint32) for t in new_ids)]
+            )[order]
+            self.indptr = np.zeros(self.n_terms + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=self.n_terms), out=self.indptr[1:])
+        self.norms = np.frombuffer(index.norms.tobytes(), dtype=np.float64)
+        self.lengths = np.frombuffer(index.lengths.tobytes(), dtype=np.uint32).astype(np.float64)
+        self._log_tf_table = np.zeros(1)
+
+    def _log_tf(self, tfs: np.ndarray) -> np.ndarray:
+        """log-tf weights through the same math.log calls the pure-Python path makes."""
+        max_tf = int(tfs.max(initial=0))
+        if max_tf >= len(self._log_tf_table):
+            self._log_tf_table = np.array([0.0] + [_log_tf(tf) for tf in range(1, max_tf + 1)])
+        return self._log_tf_table[tfs]
+
+    def stale(self, index: _SessionIndex) -> bool:
+        """Whether enough documents were added since the build to warrant a rebuild."""
+        return len(index) - self.count > max(1024, self.count // 10)
+
+    def _postings(self, index: _SessionIndex, term_id: int):
+        """(slots, tfs) for a term: the CSR row plus anything added since the build."""
+        if term_id < self.n_terms:
+            lo, hi = self.indptr[term_id], self.indptr[term_id + 1]
+            slots, tfs = self.indices[lo:hi], self.tfs[lo:hi]
+        else:
+            slots = tfs = np.empty(0, dtype=np.uint32)
+        new = index.new_postings.get(term_id)
+        if new is not None:
+            start = bisect_left(new[0], self.count)
+            if start < len(new[0]):
+                slots = np.concatenate([slots, np.array(new[0][start:], dtype=np.uint32)])
+                tfs = np.concatenate([tfs, np.array(new[1][start:], dtype=np.uint32)])
+        return slots, tfs
+
+    def _per_doc(self, index: _SessionIndex, attr: str, values: np.ndarray) -> np.ndarray:
+        if len(index) > self.count:
+            tail = getattr(index, attr)[self.count:]
+            values = np.concatenate([values, np.array(tail, dtype=np.float64)])
+        return values
+
+    def score_tfidf(self, index: _SessionIndex, query_vec: dict) -> np.ndarray:
+        weights = {}
+        for term, tf in query_vec.items():
+            term_id = index.term_id(term)
+            if term_id is not None:
+                weights[term_id] = _log_tf(tf) * index.idf(term_id)
+        query_norm = math.sqrt(sum(w * w for w in weights.values()))
+        all_slots, all_weights = [], []
+        for term_id, q_w in weights.items():
+            slots, tfs = self._postings(index, term_id)
+            all_slots.append(slots)
+            all_weights.append(q_w * self._log_tf(tfs))
+        scores = self._accumulate(index, all_slots, all_weights)
+        denom = query_norm * self._per_doc(index, "norms", self.norms)
+        return np.divide(scores, denom, out=np.zeros_like(scores), where=scores != 0)
+
+    def score_bm25(self, index: _SessionIndex, query_vec: dict) -> np.ndarray:
+        n = len(index)
+        avg_length = index.total_length / n if n else 0.0
+        lengths = self._per_doc(index, "lengths", self.lengths)
+        all_slots, all_weights = [], []
+        for term in query_vec:
+            term_id = index.term_id(term)
+            if term_id is None:
+                continue
+            df = index.df(term_id)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            slots, tfs = self._postings(index, term_id)
+            d_tf = tfs.astype(np.float64)
+            denom = d_tf + BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[slots] / avg_length)
+            all_slots.append(slots)
+            all_weights.append(idf * d_tf * (BM25_K1 + 1.0) / denom)
+        return self._accumulate(index, all_slots, all_weights)
+
+    @staticmethod
+    def _accumulate(index: _SessionIndex, slots: list, weights: list) -> np.ndarray:
+        if not slots:
+            return np.zeros(len(index))
+        return np.bincount(np.concatenate(slots), weights=np.concatenate(weights), minlength=len(index))
+
+
+def _top_k_numpy(scores: np.ndarray, min_score: float, top_k: int) -> list[int]:
+    """Slots of the ``top_k`` best scores above ``min_score``, earlier slots first on ties."""
+    if top_k <= 0:
+        return []
+    candidates = np.flatnonzero(scores > min_score)
+    if len(candidates) > top_k:
+        kth = np.partition(scores[candidates], len(candidates) - top_k)[len(candidates) - top_k]
+        candidates = candidates[scores[candidates] >= kth]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return [int(slot) for slot in candidates[order[:top_k]]]
+
+
+# Shard snapshot (version 3): a header, a table of (offset, size) per section,
+# then the sections themselves, 8-byte aligned and little-endian. Strings are
+# a UTF-8 blob plus an offsets section; postings are term-major CSR
+# (``post_start`` per term). The file is mapped rather than parsed, so only
+# the pages a query touches are read, and they are shared through the page cache.
+_SNAPSHOT_MAGIC = b"NBVEC"
+_SNAPSHOT_VERSION = 3
+# magic, version, seq, document count, epoch, term count, total token count
+_SNAPSHOT_HEADER = struct.Struct("<5sHQIIIQ")
+_SNAPSHOT_SECTIONS = (
+    "key",
+    "terms", "terms_offsets", "term_order",  # Vocabulary by id, and ids sorted by term for lookups
+    "roles", "roles_offsets", "role_codes",
+    "contents", "contents_offsets",
+    "positions", "times", "norms", "lengths", "dead",
+    "vec_start", "vec_terms", "vec_tfs",  # Forward index: each document's term ids and counts
+    "post_start", "post_slots", "post_tfs",
+    "live_positions", "live_slots",  # Live documents sorted by message index
+)
+_SECTION_TABLE = struct.Struct(f"<{2 * len(_SNAPSHOT_SECTIONS)}Q")
+
+# Legacy (versions 1-2): length-prefixed arrays, parsed into RAM on load.
+_LEGACY_HEADER_V2 = struct.Struct("<5sHQII")  # magic, version, seq, document count, epoch
+_LEGACY_HEADER_V1 = struct.Struct("<5sHQI")  # No timestamps, dead flags, key or epoch
+
+
+def _le_bytes(data) -> bytes:
+    """Little-endian bytes of an array or array-like slice."""
+    if sys.byteorder == "big" and getattr(data, "itemsize", 1) > 1:
+        data = array(data.typecode if isinstance(data, array) else data.format, data)
+        data.byteswap()
+    return bytes(data)
+
+
+class _MappedSnapshot:
+    """A version 3 snapshot opened with ``mmap`` (read-only, never parsed as a whole)."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            if os.name == "nt":
+                # Windows cannot replace a file that is mapped, and compaction replaces this one
+                self._buf = f.read()
+            else:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mv = memoryview(self._buf)
+        (magic, version, self.seq, self.count, self.epoch,
+         self.n_terms, self.total_length) = _SNAPSHOT_HEADER.unpack_from(self._mv)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot format in {path.name}")
+        table = _SECTION_TABLE.unpack_from(self._mv, _SNAPSHOT_HEADER.size)
+        self._sections = {
+            name: (table[2 * i], table[2 * i + 1]) for i, name in enumerate(_SNAPSHOT_SECTIONS)
+        }
+        self.key = bytes(self.raw("key")).decode("utf-8")
+        self._terms = self.raw("terms")
+        self._terms_offsets = self.view("terms_offsets", "Q")
+        self._term_order = self.view("term_order", "I")
+        self._contents = self.raw("contents")
+        self._contents_offsets = self.view("contents_offsets", "Q")
+        self._vec_start = self.view("vec_start", "Q")
+        self._vec_terms = self.view("vec_terms", "I")
+        self._vec_tfs = self.view("vec_tfs", "I")
+        self._post_start = self.view("post_start", "Q")
+        self._post_slots = self.view("post_slots", "I")
+        self._post_tfs = self.view("post_tfs", "I")
+        self._live_positions = self.view("live_positions", "I")
+        self._live_slots = self.view("live_slots", "I")
+
+    def raw(self, name: str) -> memoryview:
+        offset, size = self._sections[name]
+        return self._mv[offset:offset + size]
+
+    def view(self, name: str, typecode: str):
+        """A section as a sequence of numbers, without copying on little-endian hosts."""
+        raw = self.raw(name)
+        if sys.byteorder == "little":
+            return raw.cast(typecode)
+        values = array(typecode, raw.tobytes())
+        values.byteswap()
+        return values
+
+    def array(self, name: str, typecode: str) -> array:
+        """A section copied into a growable array."""
+        values = array(typecode)
+        values.frombytes(self.raw(name))
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def strings(self, name: str) -> list[str]:
+        blob, offsets = self.raw(name), self.view(f"{name}_offsets", "Q")
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def term_bytes(self, term_id: int) -> bytes:
+        return bytes(self._terms[self._terms_offsets[term_id]:self._terms_offsets[term_id + 1]])
+
+    def term(self, term_id: int) -> str:
+        return self.term_bytes(term_id).decode("utf-8")
+
+    def find_term(self, term: str) -> int | None:
+        """Binary search of the sorted vocabulary."""
+        key = term.encode("utf-8")
+        order = self._term_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.term_bytes(order[lo]) == key:
+            return order[lo]
+        return None
+
+    def find_position(self, position: int) -> int | None:
+        i = bisect_left(self._live_positions, position)
+        if i < len(self._live_positions) and self._live_positions[i] == position:
+            return self._live_slots[i]
+        return None
+
+    def content(self, slot: int) -> str:
+        lo, hi = self._contents_offsets[slot], self._contents_offsets[slot + 1]
+        return bytes(self._contents[lo:hi]).decode("utf-8")
+
+    def vector_ids(self, slot: int):
+        lo, hi = self._vec_start[slot], self._vec_start[slot + 1]
+        return self._vec_terms[lo:hi], self._vec_tfs[lo:hi]
+
+    def postings(self, term_id: int):
+        lo, hi = self._post_start[term_id], self._post_start[term_id + 1]
+        return self._post_slots[lo:hi], self._post_tfs[lo:hi]
+
+    def df(self, term_id: int) -> int:
+        return self._post_start[term_id + 1] - self._post_start[term_id]
+
+
+class _SectionWriter:
+    """Streams snapshot sections to a file and records where each one landed."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sections: dict[str, tuple[int, int]] = {}
+        self._name: str | None = None
+        self._start = 0
+
+    def begin(self, name: str) -> None:
+        pad = -self.f.tell() % 8
+        if pad:
+            self.f.write(b"\0" * pad)
+        self._name, self._start = name, self.f.tell()
+
+    def write(self, data) -> None:
+        self.f.write(_le_bytes(data))
+
+    def end(self) -> None:
+        self.sections[self._name] = (self._start, self.f.tell() - self._start)
+
+    def section(self, name: str, *chunks) -> None:
+        self.begin(name)
+        for chunk in chunks:
+            self.write(chunk)
+        self.end()
+
+    def strings(self, name: str, strings) -> None:
+        """A string table: UTF-8 blob plus ``<name>_offsets``."""
+        offsets = array("Q", [0])
+        self.begin(name)
+        for s in strings:
+            data = s if isinstance(s, bytes) else s.encode("utf-8")
+            self.f.write(data)
+            offsets.append(offsets[-1] + len(data))
+        self.end()
+        self.section(f"{name}_offsets", offsets)
+
+
+def _write_snapshot(path: Path, index: _SessionIndex, seq: int, count: int,
+                    key: str, epoch: int, dead: bytes) -> None:
+    """Write the first ``count`` documents of ``index``, with ``dead`` as their dead flags.
+
+    Only reads what existed when ``count`` was taken (documents, terms and
+    postings are append-only; the dead flags are copied by the caller), so it
+    is safe to run on a background thread while new documents are being added.
+    """
+    base, n_base, n_base_terms = index.base, index.n_base, index.n_base_terms
+    n_new = count - n_base
+    n_terms = index.n_terms
+    with open(path, "wb") as f:
+        f.write(b"\0" * (_SNAPSHOT_HEADER.size + _SECTION_TABLE.size))
+        out = _SectionWriter(f)
+        out.section("key", key.encode("utf-8"))
+
+        # Vocabulary by id; the snapshot's terms are copied as one block
+        out.begin("terms")
+        terms_offsets = array("Q", [0])
+        if base is not None:
+            out.write(base.raw("terms"))
+            terms_offsets = array("Q", base.view("terms_offsets", "Q"))
+        new_terms = [term.encode("utf-8") for term in index.new_terms[:n_terms - n_base_terms]]
+        for term in new_terms:
+            out.write(term)
+            terms_offsets.append(terms_offsets[-1] + len(term))
+        out.end()
+        out.section("terms_offsets", terms_offsets)
+        new_order = sorted(range(n_base_terms, n_terms), key=lambda t: new_terms[t - n_base_terms])
+        base_order = base.view("term_order", "I") if base is not None else ()
+        out.section("term_order", array("I", heapq.merge(
+            base_order, new_order,
+            key=lambda t: base.term_bytes(t) if t < n_base_terms else new_terms[t - n_base_terms],
+        )))
+
+        out.strings("roles", list(index.role_table))
+        out.section("role_codes", index.role_codes[:count])
+
+        out.begin("contents")
+        contents_offsets = array("Q", [0])
+        if base is not None:
+            out.write(base.raw("contents"))
+            contents_offsets = array("Q", base.view("contents_offsets", "Q"))
+        for content in index.new_contents[:n_new]:
+            data = content.encode("utf-8")
+            out.write(data)
+            contents_offsets.append(contents_offsets[-1] + len(data))
+        out.end()
+        out.section("contents_offsets", contents_offsets)
+
+        out.section("positions", index.positions[:count])
+        out.section("times", index.times[:count])
+        out.section("norms", index.norms[:count])
+        out.section("lengths", index.lengths[:count])
+        out.section("dead", dead)
+
+        base_values = len(base.view("vec_terms", "I")) if base is not None else 0
+        vec_start = array("Q", base.view("vec_start", "Q")) if base is not None else array("Q", [0])
+        vec_start.extend(base_values + v for v in index.vec_start[1:n_new + 1])
+        n_values = index.vec_start[n_new]
+        out.section("vec_start", vec_start)
+        out.section("vec_terms", *([base.raw("vec_terms")] if base is not None else []), index.vec_terms[:n_values])
+        out.section("vec_tfs", *([base.raw("vec_tfs")] if base is not None else []), index.vec_tfs[:n_values])
+
+        # Postings: each term's snapshot row, then its newer postings below ``count``
+        new_df = {}
+        for term_id, (slots, _) in list(index.new_postings.items()):
+            if term_id < n_terms:
+                df = bisect_left(slots, count)
+                if df:
+                    new_df[term_id] = df
+        post_start = array("Q", [0])
+        for term_id in range(n_terms):
+            df = base.df(term_id) if term_id < n_base_terms else 0
+            post_start.append(post_start[-1] + df + new_df.get(term_id, 0))
+        out.section("post_start", post_start)
+        for name, which in (("post_slots", 0), ("post_tfs", 1)):
+            out.begin(name)
+            base_values = base.view(name, "I") if base is not None else ()
+            copied = 0  # Snapshot postings are copied in runs, up to the next term with new ones
+            for term_id in sorted(new_df):
+                upto = base._post_start[min(term_id + 1, n_base_terms)] if base is not None else 0
+                if upto > copied:
+                    out.write(base_values[copied:upto])
+                    copied = upto
+                out.write(index.new_postings[term_id][which][:new_df[term_id]])
+            if len(base_values) > copied:
+                out.write(base_values[copied:])
+            out.end()
+
+        live = sorted((index.positions[slot], slot) for slot in range(count) if not dead[slot])
+        out.section("live_positions", array("I", (position for position, _ in live)))
+        out.section("live_slots", array("I", (slot for _, slot in live)))
+
+        f.seek(0)
+        f.write(_SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, seq, count, epoch,
+            n_terms, sum(index.lengths[:count]),
+        ))
+        f.write(_SECTION_TABLE.pack(*(v for name in _SNAPSHOT_SECTIONS for v in out.sections[name])))
+
+
+def _snapshot_version(path: Path) -> int:
+    with open(path, "rb") as f:
+        magic, version = struct.unpack("<5sH", f.read(7))
+    if magic != _SNAPSHOT_MAGIC:
+        raise ValueError(f"Not a vector memory snapshot: {path.name}")
+    return version
+
+
+def _read_snapshot_key(path: Path) -> str | None:
+    """Session key recorded in a snapshot (None before version 2)."""
+    version = _snapshot_version(path)
+    if version == _SNAPSHOT_VERSION:
+        return _MappedSnapshot(path).key
+    if version == 2:
+        with open(path, "rb") as f:
+            f.seek(_LEGACY_HEADER_V2.size)
+            return _read_strings(f)[0]
+    return None
+
+
+def _open_snapshot(path: Path) -> tuple[_SessionIndex, int, int]:
+    """(index, seq, epoch) over a mapped version 3 snapshot."""
+    base = _MappedSnapshot(path)
+    return _SessionIndex(base), base.seq, base.epoch
+
+
+def _read_array(f) -> array:
+    typecode, count = struct.unpack("<cQ", f.read(9))
+    arr = array(typecode.decode())
+    arr.frombytes(f.read(count * arr.itemsize))
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _read_strings(f) -> list[str]:
+    lengths = _read_array(f)
+    blob = f.read(sum(lengths))
+    out, pos = [], 0
+    for n in lengths:
+        out.append(blob[pos:pos + n].decode("utf-8"))
+        pos += n
+    return out
+
+
+def _read_legacy_snapshot(path: Path) -> tuple[_SessionIndex, int, int]:
+    """(index, seq, epoch) from a version 1 or 2 snapshot, rebuilt in RAM."""
+    with open(path, "rb") as f:
+        magic, version = struct.unpack("<5sH", f.read(7))
+        f.seek(0)
+        if version == 1:
+            _, _, seq, count = _LEGACY_HEADER_V1.unpack(f.read(_LEGACY_HEADER_V1.size))
+            epoch = 0
+        else:
+            _, _, seq, count, epoch = _LEGACY_HEADER_V2.unpack(f.read(_LEGACY_HEADER_V2.size))
+            _read_strings(f)  # key
+        terms = _read_strings(f)
+        role_table = _read_strings(f)
+        role_codes = _read_array(f)
+        contents = _read_strings(f)
+        positions, vec_start, vec_terms, vec_tfs = (_read_array(f) for _ in range(4))
+        if version == 2:
+            times, dead = _read_array(f), _read_array(f)
+        else:
+            # Version 1 kept no timestamps: retention ages these documents from now on
+            times, dead = array("d", [time.time()]) * count, array("B", bytes(count))
+    index = _SessionIndex()
+    for slot in range(count):
+        lo, hi = vec_start[slot], vec_start[slot + 1]
+        vector = {terms[t]: tf for t, tf in zip(vec_terms[lo:hi], vec_tfs[lo:hi])}
+        index.add(positions[slot], role_table[role_codes[slot]], contents[slot], vector, times[slot])
+        if dead[slot]:
+            index.remove(positions[slot])
+    return index, seq, epoch
+
+
+class _Shard:
+    """One session's vector memory on disk and in RAM.
+
+    Files live under ``vector_memory/shards/``: a binary ``<name>.vec`` snapshot
+    of all documents up to ``seq`` and a ``<name>.wal.jsonl`` append-only log of
+    later adds and removals. While a compaction runs, the records it folds in
+    live in ``<name>.wal.jsonl.compacting``. ``rewrite`` drops dead documents
+    for good and bumps ``epoch``, which the dense vector file is checked against.
+    """
+
+    def __init__(self, shards_dir: Path, key: str, compact_every: int,
+                 embedder: EmbeddingBackend | None = None):
+        name = safe_filename(key.replace(":", "_"))
+        self.key = key
+        self.snapshot_file = shards_dir / f"{name}.vec"
+        self.json_snapshot_file = shards_dir / f"{name}.json"  # Format before .vec
+        self.wal_file = shards_dir / f"{name}.wal.jsonl"
+        self.compacting_file = shards_dir / f"{name}.wal.jsonl.compacting"
+        self.compact_every = compact_every
+        self.index = _SessionIndex()
+        self._seq = 0  # Sequence number of the last logged document
+        self._wal_records = 0  # Records appended since the last compaction started
+        self._lock = threading.Lock()
+        self._compactor: threading.Thread | None = None
+        self._compacted: int | None = None  # Document count of a snapshot written but not yet mapped
+        self._wal = None  # Opened on first add, so reading a shard never creates files
+        self._numpy: _NumpyPostings | None = None
+        self._fingerprints: dict[int, int] | None = None  # Built on first use
+        self.epoch = 0
+        self.generation = 0  # Bumped on every change, so cached query results know they are stale
+        # Recent search results: (normalized query, top_k) -> (generation, messages)
+        self.query_cache: OrderedDict[tuple, tuple[int, list[dict]]] = OrderedDict()
+        self.retention_checked_at = 0.0
+        self._load()
+        # Dense vectors for the same slots, in ``<name>.emb`` (only when an embedder is configured)
+        self.dense: DenseStore | None = None
+        if embedder is not None:
+            try:
+                self.dense = DenseStore(shards_dir / f"{name}.emb", embedder, self.epoch)
+            except Exception as e:
+                logger.error(f"Dense vectors unavailable for {key}: {e}")
+                self.dense = None
+
+    def numpy_postings(self) -> "_NumpyPostings":
+        if self._numpy is None or self._numpy.stale(self.index):
+            self._numpy = _NumpyPostings(self.index)
+        return self._numpy
+
+    @property
+    def exists(self) -> bool:
+        return any(p.exists() for p in (
+            self.snapshot_file, self.json_snapshot_file, self.wal_file, self.compacting_file,
+        ))
+
+    def _load(self):
+        snapshot_seq = 0
+        try:
+            if self.snapshot_file.exists() and _snapshot_version(self.snapshot_file) == _SNAPSHOT_VERSION:
+                self.index, snapshot_seq, self.epoch = _open_snapshot(self.snapshot_file)
+            elif self.snapshot_file.exists():
+                # Older binary format: parsed into RAM once, then rewritten in the mapped format
+                self.index, snapshot_seq, self.epoch = _read_legacy_snapshot(self.snapshot_file)
+                self._compact(len(self.index), snapshot_seq, bytes(self.index.dead))
+                self.adopt_snapshot()
+            elif self.json_snapshot_file.exists():
+                with open(self.json_snapshot_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                now = time.time()
+                for doc in data.get("documents", []):
+                    self.index.add(_position(doc["id"]), doc.get("role", "user"), doc["content"], doc.get("vector"), now)
+                snapshot_seq = data.get("seq", 0)
+                self._compact(len(self.index), snapshot_seq, bytes(len(self.index)))
+                self.json_snapshot_file.unlink(missing_ok=True)
+                self.adopt_snapshot()
+        except Exception as e:
+            logger.warning(f"Failed to load Vector DB shard {self.key}: {e}")
+            self.index = _SessionIndex()
+        self._seq = snapshot_seq
+        if self.compacting_file.exists():
+            # A compaction was interrupted: finish folding its records in before going on.
+            self._replay(self.compacting_file, snapshot_seq)
+            self._compact(len(self.index), self._seq, bytes(self.index.dead))
+            self.adopt_snapshot()
+            snapshot_seq = self._seq
+        self._wal_records = self._replay(self.wal_file, snapshot_seq)
+
+    def _replay(self, path: Path, after_seq: int) -> int:
+        """Apply logged adds and removals newer than the snapshot; a torn last line is ignored."""
+        replayed = 0
+        if not path.exists():
+            return replayed
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["seq"] <= after_seq:
+                    continue
+                if "drop" in record:
+                    for position in record["drop"]:
+                        self.index.remove(position)
+                else:
+                    doc = record["doc"]
+                    self.index.add(
+                        _position(doc["id"]), doc.get("role", "user"), doc["content"], doc.get("vector"),
+                        doc.get("ts") or time.time(),
+                    )
+                self._seq = max(self._seq, record["seq"])
+                replayed += 1
+        return replayed
+
+    def _open_wal(self):
+        wal = open(self.wal_file, "a", encoding="utf-8")
+        if wal.tell() > 0:
+            with open(self.wal_file, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    wal.write("\n")  # Terminate a torn record so the next one starts cleanly
+        return wal
+
+    def add(self, position: int, role: str, content: str, vector: dict | None = None,
+            timestamp: float = 0.0) -> bool:
+        return self.add_many([(position, role, content, vector, timestamp)]) == 1
+
+    def fingerprints(self) -> dict[int, int]:
+        """Term-set hash -> slot of the latest live document with those terms."""
+        if self._fingerprints is None:
+            index = self.index
+            self._fingerprints = {
+                hash(frozenset(index.vector_ids(slot)[0])): slot
+                for slot in range(len(index)) if not index.dead[slot]
+            }
+        return self._fingerprints
+
+    def add_many(self, docs: list[tuple[int, str, str, dict, float]], collapse_duplicates: bool = False) -> int:
+        """Index ``(position, role, content, vector, timestamp)`` documents with a single log write.
+
+        With ``collapse_duplicates``, a live document with exactly the same terms
+        is removed in favour of the new one. Returns how many were added.
+        """
+        records = []
+        added = 0
+        fingerprints = self.fingerprints() if collapse_duplicates else None
+        for position, role, content, vector, timestamp in docs:
+            timestamp = timestamp or time.time()
+            if not self.index.add(position, role, content, vector, timestamp):
+                continue
+            added += 1
+            if fingerprints is not None:
+                # Term ids are only known once indexed, so the new document is hashed afterwards
+                slot = len(self.index) - 1
+                fingerprint = hash(frozenset(self.index.vector_ids(slot)[0]))
+                previous = fingerprints.get(fingerprint)
+                fingerprints[fingerprint] = slot
+                if previous is not None and not self.index.dead[previous]:
+                    old_position = self.index.positions[previous]
+                    self.index.remove(old_position)
+                    records.append({"drop": [old_position]})
+            # The vector is not logged: replay re-tokenizes the content.
+            records.append({"doc": {"id": f"{self.key}_{position}", "role": role, "content": content, "ts": timestamp}})
+        if records:
+            self.generation += 1
+            self._log(records)
+        return added
+
+    def remove_many(self, positions: list[int]) -> int:
+        """Mark documents dead and log one removal record; returns how many were live."""
+        removed = [position for position in positions if self.index.remove(position)]
+        if removed:
+            self.generation += 1
+            self._log([{"drop": removed}])
+        return len(removed)
+
+    def _log(self, records: list[dict]) -> None:
+        with self._lock:
+            lines = []
+            for record in records:
+                self._seq += 1
+                lines.append(json.dumps({"seq": self._seq, **record}, ensure_ascii=False) + "\n")
+            self._wal_records += len(records)
+            try:
+                if self._wal is None:
+                    self._wal = self._open_wal()
+                self._wal.write("".join(lines))
+                self._wal.flush()
+            except Exception as e:
+                logger.error(f"Failed to append to Vector DB log: {e}")
+            should_compact = self._wal_records >= self.compact_every
+        if should_compact:
+            self.start_compaction()
+
+    @property
+    def dead_ratio(self) -> float:
+        return self.index.n_dead / len(self.index) if len(self.index) else 0.0
+
+    def rewrite(self) -> int:
+        """Rebuild the shard from its live documents only; returns how many dead ones were dropped.
+
+        Writes a fresh snapshot that covers the whole log, so the log is
+        truncated, and rewrites the dense vectors for the new slot numbers.
+        """
+        self.wait_for_compaction()
+        with self._lock:
+            old = self.index
+            live = [slot for slot in range(len(old)) if not old.dead[slot]]
+            index = _SessionIndex()
+            for slot in live:
+                index.add(old.positions[slot], old.role(slot), old.content(slot), old.vector(slot), old.times[slot])
+            self._install(index, live)
+        return old.n_dead
+
+    def replace(self, docs: list[tuple[int, str, str, dict, float]], collapse_duplicates: bool = False) -> int:
+        """Swap every document for ``docs`` with a single snapshot write; returns how many are kept.
+
+        Nothing is logged: the new snapshot covers the whole shard. With
+        ``collapse_duplicates``, only the last document with a given set of
+        terms is kept, as ``add_many`` would have left it.
+        """
+        if collapse_duplicates:
+            latest = {frozenset(doc[3]): i for i, doc in enumerate(docs)}
+            docs = [doc for i, doc in enumerate(docs) if latest[frozenset(doc[3])] == i]
+        self.wait_for_compaction()
+        with self._lock:
+            index = _SessionIndex()
+            for position, role, content, vector, timestamp in docs:
+                index.add(position, role, content, vector, timestamp or time.time())
+            self._install(index, [])
+        return len(self.index)
+
+    @property
+    def dense_missing(self) -> int:
+        """Documents that have no dense vector yet (all of them while the vectors are stale)."""
+        if self.dense is None:
+            return 0
+        return len(self.index) - len(self.dense)
+
+    def embed_missing(self, limit: int | None = None) -> int:
+        """Embed up to ``limit`` documents that have no dense vector yet; returns how many were embedded."""
+        if self.dense is None:
+            return 0
+        before = self.dense_missing
+        try:
+            missing = self.dense.sync(self.index.contents, limit)
+        except Exception as e:
+            logger.error(f"Dense vectors unavailable for {self.key}: {e}")
+            return 0
+        if missing != before:
+            self.generation += 1  # Cached results were ranked without these vectors
+        return before - missing
+
+    def build_dense_index(self) -> bool:
+        """Build and save the dense vectors' IVF index; returns whether it was built."""
+        try:
+            self.dense.build_index()
+        except Exception as e:
+            logger.error(f"Failed to build the dense index for {self.key}: {e}")
+            return False
+        self.generation += 1  # Approximate search may rank differently from the scan it replaces
+        return True
+
+    def _install(self, index: _SessionIndex, kept: list[int]) -> None:
+        """Make ``index`` (no dead documents) the whole shard; ``kept[i]`` is the old slot of slot ``i``.
+
+        Called with ``_lock`` held.
+        """
+        self.epoch += 1
+        tmp = self.snapshot_file.with_suffix(".vec.tmp")
+        _write_snapshot(tmp, index, self._seq, len(index), self.key, self.epoch, bytes(len(index)))
+        if self.dense is not None:
+            # Replaced first: if we crash before the snapshot, the epoch mismatch forces a re-embed
+            self.dense.retain(kept, self.epoch)
+        os.replace(tmp, self.snapshot_file)
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        self.wal_file.unlink(missing_ok=True)
+        self._wal_records = 0
+        self._compacted = None
+        self.index = _open_snapshot(self.snapshot_file)[0]
+        self._numpy = None
+        self._fingerprints = None
+        self.generation += 1
+
+    def start_compaction(self) -> bool:
+        """Rotate the log and fold it into a new snapshot on a background thread."""
+        with self._lock:
+            if self._compactor is not None or self.compacting_file.exists() or not self._wal_records:
+                return False
+            if self._wal is not None:  # Not opened yet when the records were replayed at load
+                self._wal.close()
+                self._wal = None
+            os.replace(self.wal_file, self.compacting_file)
+            self._wal_records = 0
+            # The arrays are append-only, so their first ``len(index)`` documents are a
+            # stable snapshot; only the dead flags change in place and are copied here.
+            self._compactor = threading.Thread(
+                target=self._compact, args=(len(self.index), self._seq, bytes(self.index.dead)),
+                name="vectordb-compactor", daemon=True,
+            )
+            self._compactor.start()
+        return True
+
+    def _compact(self, count: int, seq: int, dead: bytes):
+        tmp = self.snapshot_file.with_suffix(".vec.tmp")
+        try:
+            _write_snapshot(tmp, self.index, seq, count, self.key, self.epoch, dead)
+            os.replace(tmp, self.snapshot_file)
+            self.compacting_file.unlink(missing_ok=True)
+            with self._lock:
+                self._compacted = count
+        except Exception as e:
+            logger.error(f"Failed to compact Vector DB shard {self.key}: {e}")
+        finally:
+            with self._lock:
+                self._compactor = None
+
+    def adopt_snapshot(self) -> None:
+        """Switch to the snapshot a finished compaction wrote, keeping only later documents in RAM.
+
+        The snapshot holds the first ``count`` slots; documents added since are
+        indexed again on top of it and dead flags are carried over by slot. Must
+        be called from the thread that adds documents.
+        """
+        with self._lock:
+            count, self._compacted = self._compacted, None
+        if count is None:
+            return
+        try:
+            index = _open_snapshot(self.snapshot_file)[0]
+        except Exception as e:
+            logger.warning(f"Failed to map Vector DB snapshot of {self.key}: {e}")
+            return
+        old = self.index
+        if index.n_base != count or count > len(old):
+            return
+        for slot in range(count):
+            if old.dead[slot] and not index.dead[slot]:
+                index.kill(slot)
+        for slot in range(count, len(old)):
+            position = old.positions[slot]
+            index.add(position, old.role(slot), old.content(slot), old.vector(slot), old.times[slot])
+            if old.dead[slot]:
+                index.remove(position)
+        self.index = index
+        self._numpy = None
+        self._fingerprints = None  # Term ids of documents after the snapshot may have changed
+
+    def wait_for_compaction(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self):
+        """Wait for any running compaction and close the log."""
+        self.wait_for_compaction()
+        with self._lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+        if self.dense is not None:
+            self.dense.close()
+
+
 class LocalVectorDB:
     """A lightweight, pure-Python vector database using TF-IDF for zero dependencies.
     This guarantees 100% compatibility across Windows, Mac, and Linux without C++ tools.
+
+    Ranking is either cosine over tf-idf weights ("tfidf") or Okapi BM25 ("bm25").
+    Each session is stored in its own shard, loaded the first time the session is
+    used; at most ``max_resident`` shards are kept in RAM (least recently used
+    shards are closed first). ``retention`` bounds what each shard keeps.
+
+    Dense vectors are embedded as documents are added and when a shard is
+    loaded with some missing. With ``embed_inline`` off (as BackgroundIndexer
+    sets it), that is left to ``embed_pending`` instead, so loading and adding
+    never wait for the embedder; a shard whose vectors are being rebuilt is
+    searched lexically only until they are done.
     """
-    def __init__(self, workspace: Path):
+    # Number of log records that triggers a background compaction
+    COMPACT_EVERY = 1000
+    MAX_RESIDENT = 64
+    # Minimum score for a document to be returned, per ranking mode
+    MIN_SCORE = {"tfidf": 0.05, "bm25": 0.0}
+    DENSE_MIN_SCORE = 0.2
+    # Seconds between age-based retention sweeps of a shard
+    RETENTION_INTERVAL = 3600
+    # Cached search results kept per resident session
+    QUERY_CACHE_SIZE = 32
+
+    def __init__(
+        self,
+        workspace: Path,
+        compact_every: int | None = None,
+        ranking: str = "tfidf",
+        max_resident: int | None = None,
+        backend: str = "auto",
+        retrieval: str = "lexical",
+        embedder: EmbeddingBackend | None = None,
+        retention: RetentionPolicy | None = None,
+        query_cache_size: int | None = None,
+        embed_inline: bool = True,
+    ):
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking!r} (expected one of {RANKING_MODES})")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown scoring backend: {backend!r} (expected one of {BACKENDS})")
+        if backend == "numpy" and np is None:
+            raise ValueError("The numpy scoring backend requires NumPy to be installed")
+        if backend == "auto":
+            backend = "numpy" if np is not None else "python"
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval!r} (expected one of {RETRIEVAL_MODES})")
+        if retrieval != "lexical" and embedder is None:
+            raise ValueError(f"Retrieval mode {retrieval!r} requires an embedding backend")
+        self.ranking = ranking
+        self.backend = backend
+        self.retrieval = retrieval
+        self.embedder = embedder if retrieval != "lexical" else None
+        self.embed_inline = embed_inline
         self.db_path = workspace / "vector_memory"
-        self.db_path.mkdir(exist_ok=True)
-        self.index_file = self.db_path / "index.json"
-        
-        # In-memory storage: lists of dicts {"id", "session", "role", "content", "vector", "tokens"}
-        self.documents = []
-        self._load_index()
-        logger.info("Native Pure-Python Vector DB initialized.")
-
-    def _load_index(self):
-        if self.index_file.exists():
+        self.shards_dir = ensure_dir(self.db_path / "shards")
+        self.compact_every = compact_every or self.COMPACT_EVERY
+        self.max_resident = max_resident or self.MAX_RESIDENT
+        self.retention = retention or RetentionPolicy()
+        self.query_cache_size = self.QUERY_CACHE_SIZE if query_cache_size is None else query_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Resident shards, least recently used first
+        self._shards: OrderedDict[str, _Shard] = OrderedDict()
+        self._migrate_global_index()
+        logger.info("Native Vector DB initialized ({} scoring).", self.backend)
+
+    @classmethod
+    def from_config(cls, workspace: Path, config: "VectorMemoryConfig") -> "LocalVectorDB":
+        """Build the database described by ``memory.vector`` in the config."""
+        embedder = None
+        if config.retrieval != "lexical":
+            from nanobot.agent.embeddings import create_embedder
+            embedder = create_embedder(config.embedding)
+        return cls(
+            workspace,
+            ranking=config.ranking,
+            max_resident=config.max_resident_shards,
+            backend=config.backend,
+            retrieval=config.retrieval,
+            embedder=embedder,
+            retention=RetentionPolicy(**config.retention.model_dump()),
+            query_cache_size=config.query_cache_size,
+        )
+
+    def _migrate_global_index(self):
+        """Split the pre-shard ``index.json`` + ``wal.jsonl`` into per-session shards."""
+        index_file = self.db_path / "index.json"
+        logs = [self.db_path / "wal.jsonl.compacting", self.db_path / "wal.jsonl"]
+        if not index_file.exists() and not any(p.exists() for p in logs):
+            return
+        documents: list[dict] = []
+        snapshot_seq = 0
+        if index_file.exists():
             try:
-                with open(self.index_file, "r", encoding="utf-8") as f:
-                    self.documents = json.load(f)
-            except Exception:
-                self.documents = []
+                with open(index_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, list):  # Original format: one flat document list
+                    documents = data
+                elif "sessions" in data:
+                    documents = [doc for docs in data["sessions"].values() for doc in docs]
+                else:
+                    documents = data.get("documents", [])
+                if isinstance(data, dict):
+                    snapshot_seq = data.get("seq", 0)
+            except Exception as e:
+                logger.warning(f"Failed to read legacy Vector DB index: {e}")
+        for path in logs:
+            if not path.exists():
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record["seq"] > snapshot_seq:
+                        documents.append(record["doc"])
+
+        by_session: dict[str, list[dict]] = {}
+        for doc in documents:
+            by_session.setdefault(doc["session"], []).append(doc)
+        logger.info(f"Migrating Vector DB index into {len(by_session)} per-session shards")
+        for key, docs in by_session.items():
+            shard = _Shard(self.shards_dir, key, self.compact_every)
+            for doc in docs:
+                shard.add(_position(doc["id"]), doc.get("role", "user"), doc["content"], doc.get("vector"))
+            shard.close()
+        for path in [index_file, *logs]:
+            path.unlink(missing_ok=True)
+
+    def _shard(self, session_key: str, create: bool = True) -> _Shard | None:
+        """Return the session's shard, loading it (and evicting the LRU one) if needed."""
+        shard = self._shards.get(session_key)
+        if shard is not None:
+            self._shards.move_to_end(session_key)
+            shard.adopt_snapshot()
+            return shard
+        shard = _Shard(self.shards_dir, session_key, self.compact_every, self.embedder)
+        if not create and not shard.exists:
+            return None
+        self._shards[session_key] = shard
+        while len(self._shards) > self.max_resident:
+            _, evicted = self._shards.popitem(last=False)
+            evicted.close()
+        self._embed(shard)
+        return shard
+
+    def _embed(self, shard: _Shard) -> None:
+        if not self.embed_inline or shard.dense is None:
+            return
+        if shard.dense_missing:
+            shard.embed_missing()
+        if shard.dense.needs_index:
+            shard.build_dense_index()
+
+    def embed_pending(self, limit: int | None = None) -> bool:
+        """One step of dense upkeep for the resident shards, most recently used first.
+
+        Embeds up to ``limit`` missing vectors of one shard or, once none are
+        missing, builds one shard's IVF index. Returns whether anything was
+        done (so there may be more to do).
+        """
+        shards = list(reversed(self._shards.values()))
+        for shard in shards:
+            if shard.dense_missing:
+                return shard.embed_missing(limit) > 0
+        for shard in shards:
+            if shard.dense is not None and shard.dense.needs_index:
+                return shard.build_dense_index()
+        return False
 
-    def _save_index(self):
+    def embed_query(self, query: str) -> list[float] | None:
+        """The query's embedding for dense search, or None without an embedder or if it failed."""
+        if self.embedder is None:
+            return None
         try:
-            with open(self.index_file, "w", encoding="utf-8") as f:
-                json.dump(self.documents, f, ensure_ascii=False)
+            return self.embedder.embed([query])[0]
         except Exception as e:
-            logger.error(f"Failed to save Vector DB index: {e}")
-
-    def _tokenize(self, text: str) -> dict:
-        """Simple tokenization and frequency count for TF vectors."""
-        words = re.findall(r'\w+', text.lower())
-        freq = {}
-        for w in words:
-            if len(w) > 2:  # ignore extremely short stop words roughly
-                freq[w] = freq.get(w, 0) + 1
-        return freq
-
-    def _cosine_similarity(self, vec1: dict, vec2: dict) -> float:
-        """Compute cosine similarity between two sparse vectors."""
-        intersection = set(vec1.keys()) & set(vec2.keys())
-        dot_product = sum(vec1[w] * vec2[w] for w in intersection)
-        
-        mag1 = math.sqrt(sum(v**2 for v in vec1.values()))
-        mag2 = math.sqrt(sum(v**2 for v in vec2.values()))
-        
-        if not mag1 or not mag2:
-            return 0.0
-        return dot_product / (mag1 * mag2)
+            logger.error(f"Query embedding failed: {e}")
+            return None
+
+    def resident_sessions(self) -> list[str]:
+        return list(self._shards)
+
+    def compact(self):
+        """Synchronously fold every resident shard's log into its snapshot."""
+        for shard in list(self._shards.values()):
+            shard.wait_for_compaction()
+            shard.start_compaction()
+            shard.wait_for_compaction()
+
+    def session_documents(self, session_key: str) -> list[dict]:
+        """Documents indexed for a session, in insertion order."""
+        shard = self._shard(session_key, create=False)
+        if shard is None:
+            return []
+        index = shard.index
+        return [index.document(slot, session_key) for slot in range(len(index)) if not index.dead[slot]]
+
+    def cache_stats(self) -> dict:
+        """Query cache counters since startup."""
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+        }
+
+    def session_keys(self) -> list[str]:
+        """Every session with a shard on disk (or in memory).
+
+        Shards whose key was never recorded are listed under their file name.
+        """
+        keys: dict[str, str] = {}  # file name -> session key
+        for path in sorted(self.shards_dir.iterdir()):
+            name, _, suffix = path.name.partition(".")
+            if suffix not in ("vec", "json", "wal.jsonl", "wal.jsonl.compacting") or name in keys:
+                continue
+            key = None
+            try:
+                if suffix == "vec":
+                    key = _read_snapshot_key(path)
+                elif suffix == "json":
+                    with open(path, "r", encoding="utf-8") as f:
+                        key = json.load(f).get("key")
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            doc = json.loads(line).get("doc")
+                            if doc:
+                                key = doc["id"].rsplit("_", 1)[0]
+                                break
+            except Exception as e:
+                logger.warning(f"Could not read session key from {path.name}: {e}")
+            # Older snapshots did not record the key; the file name opens the same shard
+            keys[name] = key or name
+        for key in self._shards:
+            keys[safe_filename(key.replace(":", "_"))] = key
+        return sorted(set(keys.values()))
+
+    def wait_for_compaction(self):
+        for shard in list(self._shards.values()):
+            shard.wait_for_compaction()
+
+    def close(self):
+        """Close every resident shard, waiting for running compactions."""
+        while self._shards:
+            _, shard = self._shards.popitem(last=False)
+            shard.close()
+
+    @staticmethod
+    def _tokenize(text: str) -> dict:
+        return _tokenize(text)
 
     def add_message(self, session_key: str, msg: dict, msg_idx: int):
-        if not msg.get("content") or not isinstance(msg["content"], str):
-            return
-        content = msg["content"].strip()
-        if not content:
-            return
-        
-        doc_id = f"{session_key}_{msg_idx}"
-        # Update if exists
-        for d in self.documents:
-            if d["id"] == doc_id:
-                return  # already indexed
-                
-        vector = self._tokenize(content)
-        if not vector:
-            return
-            
-        self.documents.append({
-            "id": doc_id,
-            "session": session_key,
-            "role": msg.get("role", "user"),
-            "content": content,
-            "vector": vector
-        })
-        self._save_index()
-
-    def search_messages(self, session_key: str, query: str, top_k: int = 4) -> list[dict]:
-        if not query or not query.strip() or not self.documents:
+        self.add_messages(session_key, [(msg, msg_idx)])
+
+    def add_messages(self, session_key: str, items: list[tuple[dict, int]]) -> int:
+        """Index a batch of ``(message, index)`` pairs for one session; returns how many were added."""
+        docs = message_documents(items)
+        if not docs:
+            return 0
+        # Already-indexed ids (and duplicates within the batch) are skipped by the shard
+        shard = self._shard(session_key)
+        added = shard.add_many(docs, collapse_duplicates=self.retention.collapse_duplicates)
+        self._apply_retention(shard)
+        self._embed(shard)
+        return added
+
+    def rebuild_session(self, session_key: str, docs: list[tuple[int, str, str, dict, float]]) -> int:
+        """Replace a session's index with ``docs`` (from ``message_documents``); returns how many are kept.
+
+        Unlike ``add_messages``, nothing is appended to the log: the shard is
+        written as a single snapshot, then the retention policy is applied.
+        """
+        shard = self._shard(session_key)
+        shard.replace(docs, collapse_duplicates=self.retention.collapse_duplicates)
+        self._apply_retention(shard, force=True)
+        self._embed(shard)
+        return shard.index.live
+
+    def clear_session(self, session_key: str) -> int:
+        """Forget every document of a session (e.g. after ``/new``); returns how many were dropped."""
+        shard = self._shard(session_key, create=False)
+        if shard is None:
+            return 0
+        removed = shard.remove_many(shard.index.live_positions())
+        shard.rewrite()
+        return removed
+
+    def _apply_retention(self, shard: _Shard, force: bool = False) -> int:
+        """Drop documents the retention policy no longer keeps; returns how many.
+
+        The per-session cap is checked on every call, age limits at most every
+        ``RETENTION_INTERVAL`` seconds (or when forced). The shard is rewritten
+        once its dead share exceeds ``dead_ratio``.
+        """
+        policy = self.retention
+        index = shard.index
+        now = time.time()
+        drop: set[int] = set()
+        if (policy.max_age_days or policy.tool_max_age_days) and (
+            force or now - shard.retention_checked_at >= self.RETENTION_INTERVAL
+        ):
+            shard.retention_checked_at = now
+            age_cutoff = now - policy.max_age_days * 86400 if policy.max_age_days else None
+            tool_cutoff = now - policy.tool_max_age_days * 86400 if policy.tool_max_age_days else None
+            for slot in range(index.head, len(index)):
+                if index.dead[slot]:
+                    continue
+                t = index.times[slot]
+                if (age_cutoff is not None and t < age_cutoff) or (
+                    tool_cutoff is not None and t < tool_cutoff and index.role(slot) == "tool"
+                ):
+                    drop.add(index.positions[slot])
+        if policy.max_documents:
+            excess = index.live - len(drop) - policy.max_documents
+            slot = index.head
+            while excess > 0:
+                position = index.positions[slot]
+                if not index.dead[slot] and position not in drop:
+                    drop.add(position)
+                    excess -= 1
+                slot += 1
+        dropped = shard.remove_many(sorted(drop)) if drop else 0
+        if index.n_dead and (force or shard.dead_ratio > policy.dead_ratio):
+            shard.rewrite()
+        return dropped
+
+    def compact_all(self) -> list[tuple[str, int, int]]:
+        """Apply retention to every session and rewrite its shard.
+
+        Returns ``(session_key, documents dropped, documents kept)`` per session.
+        """
+        report = []
+        for key in self.session_keys():
+            shard = self._shard(key)
+            before = len(shard.index)
+            self._apply_retention(shard, force=True)
+            if len(shard.index) == before:
+                # Nothing was dead, so nothing was rewritten: still fold the log into the snapshot
+                shard.wait_for_compaction()
+                shard.start_compaction()
+                shard.wait_for_compaction()
+            report.append((key, before - len(shard.index), len(shard.index)))
+        return report
+
+    def export_json(self, session_key: str, path: Path) -> int:
+        """Write a session's live documents as readable JSON (for debugging); returns how many."""
+        documents = self.session_documents(session_key)
+        shard = self._shard(session_key, create=False)
+        data = {"key": session_key, "seq": shard._seq if shard else 0, "documents": documents}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        return len(documents)
+
+    def import_json(self, path: Path) -> tuple[str, int]:
+        """Replace a session's documents with those of an ``export_json`` file.
+
+        Returns ``(session_key, documents imported)``.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        key = data["key"]
+        self.clear_session(key)
+        shard = self._shard(key)
+        added = shard.add_many([
+            (_position(doc["id"]), doc.get("role", "user"), doc["content"], doc.get("vector"),
+             doc.get("timestamp", 0.0))
+            for doc in data.get("documents", [])
+        ])
+        shard.rewrite()  # Straight into a snapshot, rather than a log to replay
+        self._embed(shard)
+        return key, added
+
+    def _lexical_top(self, shard: _Shard, query_vec: dict, top_k: int) -> list[int]:
+        """Slots of the best lexical matches, earlier documents first on ties."""
+        index = shard.index
+        min_score = self.MIN_SCORE[self.ranking]
+        if self.backend == "numpy":
+            postings = shard.numpy_postings()
+            if self.ranking == "bm25":
+                scores = postings.score_bm25(index, query_vec)
+            else:
+                scores = postings.score_tfidf(index, query_vec)
+            if index.n_dead:
+                scores[np.frombuffer(index.dead, dtype=np.bool_)] = 0.0
+            return _top_k_numpy(scores, min_score, top_k)
+        if self.ranking == "bm25":
+            scores = index.score_bm25(query_vec)
+        else:
+            scores = index.score_tfidf(query_vec)
+        dead = index.dead
+        scored_docs = [(score, slot) for slot, score in scores.items() if score > min_score and not dead[slot]]
+        return [slot for _, slot in heapq.nsmallest(top_k, scored_docs, key=lambda x: (-x[0], x[1]))]
+
+    def _dense_top(self, shard: _Shard, query_embedding: list[float] | None, top_k: int) -> list[int]:
+        """Slots of the nearest embeddings (approximate once the shard is large)."""
+        if shard.dense is None or query_embedding is None or top_k <= 0:
+            return []
+        dead = shard.index.dead
+        try:
+            hits = shard.dense.search(query_embedding, top_k + shard.index.n_dead, self.DENSE_MIN_SCORE)
+            return [slot for _, slot in hits if not dead[slot]][:top_k]
+        except Exception as e:
+            logger.error(f"Dense search failed for {shard.key}: {e}")
+            return []
+
+    def _cache_key(self, query: str, query_vec: dict, top_k: int) -> tuple:
+        """Queries that normalize to the same tokens share results."""
+        if self.retrieval == "lexical":
+            return tuple(sorted(query_vec.items())), top_k
+        # Embeddings may depend on every word and on word order
+        return tuple(re.findall(r"\w+", query.lower())), top_k
+
+    def search_messages(self, session_key: str, query: str, top_k: int = 4,
+                        query_embedding: list[float] | None = None) -> list[dict]:
+        """The session's best matches for ``query``, oldest first.
+
+        Dense retrieval embeds the query itself, unless ``embed_inline`` is off:
+        then it only uses ``query_embedding`` (from ``embed_query``, called
+        outside any lock), and without one searches lexically.
+        """
+        if not query or not query.strip():
             return []
-            
+
         query_vec = self._tokenize(query)
-        if not query_vec:
+        if not query_vec and self.retrieval == "lexical":
             return []
 
-        # Filter by session
-        session_docs = [d for d in self.documents if d["session"] == session_key]
-        
-        scored_docs = []
-        for doc in session_docs:
-            score = self._cosine_similarity(query_vec, doc["vector"])
-            if score > 0.05:  # Slight relevance threshold
-                scored_docs.append((score, doc))
-                
-        # Sort by relevance descending
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-        
-        # Take top_k
-        top_docs = scored_docs[:top_k]
-        
-        # Sort chronologically (by assuming id ends with integer index)
-        # to feed LLM in a somewhat logical order
-        top_docs.sort(key=lambda x: int(x[1]["id"].split("_")[-1]))
-        
+        shard = self._shard(session_key, create=False)
+        if shard is None:
+            return []
+        cache_key = self._cache_key(query, query_vec, top_k)
+        cached = shard.query_cache.get(cache_key)
+        if cached is not None and cached[0] == shard.generation:
+            self.cache_hits += 1
+            shard.query_cache.move_to_end(cache_key)
+            return [dict(m) for m in cached[1]]
+        self.cache_misses += 1
+
+        index = shard.index
+        if self.retrieval != "lexical" and query_embedding is None and self.embed_inline:
+            query_embedding = self.embed_query(query)
+        if (self.retrieval == "lexical" or shard.dense is None or shard.dense.stale
+                or query_embedding is None):
+            best = self._lexical_top(shard, query_vec, top_k)
+        elif self.retrieval == "dense":
+            best = self._dense_top(shard, query_embedding, top_k)
+        else:
+            # Reciprocal rank fusion over deeper candidate lists from both retrievers
+            fused: dict[int, float] = {}
+            for ranked in (self._lexical_top(shard, query_vec, top_k * 4),
+                           self._dense_top(shard, query_embedding, top_k * 4)):
+                for rank, slot in enumerate(ranked):
+                    fused[slot] = fused.get(slot, 0.0) + 1.0 / (RRF_K + rank + 1)
+            best = heapq.nsmallest(top_k, fused, key=lambda slot: (-fused[slot], slot))
+
+        # Sort chronologically to feed LLM in a somewhat logical order
+        slots = sorted(best, key=lambda slot: index.positions[slot])
+
         messages = []
-        for score, doc in top_docs:
+        for slot in slots:
             messages.append({
-                "role": doc["role"], 
-                "content": f"[From Past Context]: {doc['content']}",
+                "role": index.role(slot),
+                "content": f"[From Past Context]: {index.content(slot)}",
                 "is_from_vector": True
             })
+        if self.query_cache_size > 0:
+            shard.query_cache[cache_key] = (shard.generation, [dict(m) for m in messages])
+            shard.query_cache.move_to_end(cache_key)
+            while len(shard.query_cache) > self.query_cache_size:
+                shard.query_cache.popitem(last=False)
         return messages
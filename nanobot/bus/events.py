@@ -17,6 +17,7 @@ class InboundMessage:
     media: list[str] = field(default_factory=list)  # Media URLs
     metadata: dict[str, Any] = field(default_factory=dict)  # Channel-specific data
     session_key_override: str | None = None  # Optional override for thread-scoped sessions
+    arrival: int = field(default=0, repr=False, compare=False)  # Publish order, set by the bus
     
     @property
     def session_key(self) -> str:
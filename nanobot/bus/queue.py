@@ -1,6 +1,8 @@
 """Async message queue for decoupled channel-agent communication."""
 
 import asyncio
+import itertools
+from collections import deque
 
 from nanobot.bus.events import InboundMessage, OutboundMessage
 
@@ -11,19 +13,79 @@ class MessageBus:
 
     Channels push messages to the inbound queue, and the agent processes
     them and pushes responses to the outbound queue.
+
+    Inbound messages are also indexed by session until they are consumed,
+    so a consumer working on a session can take that session's messages
+    directly (``next_for_session``, ``drain_for_session``) without going
+    through the rest of the queue. While a session is held, its messages
+    stay in the index and ``consume_inbound`` passes over them. Every message
+    is stamped with its ``arrival`` order when it is published.
     """
 
     def __init__(self):
         self.inbound: asyncio.Queue[InboundMessage] = asyncio.Queue()
         self.outbound: asyncio.Queue[OutboundMessage] = asyncio.Queue()
+        self._pending: dict[str, deque[InboundMessage]] = {}  # Not yet consumed, per session
+        self._pending_count = 0
+        self._held: set[str] = set()
+        self._arrivals = itertools.count(1)
 
     async def publish_inbound(self, msg: InboundMessage) -> None:
         """Publish a message from a channel to the agent."""
+        msg.arrival = next(self._arrivals)
+        pending = self._pending.get(msg.session_key)
+        if pending is None:
+            pending = self._pending[msg.session_key] = deque()
+        pending.append(msg)
+        self._pending_count += 1
         await self.inbound.put(msg)
 
     async def consume_inbound(self) -> InboundMessage:
         """Consume the next inbound message (blocks until available)."""
-        return await self.inbound.get()
+        while True:
+            msg = await self.inbound.get()
+            key = msg.session_key
+            pending = self._pending.get(key)
+            # Taken through the session index already, or left there for the session's holder
+            if not pending or pending[0] is not msg or key in self._held:
+                continue
+            return self._take(key, pending)
+
+    def _take(self, key: str, pending: deque[InboundMessage]) -> InboundMessage:
+        msg = pending.popleft()
+        if not pending:
+            del self._pending[key]
+        self._pending_count -= 1
+        return msg
+
+    def peek_for_session(self, session_key: str) -> InboundMessage | None:
+        """The oldest pending message of a session, left in place."""
+        pending = self._pending.get(session_key)
+        return pending[0] if pending else None
+
+    def next_for_session(self, session_key: str) -> InboundMessage | None:
+        """Take the oldest pending message of a session, if any."""
+        pending = self._pending.get(session_key)
+        return self._take(session_key, pending) if pending else None
+
+    def drain_for_session(self, session_key: str) -> list[InboundMessage]:
+        """Take all pending messages of a session, oldest first."""
+        pending = self._pending.pop(session_key, None)
+        if not pending:
+            return []
+        self._pending_count -= len(pending)
+        return list(pending)
+
+    def hold_session(self, session_key: str) -> None:
+        """Keep a session's messages out of ``consume_inbound`` (its consumer takes them itself)."""
+        self._held.add(session_key)
+
+    def release_session(self, session_key: str) -> None:
+        """Let ``consume_inbound`` return a session's messages again."""
+        self._held.discard(session_key)
+        # Messages passed over while the session was held are no longer in the queue
+        for msg in self._pending.get(session_key, ()):
+            self.inbound.put_nowait(msg)
 
     async def publish_outbound(self, msg: OutboundMessage) -> None:
         """Publish a response from the agent to channels."""
@@ -36,7 +98,7 @@ class MessageBus:
     @property
     def inbound_size(self) -> int:
         """Number of pending inbound messages."""
-        return self.inbound.qsize()
+        return self._pending_count
 
     @property
     def outbound_size(self) -> int:
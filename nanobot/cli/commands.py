@@ -296,7 +296,7 @@ def gateway(
     config = load_config()
     bus = MessageBus()
     provider = _make_provider(config)
-    session_manager = SessionManager(config.workspace_path)
+    session_manager = SessionManager.from_config(config.workspace_path, config.memory.sessions)
     
     # Create cron service first (callback set after agent creation)
     cron_store_path = get_data_dir() / "cron" / "jobs.json"
@@ -312,6 +312,7 @@ def gateway(
         max_tokens=config.agents.defaults.max_tokens,
         max_iterations=config.agents.defaults.max_tool_iterations,
         memory_window=config.agents.defaults.memory_window,
+        max_concurrent_sessions=config.agents.defaults.max_concurrent_sessions,
         brave_api_key=config.tools.web.search.api_key or None,
         exec_config=config.tools.exec,
         cron_service=cron,
@@ -319,6 +320,7 @@ def gateway(
         session_manager=session_manager,
         mcp_servers=config.tools.mcp_servers,
         channels_config=config.channels,
+        vector_config=config.memory.vector,
     )
     
     # Set cron callback (needs agent)
@@ -416,7 +418,7 @@ def gateway(
         except KeyboardInterrupt:
             console.print("\nShutting down...")
         finally:
-            await agent.close_mcp()
+            await agent.close()
             heartbeat.stop()
             cron.stop()
             agent.stop()
@@ -444,6 +446,7 @@ def agent(
     from nanobot.bus.queue import MessageBus
     from nanobot.agent.loop import AgentLoop
     from nanobot.cron.service import CronService
+    from nanobot.session.manager import SessionManager
     from loguru import logger
     
     config = load_config()
@@ -469,12 +472,15 @@ def agent(
         max_tokens=config.agents.defaults.max_tokens,
         max_iterations=config.agents.defaults.max_tool_iterations,
         memory_window=config.agents.defaults.memory_window,
+        max_concurrent_sessions=config.agents.defaults.max_concurrent_sessions,
         brave_api_key=config.tools.web.search.api_key or None,
         exec_config=config.tools.exec,
         cron_service=cron,
         restrict_to_workspace=config.tools.restrict_to_workspace,
+        session_manager=SessionManager.from_config(config.workspace_path, config.memory.sessions),
         mcp_servers=config.tools.mcp_servers,
         channels_config=config.channels,
+        vector_config=config.memory.vector,
     )
     
     # Show spinner when logs are off (no output to miss); skip when logs are on
@@ -499,7 +505,7 @@ def agent(
             with _thinking_ctx():
                 response = await agent_loop.process_direct(message, session_id, on_progress=_cli_progress)
             _print_agent_response(response, render_markdown=markdown)
-            await agent_loop.close_mcp()
+            await agent_loop.close()
 
         asyncio.run(run_once())
     else:
@@ -594,7 +600,7 @@ def agent(
                 agent_loop.stop()
                 outbound_task.cancel()
                 await asyncio.gather(bus_task, outbound_task, return_exceptions=True)
-                await agent_loop.close_mcp()
+                await agent_loop.close()
 
         asyncio.run(run_interactive())
 
@@ -946,6 +952,7 @@ def cron_run(
     from nanobot.cron.types import CronJob
     from nanobot.bus.queue import MessageBus
     from nanobot.agent.loop import AgentLoop
+    from nanobot.session.manager import SessionManager
     logger.disable("nanobot")
 
     config = load_config()
@@ -960,11 +967,14 @@ def cron_run(
         max_tokens=config.agents.defaults.max_tokens,
         max_iterations=config.agents.defaults.max_tool_iterations,
         memory_window=config.agents.defaults.memory_window,
+        max_concurrent_sessions=config.agents.defaults.max_concurrent_sessions,
         brave_api_key=config.tools.web.search.api_key or None,
         exec_config=config.tools.exec,
         restrict_to_workspace=config.tools.restrict_to_workspace,
+        session_manager=SessionManager.from_config(config.workspace_path, config.memory.sessions),
         mcp_servers=config.tools.mcp_servers,
         channels_config=config.channels,
+        vector_config=config.memory.vector,
     )
 
     store_path = get_data_dir() / "cron" / "jobs.json"
@@ -985,7 +995,10 @@ def cron_run(
     service.on_job = on_job
 
     async def run():
-        return await service.run_job(job_id, force=force)
+        try:
+            return await service.run_job(job_id, force=force)
+        finally:
+            await agent_loop.close()
 
     if asyncio.run(run()):
         console.print("[green]✓[/green] Job executed")
@@ -995,6 +1008,299 @@ def cron_run(
         console.print(f"[red]Failed to run job {job_id}[/red]")
 
 
+# ============================================================================
+# Session Commands
+# ============================================================================
+
+sessions_app = typer.Typer(help="Manage saved chat sessions")
+app.add_typer(sessions_app, name="sessions")
+
+
+@sessions_app.command("migrate")
+def sessions_migrate(
+    to: str = typer.Option(..., "--to", help="Backend to move sessions to: jsonl or sqlite"),
+):
+    """Copy every session to another storage backend and switch to it (stop the gateway first)."""
+    from nanobot.config.loader import load_config, save_config
+    from nanobot.session.manager import BACKENDS, open_storage
+
+    config = load_config()
+    current = config.memory.sessions.backend
+    if to not in BACKENDS:
+        console.print(f"[red]Unknown backend '{to}', expected one of: {', '.join(BACKENDS)}[/red]")
+        raise typer.Exit(1)
+    if to == current:
+        console.print(f"Sessions are already stored with {to}.")
+        return
+
+    fsync = config.memory.sessions.fsync
+    source = open_storage(config.workspace_path, current, fsync)
+    target = open_storage(config.workspace_path, to, fsync)
+    copied, failed = 0, []
+    try:
+        for entry in source.list():
+            session = source.load_full(entry["key"])
+            if session is None:
+                failed.append(entry["key"])
+                continue
+            session._stored = None  # Written in full to the new backend
+            target.commit(target.prepare(session))
+            copied += 1
+    finally:
+        source.close()
+        target.close()
+
+    if failed:
+        console.print(f"[red]Could not read:[/red] {', '.join(failed)}")
+        console.print(f"Copied {copied} session(s); backend left as {current}.")
+        raise typer.Exit(1)
+    config.memory.sessions.backend = to
+    save_config(config)
+    console.print(f"[green]✓[/green] Copied {copied} session(s) from {current} to {to}; memory.sessions.backend is now {to}")
+
+
+@sessions_app.command("export")
+def sessions_export(
+    session: str = typer.Argument(..., help="Session key, e.g. telegram:12345"),
+    output: Path = typer.Option(None, "--output", "-o", help="JSONL file to write"),
+):
+    """Write a session's full message history, archived messages included, as JSONL."""
+    import json
+
+    from nanobot.config.loader import load_config
+    from nanobot.session.manager import open_storage
+    from nanobot.utils.helpers import safe_filename
+
+    config = load_config()
+    output = output or Path(f"{safe_filename(session.replace(':', '_'))}.jsonl")
+    storage = open_storage(config.workspace_path, config.memory.sessions.backend)
+    count = 0
+    try:
+        with open(output, "w", encoding="utf-8") as f:
+            for message in storage.iter_messages(session):
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+                count += 1
+    except KeyError:
+        output.unlink(missing_ok=True)
+        console.print(f"[red]No saved session {session}[/red]")
+        raise typer.Exit(1)
+    finally:
+        storage.close()
+    console.print(f"[green]✓[/green] Exported {count} messages of {session} to {output}")
+
+
+@sessions_app.command("bench")
+def sessions_bench(
+    size: str = typer.Option("1m", "--size", "-s", help="Messages: 10k, 100k, 1m or a number"),
+):
+    """Compare the memory resident sessions take as plain dicts and as compact message records."""
+    from nanobot.agent.benchmark import SIZES
+    from nanobot.session.benchmark import run_message_benchmark
+
+    messages = SIZES.get(size.lower()) or int(size)
+    console.print(f"Benchmarking {messages:,} messages...")
+    before, after = run_message_benchmark(messages)
+
+    table = Table(title="Session Message Memory")
+    table.add_column("Representation", style="cyan")
+    table.add_column("Memory", justify="right")
+    table.add_column("Per message", justify="right")
+    table.add_column("Load", justify="right")
+    table.add_column("get_history", justify="right")
+    for r in (before, after):
+        table.add_row(
+            r.representation,
+            f"{r.bytes / 2**20:.1f} MiB",
+            f"{r.bytes_per_message:.0f} B",
+            f"{r.load_seconds:.2f} s",
+            f"{r.history_us:.0f} µs",
+        )
+    console.print(table)
+    console.print(f"Records use {1 - after.bytes / before.bytes:.0%} less memory than dicts")
+
+
+# ============================================================================
+# Memory Commands
+# ============================================================================
+
+memory_app = typer.Typer(help="Manage agent memory")
+app.add_typer(memory_app, name="memory")
+
+
+@memory_app.command("compact")
+def memory_compact():
+    """Apply vector memory retention and rewrite every session's index."""
+    from nanobot.agent.vectordb import LocalVectorDB
+    from nanobot.config.loader import load_config
+
+    config = load_config()
+    db = LocalVectorDB.from_config(config.workspace_path, config.memory.vector)
+    try:
+        report = db.compact_all()
+    finally:
+        db.close()
+
+    if not report:
+        console.print("No vector memory to compact.")
+        return
+
+    table = Table(title="Vector Memory")
+    table.add_column("Session", style="cyan")
+    table.add_column("Dropped", justify="right")
+    table.add_column("Kept", justify="right")
+    for key, dropped, kept in report:
+        table.add_row(key, str(dropped), str(kept))
+    console.print(table)
+    total = sum(dropped for _, dropped, _ in report)
+    console.print(f"[green]✓[/green] Compacted {len(report)} session(s), dropped {total} entries")
+
+
+@memory_app.command("export")
+def memory_export(
+    session: str = typer.Argument(..., help="Session key, e.g. telegram:12345"),
+    output: Path = typer.Option(None, "--output", "-o", help="JSON file to write"),
+):
+    """Dump a session's vector memory as JSON (for debugging)."""
+    from nanobot.agent.vectordb import LocalVectorDB
+    from nanobot.config.loader import load_config
+    from nanobot.utils.helpers import safe_filename
+
+    config = load_config()
+    output = output or Path(f"{safe_filename(session.replace(':', '_'))}.json")
+    db = LocalVectorDB.from_config(config.workspace_path, config.memory.vector)
+    try:
+        count = db.export_json(session, output)
+    finally:
+        db.close()
+    console.print(f"[green]✓[/green] Exported {count} entries of {session} to {output}")
+
+
+@memory_app.command("import")
+def memory_import(
+    path: Path = typer.Argument(..., help="JSON file written by `nanobot memory export`"),
+):
+    """Replace a session's vector memory with the contents of an exported JSON file."""
+    from nanobot.agent.vectordb import LocalVectorDB
+    from nanobot.config.loader import load_config
+
+    config = load_config()
+    db = LocalVectorDB.from_config(config.workspace_path, config.memory.vector)
+    try:
+        session, count = db.import_json(path)
+    finally:
+        db.close()
+    console.print(f"[green]✓[/green] Imported {count} entries into {session}")
+
+
+@memory_app.command("reindex")
+def memory_reindex(
+    workers: int = typer.Option(None, "--workers", "-w", help="Tokenizer processes (default: all cores)"),
+    restart: bool = typer.Option(False, "--restart", help="Rebuild every session, e.g. after a tokenizer change"),
+):
+    """Rebuild vector memory from the saved sessions (stop the gateway first)."""
+    from rich.progress import Progress
+
+    from nanobot.agent.reindex import Reindexer
+    from nanobot.agent.vectordb import LocalVectorDB
+    from nanobot.config.loader import load_config
+
+    config = load_config()
+    db = LocalVectorDB.from_config(config.workspace_path, config.memory.vector)
+    try:
+        reindexer = Reindexer(config.workspace_path, db, workers=workers,
+                              backend=config.memory.sessions.backend)
+        with Progress(console=console, transient=True) as bar:
+            task = bar.add_task("Reindexing sessions", total=None)
+            report = reindexer.run(
+                restart=restart,
+                progress=lambda key, done, total: bar.update(task, completed=done, total=total),
+            )
+    finally:
+        db.close()
+
+    console.print(
+        f"[green]✓[/green] Reindexed {report.sessions} session(s): "
+        f"{report.documents} entries from {report.messages} messages"
+        + (f", {report.skipped} already up to date" if report.skipped else "")
+    )
+    if report.failed:
+        console.print(f"[red]Failed:[/red] {', '.join(report.failed)} (run again to retry)")
+        raise typer.Exit(1)
+
+
+@memory_app.command("bench")
+def memory_bench(
+    sizes: list[str] = typer.Option(["10k"], "--size", "-s", help="Corpus size: 10k, 100k, 1m or a number (repeatable)"),
+    output: Path = typer.Option(Path("vector-bench.json"), "--output", "-o", help="JSON file for the results"),
+    baseline: Path = typer.Option(None, "--compare", "-c", help="Earlier results to compare against"),
+    queries: int = typer.Option(500, "--queries", help="Searches to time per corpus"),
+    ranking: str = typer.Option("tfidf", "--ranking", help="tfidf or bm25"),
+    backend: str = typer.Option("auto", "--backend", help="auto, python or numpy"),
+    retrieval: str = typer.Option("lexical", "--retrieval", help="lexical, dense or hybrid"),
+    per_session: int = typer.Option(
+        1000, "--messages-per-session", help="Messages per chat (set it to the corpus size for one large index)",
+    ),
+    workdir: Path = typer.Option(None, "--workdir", help="Where to build the scratch workspaces"),
+):
+    """Benchmark vector memory on synthetic multi-session chat corpora."""
+    import json
+
+    from loguru import logger
+
+    from nanobot.agent.benchmark import SIZES, BenchmarkSpec, compare, run_benchmark, save_results
+
+    logger.disable("nanobot")
+    results = []
+    for size in sizes:
+        messages = SIZES.get(size.lower()) or int(size)
+        console.print(f"Benchmarking {messages:,} messages...")
+        spec = BenchmarkSpec(
+            messages=messages, messages_per_session=per_session, queries=queries,
+            ranking=ranking, backend=backend, retrieval=retrieval,
+        )
+        result = run_benchmark(spec, workdir=workdir)
+        results.append(result)
+        save_results(results, output)  # After every size, so a long run leaves partial results
+
+    table = Table(title="Vector Memory Benchmark")
+    table.add_column("Messages", justify="right", style="cyan", no_wrap=True)
+    table.add_column("Add (msg/s)", justify="right")
+    table.add_column("Search p50", justify="right")
+    table.add_column("Search p99", justify="right")
+    table.add_column("Session load", justify="right")
+    table.add_column("Disk", justify="right")
+    table.add_column("Search RSS", justify="right")
+    for r in results:
+        delta = r.memory.get("rss_search_delta_bytes")
+        table.add_row(
+            f"{r.spec['messages']:,}",
+            f"{r.add['messages_per_second']:,.0f}",
+            f"{r.search['p50_ms']:.2f} ms",
+            f"{r.search['p99_ms']:.2f} ms",
+            f"{r.cold['p50_session_load_ms']:.2f} ms",
+            f"{r.disk['bytes'] / 2**20:.1f} MiB",
+            f"{delta / 2**20:.1f} MiB" if delta is not None else "-",
+        )
+    console.print(table)
+    console.print(f"[green]✓[/green] Results written to {output}")
+
+    if baseline:
+        rows = compare(json.loads(baseline.read_text(encoding="utf-8")), json.loads(output.read_text(encoding="utf-8")))
+        table = Table(title=f"Compared to {baseline}")
+        table.add_column("Messages", justify="right", style="cyan", no_wrap=True)
+        table.add_column("Metric")
+        table.add_column("Before", justify="right")
+        table.add_column("After", justify="right")
+        table.add_column("Change", justify="right")
+        for messages, metric, old, new, change in rows:
+            style = "green" if change and change > 0 else "red" if change and change < 0 else "dim"
+            table.add_row(
+                messages, metric, f"{old:,.3f}" if old is not None else "-", f"{new:,.3f}" if new is not None else "-",
+                f"[{style}]{change:+.1%}[/{style}]" if change is not None else "-",
+            )
+        console.print(table)
+
+
 # ============================================================================
 # Status Commands
 # ============================================================================
@@ -1,6 +1,8 @@
 """Configuration schema using Pydantic."""
 
 from pathlib import Path
+from typing import Literal
+
 from pydantic import BaseModel, Field, ConfigDict
 from pydantic.alias_generators import to_camel
 from pydantic_settings import BaseSettings
@@ -190,6 +192,7 @@ class AgentDefaults(Base):
     temperature: float = 0.1
     max_tool_iterations: int = 40
     memory_window: int = 100
+    max_concurrent_sessions: int = 4
 
 
 class AgentsConfig(Base):
@@ -282,6 +285,55 @@ class ToolsConfig(Base):
     mcp_servers: dict[str, MCPServerConfig] = Field(default_factory=dict)
 
 
+class EmbeddingConfig(Base):
+    """Embedding backend for dense retrieval."""
+
+    provider: Literal["hashing", "openai", "sentence-transformers"] = "hashing"
+    model: str = ""  # Provider default when empty
+    api_base: str | None = None  # Any OpenAI-compatible /embeddings endpoint
+    api_key: str = ""
+    dim: int = 0  # Vector size; 0 means 256 for hashing and the model's own size for openai
+
+
+class VectorRetentionConfig(Base):
+    """What vector memory keeps per session (0 disables a limit)."""
+
+    max_documents: int = 0
+    max_age_days: float = 0
+    tool_max_age_days: float = 0  # e.g. 30 to drop tool results sooner than conversation
+    collapse_duplicates: bool = False  # A new message replaces an older one with the same terms
+    dead_ratio: float = 0.3  # Rewrite a shard once this share of its entries is dead
+
+
+class VectorMemoryConfig(Base):
+    """Retrieval over past messages (vector_memory/)."""
+
+    ranking: Literal["tfidf", "bm25"] = "tfidf"
+    max_resident_shards: int = 64  # Sessions whose index is kept in RAM (LRU)
+    backend: Literal["auto", "python", "numpy"] = "auto"  # "auto" uses NumPy when installed
+    retrieval: Literal["lexical", "dense", "hybrid"] = "lexical"
+    embedding: EmbeddingConfig = Field(default_factory=EmbeddingConfig)
+    retention: VectorRetentionConfig = Field(default_factory=VectorRetentionConfig)
+    query_cache_size: int = 32  # Cached search results per session (0 disables)
+
+
+class SessionsConfig(Base):
+    """Conversation sessions (sessions/)."""
+
+    max_cached: int = 256  # Sessions kept in RAM (LRU)
+    max_cache_mb: int = 64  # Estimated memory budget for cached sessions
+    write_behind_seconds: float = 0  # Save turns in the background, at most this late (0 = before replying)
+    fsync: bool = False  # fsync session files on write, so saved turns survive a power loss
+    backend: Literal["jsonl", "sqlite"] = "jsonl"  # Switch with `nanobot sessions migrate`
+
+
+class MemoryConfig(Base):
+    """Memory and persistence configuration."""
+
+    vector: VectorMemoryConfig = Field(default_factory=VectorMemoryConfig)
+    sessions: SessionsConfig = Field(default_factory=SessionsConfig)
+
+
 class Config(BaseSettings):
     """Root configuration for nanobot."""
 
@@ -290,6 +342,7 @@ class Config(BaseSettings):
     providers: ProvidersConfig = Field(default_factory=ProvidersConfig)
     gateway: GatewayConfig = Field(default_factory=GatewayConfig)
     tools: ToolsConfig = Field(default_factory=ToolsConfig)
+    memory: MemoryConfig = Field(default_factory=MemoryConfig)
 
     @property
     def workspace_path(self) -> Path:
@@ -0,0 +1,259 @@
+"""Session model and the interface of session storage backends."""
+
+import copy
+from abc import ABC, abstractmethod
+from collections.abc import MutableSequence
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Iterator
+
+from nanobot.session.message import Message, as_dict, provider_message
+
+
+@dataclass
+class StoredState:
+    """What storage already holds for a session, so a save only writes what is new."""
+
+    messages: list[dict[str, Any]]  # The list written from; a different list means a rewrite
+    count: int  # Messages stored
+    fields: dict[str, Any]  # Metadata values as last stored (see meta_fields)
+    size: int  # Bytes stored (used to estimate the session's memory footprint)
+    appends: int = 0  # Incremental writes since the session was last written in full
+    archived: int = 0  # Leading messages moved out to compressed archive segments
+
+
+def meta_fields(session: "Session") -> dict[str, Any]:
+    """The session fields besides its messages that a save records."""
+    return {
+        "updated_at": session.updated_at.isoformat(),
+        "metadata": copy.deepcopy(session.metadata),
+        "last_consolidated": session.last_consolidated,
+        "count": len(session.messages),
+    }
+
+
+def catalog_entry(key: str, created_at: str | None, fields: dict[str, Any]) -> dict[str, Any]:
+    """Summary of a session, as listed by SessionManager.list_sessions."""
+    return {
+        "key": key,
+        "created_at": created_at,
+        "updated_at": fields.get("updated_at"),
+        "messages": fields.get("count", 0),
+        "channel": key.split(":", 1)[0] if ":" in key else None,
+    }
+
+
+class PagedMessages(MutableSequence):
+    """
+    A session's messages, of which only the newest are in memory at first.
+
+    Indexing and slicing within the loaded tail cost nothing extra; touching an
+    older message (or iterating, or changing the list other than by appending)
+    loads the rest from storage first, through ``load_older(stop)``, which
+    returns the messages before index ``stop``.
+    """
+
+    def __init__(self, tail: list[dict[str, Any]], start: int,
+                 load_older: Callable[[int], list[dict[str, Any]]]):
+        self._items = tail
+        self._start = start  # Index of the first loaded message
+        self._load_older = load_older
+
+    @property
+    def loaded(self) -> int:
+        """Messages currently in memory."""
+        return len(self._items)
+
+    def _page_in(self) -> None:
+        if self._start:
+            older = self._load_older(self._start)
+            if len(older) != self._start:
+                raise RuntimeError(f"expected {self._start} older messages, found {len(older)}")
+            self._items = older + self._items
+            self._start = 0
+
+    def release(self, index: int, load_older: Callable[[int], list[dict[str, Any]]]) -> None:
+        """Drop the messages before ``index`` from memory, to be read back by ``load_older``."""
+        if index > self._start:
+            del self._items[:index - self._start]
+            self._start = index
+        self._load_older = load_older
+
+    def __len__(self) -> int:
+        return self._start + len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1 and start >= self._start:
+                return self._items[start - self._start:max(stop - self._start, 0)]
+            self._page_in()
+            return self._items[index]
+        i = index + len(self) if index < 0 else index
+        if not 0 <= i < len(self):
+            raise IndexError("message index out of range")
+        if i < self._start:
+            self._page_in()
+            return self._items[i]
+        return self._items[i - self._start]
+
+    def __setitem__(self, index, value) -> None:
+        self._page_in()
+        self._items[index] = value
+
+    def __delitem__(self, index) -> None:
+        self._page_in()
+        del self._items[index]
+
+    def insert(self, index: int, value: dict[str, Any]) -> None:
+        self._page_in()
+        self._items.insert(index, value)
+
+    def append(self, value: dict[str, Any]) -> None:
+        self._items.append(value)
+
+    def __iter__(self):
+        self._page_in()
+        return iter(self._items)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, PagedMessages)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"PagedMessages({len(self)} messages, {len(self._items)} loaded)"
+
+
+@dataclass
+class Session:
+    """
+    A conversation session.
+
+    Stores messages in JSONL format for easy reading and persistence.
+
+    Important: Messages are append-only for LLM cache efficiency.
+    The consolidation process writes summaries to MEMORY.md/HISTORY.md
+    but does NOT modify the messages list or get_history() output.
+    """
+
+    key: str  # channel:chat_id
+    messages: list[dict[str, Any]] = field(default_factory=list)
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
+    metadata: dict[str, Any] = field(default_factory=dict)
+    last_consolidated: int = 0  # Number of messages already consolidated to files
+    _stored: StoredState | None = field(default=None, init=False, repr=False, compare=False)
+
+    def add_message(self, role: str, content: str, **kwargs: Any) -> None:
+        """Add a message to the session."""
+        msg = Message(role, content, timestamp=datetime.now(), **kwargs)
+        self.messages.append(msg)
+        self.updated_at = datetime.now()
+
+    def get_history(self, max_messages: int = 500) -> list[dict[str, Any]]:
+        """Return unconsolidated messages for LLM input, aligned to a user turn."""
+        messages = self.messages
+        end = len(messages)
+        start = min(self.last_consolidated, end)
+        if max_messages > 0:
+            start = max(start, end - max_messages)
+
+        # Drop leading non-user messages to avoid orphaned tool_result blocks
+        for i in range(start, end):
+            if messages[i].get("role") == "user":
+                start = i
+                break
+
+        # Indexed in place (no slices copied); only the provider dicts are built
+        return [provider_message(messages[i]) for i in range(start, end)]
+
+    def clear(self) -> None:
+        """Clear all messages and reset session to initial state."""
+        self.messages = []
+        self.last_consolidated = 0
+        self.updated_at = datetime.now()
+
+
+@dataclass
+class PendingWrite:
+    """A session's unsaved changes, captured by SessionStorage.prepare."""
+
+    session: Session
+    source: list[dict[str, Any]]  # The message list the changes were taken from
+    messages: list[dict[str, Any]]  # Messages to write, starting at index ``start``
+    start: int
+    fields: dict[str, Any]
+    rewrite: bool  # Replace everything stored for the session
+    stored: StoredState | None  # What storage held when the changes were captured
+
+
+class SessionStorage(ABC):
+    """
+    Where sessions are persisted.
+
+    SessionManager caches sessions and decides when to save them; a backend
+    only loads and stores them. ``prepare`` runs on the thread that owns the
+    session (the event loop), ``commit`` may run on any thread.
+
+    A backend holds sessions only: their messages, metadata and consolidation
+    offsets. Vector memory shards (snapshot and WAL) and the cron store keep
+    their own files whichever backend is selected.
+    """
+
+    name: str
+
+    @abstractmethod
+    def load(self, key: str) -> Session | None:
+        """Load a session, or None if it was never saved.
+
+        Only the unconsolidated messages need to be read; ``session.messages``
+        may be a PagedMessages that reads older ones when they are touched.
+        """
+
+    def load_full(self, key: str) -> Session | None:
+        """Load a session with all of its messages in memory."""
+        session = self.load(key)
+        if session is not None and isinstance(session.messages, PagedMessages):
+            session.messages._page_in()
+        return session
+
+    def iter_messages(self, key: str) -> Iterator[dict[str, Any]]:
+        """Every message of a stored session, oldest first, without holding them all in memory."""
+        session = self.load_full(key)
+        if session is None:
+            raise KeyError(key)
+        for message in session.messages:
+            yield as_dict(message)
+
+    def _needs_rewrite(self, session: Session, state: StoredState) -> bool:
+        """Whether to store the session in full although it was only appended to."""
+        return False
+
+    def prepare(self, session: Session) -> PendingWrite | None:
+        """Capture what storage is missing of the session, or None if it is up to date."""
+        state = session._stored
+        fields = meta_fields(session)
+        if (state is None or state.messages is not session.messages
+                or len(session.messages) < state.count or self._needs_rewrite(session, state)):
+            return PendingWrite(session, session.messages, list(session.messages), 0, fields,
+                                True, state)
+        if fields == state.fields:
+            return None
+        return PendingWrite(session, session.messages, session.messages[state.count:],
+                            state.count, fields, False, state)
+
+    @abstractmethod
+    def commit(self, pending: PendingWrite) -> None:
+        """Store prepared changes and update ``session._stored`` to match."""
+
+    @abstractmethod
+    def list(self) -> list[dict[str, Any]]:
+        """Every stored session's catalog entry, most recently updated first."""
+
+    @abstractmethod
+    def stamps(self) -> dict[str, Any]:
+        """A value per stored session key that changes whenever the session does."""
+
+    def close(self) -> None:
+        """Release any open handles."""
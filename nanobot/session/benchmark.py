@@ -0,0 +1,120 @@
+"""Memory benchmark for resident session messages: plain dicts versus Message records."""
+
+import gc
+import json
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterator
+
+from nanobot.session.base import Session
+from nanobot.session.message import Message
+
+_WORDS = [
+    "table", "friday", "garden", "report", "lisbon", "deploy", "backup", "invoice", "meeting",
+    "weather", "recipe", "flight", "budget", "server", "ticket", "review", "draft", "plan",
+]
+_TOOLS = ["web_search", "read_file", "exec", "search_history", "message"]
+
+
+@dataclass
+class MessageBenchResult:
+    representation: str  # "dict" (as loaded before) or "record" (Message)
+    messages: int
+    bytes: int  # Memory held by the loaded messages, content included
+    load_seconds: float  # Decoding the JSON lines into the representation
+    history_us: float  # One get_history(500) call
+
+    @property
+    def bytes_per_message(self) -> float:
+        return self.bytes / self.messages if self.messages else 0.0
+
+
+def synthetic_messages(n: int, seed: int = 0) -> Iterator[str]:
+    """JSON lines for ``n`` session messages, shaped like saved turns (with tool calls now and then)."""
+    rng = random.Random(seed)
+    clock = datetime(2026, 1, 1, 9, 0)
+    produced = 0
+
+    def line(**msg: Any) -> str:
+        nonlocal clock
+        clock += timedelta(seconds=rng.randint(1, 90), microseconds=rng.randint(0, 999_999))
+        return json.dumps({**msg, "timestamp": clock.isoformat()}, ensure_ascii=False)
+
+    def text(words: int) -> str:
+        return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+    while produced < n:
+        turn = [line(role="user", content=text(rng.randint(4, 20)))]
+        if rng.random() < 0.2:
+            call_id = f"call_{rng.getrandbits(48):012x}"
+            tool = rng.choice(_TOOLS)
+            turn.append(line(role="assistant", content="", tool_calls=[{
+                "id": call_id, "type": "function",
+                "function": {"name": tool, "arguments": json.dumps({"query": text(3)})},
+            }]))
+            turn.append(line(role="tool", tool_call_id=call_id, name=tool, content=text(rng.randint(10, 40))))
+        turn.append(line(role="assistant", content=text(rng.randint(8, 40))))
+        for item in turn[:n - produced]:
+            yield item
+        produced += len(turn)
+
+
+def deep_size(objects: list) -> int:
+    """Bytes held by ``objects`` and everything they reference, each shared object counted once."""
+    seen: set[int] = set()
+    stack = list(objects)
+    total = sys.getsizeof(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, Message):
+            stack.extend((obj.role, obj.content, obj.name, obj._stamp))
+            if obj.extra is not None:
+                stack.append(obj.extra)
+    return total
+
+
+def _load(fixture: Path, record: bool) -> list:
+    with open(fixture, encoding="utf-8") as f:
+        if record:
+            return [Message.from_dict(json.loads(line)) for line in f]
+        return [json.loads(line) for line in f]
+
+
+def run_message_benchmark(n: int, history: int = 500, calls: int = 200, seed: int = 0) -> list[MessageBenchResult]:
+    """Load ``n`` synthetic messages both ways and measure memory, load time and get_history."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="nanobot-msgbench-") as tmp:
+        fixture = Path(tmp) / "messages.jsonl"
+        with open(fixture, "w", encoding="utf-8") as f:
+            for line in synthetic_messages(n, seed):
+                f.write(line + "\n")
+
+        for representation in ("dict", "record"):
+            gc.collect()
+            start = time.perf_counter()
+            messages = _load(fixture, representation == "record")
+            load_seconds = time.perf_counter() - start
+
+            session = Session(key="bench:1", messages=messages, last_consolidated=max(0, n - 2 * history))
+            start = time.perf_counter()
+            for _ in range(calls):
+                session.get_history(max_messages=history)
+            history_us = (time.perf_counter() - start) / calls * 1e6
+
+            results.append(MessageBenchResult(representation, n, deep_size(messages), load_seconds, history_us))
+            del session, messages
+    return results
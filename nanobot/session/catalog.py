@@ -0,0 +1,109 @@
+"""Catalog of saved sessions, so listing them does not open every session file."""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from loguru import logger
+
+
+class SessionCatalog:
+    """
+    Summary of every saved session: key, created/updated times, message count, channel.
+
+    Stored as ``sessions/catalog.log``, one JSON line per session update; the
+    newest line for a key wins. Every SessionManager on the workspace (the
+    gateway and a CLI agent, say) appends to the same file, and each reads
+    what the others appended before answering a query. The log is rewritten
+    once it holds many more lines than sessions. If it is missing or cannot
+    be read, it is rebuilt by ``scan``, which reads the session files.
+    Safe to use from several threads.
+    """
+
+    FILE_NAME = "catalog.log"  # Not *.jsonl, so it is never mistaken for a session
+    COMPACT_MIN_LINES = 256
+
+    def __init__(self, sessions_dir: Path, scan: Callable[[], Iterable[dict[str, Any]]]):
+        self.path = sessions_dir / self.FILE_NAME
+        self._scan = scan
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._inode: int | None = None
+        self._offset = 0  # How much of the file is reflected in _entries
+        self._lines = 0
+        self._lock = threading.RLock()
+
+    def _refresh(self) -> None:
+        """Read lines appended since the last call (or everything, if the file was replaced)."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            self.rebuild()
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._entries, self._offset, self._lines = {}, 0, 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        end = data.rfind(b"\n") + 1  # A line still being written is read next time
+        try:
+            for line in data[:end].splitlines():
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+                    self._lines += 1
+        except (ValueError, KeyError) as e:
+            logger.warning("Session catalog is unreadable ({}); rebuilding it", e)
+            self.rebuild()
+            return
+        self._offset += end
+
+    def rebuild(self) -> None:
+        """Recreate the catalog from the session files."""
+        with self._lock:
+            entries = {entry["key"]: entry for entry in self._scan()}
+            self._write(entries)
+        logger.info("Rebuilt session catalog ({} sessions)", len(entries))
+
+    def _write(self, entries: dict[str, dict[str, Any]]) -> None:
+        tmp = self.path.with_suffix(".log.tmp")
+        with open(tmp, "wb") as f:
+            for entry in entries.values():
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+        os.replace(tmp, self.path)
+        stat = self.path.stat()
+        self._entries = entries
+        self._inode, self._offset, self._lines = stat.st_ino, stat.st_size, len(entries)
+
+    def update(self, entry: dict[str, Any]) -> None:
+        """Record a session's current summary."""
+        with self._lock:
+            self._update(entry)
+
+    def _update(self, entry: dict[str, Any]) -> None:
+        self._refresh()
+        if self._entries.get(entry["key"]) == entry:
+            return
+        self._entries[entry["key"]] = entry
+        if self._lines >= max(self.COMPACT_MIN_LINES, 2 * len(self._entries)):
+            self._write(self._entries)
+            return
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(line)
+            end = f.tell()
+        # If another process appended in between, its lines (and this one) are read next time
+        if end - len(line) == self._offset:
+            self._offset = end
+            self._lines += 1
+
+    def entries(self) -> list[dict[str, Any]]:
+        """Every session, most recently updated first."""
+        with self._lock:
+            self._refresh()
+            entries = list(self._entries.values())
+        return sorted(entries, key=lambda e: e.get("updated_at") or "", reverse=True)
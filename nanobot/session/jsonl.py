@@ -0,0 +1,526 @@
+"""Session storage as one JSONL file per session."""
+
+import gzip
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+
+from loguru import logger
+
+from nanobot.session.base import (
+    PagedMessages,
+    PendingWrite,
+    Session,
+    SessionStorage,
+    StoredState,
+    catalog_entry,
+    meta_fields,
+)
+from nanobot.session.catalog import SessionCatalog
+from nanobot.session.message import Message, as_dict
+from nanobot.utils.helpers import ensure_dir, safe_filename
+
+# Session files are append-only logs: a metadata record, then messages interleaved
+# with "metadata_update" trailers. A file is rewritten once it holds more
+# trailers than messages (and at least this many), so metadata-only saves
+# cannot grow it without bound.
+COMPACT_MIN_TRAILERS = 64
+
+# Once this many consolidated messages have built up in a session file, they are moved
+# to a compressed archive segment (and out of memory); see JsonlStorage
+ARCHIVE_MIN_MESSAGES = 200
+
+# Bytes read per step when scanning a session file backwards from its end
+_TAIL_BLOCK = 64 * 1024
+
+
+@dataclass
+class _Compaction(PendingWrite):
+    """A rewrite that copies the stored messages from the session file instead of from memory."""
+
+    archive_to: int = 0  # Messages before this index go to archive segments
+
+
+def archive_dir(path: Path) -> Path:
+    """Directory holding the archive segments of a session file."""
+    return path.with_suffix(".archive")
+
+
+def _segment_range(segment: Path) -> tuple[int, int] | None:
+    try:
+        start, end = segment.name.split(".", 1)[0].split("-")
+        return int(start), int(end)
+    except ValueError:
+        return None
+
+
+def _segments(path: Path, archived: int) -> list[Path]:
+    """The archive segments holding a session's first ``archived`` messages, in order."""
+    if not archived:
+        return []
+    # Segments are immutable, so of several starting at the same index any is right;
+    # one ending past ``archived`` was written by an archival that never completed
+    by_start: dict[int, tuple[int, Path]] = {}
+    for segment in archive_dir(path).glob("*.jsonl.gz"):
+        bounds = _segment_range(segment)
+        if bounds and bounds[1] <= archived and bounds[1] > by_start.get(bounds[0], (0,))[0]:
+            by_start[bounds[0]] = (bounds[1], segment)
+    chain, pos = [], 0
+    while pos < archived:
+        if pos not in by_start:
+            raise ValueError(f"archive of {path.name} is missing messages from {pos}")
+        pos, segment = by_start[pos]
+        chain.append(segment)
+    return chain
+
+
+def _is_metadata(line: bytes) -> bool:
+    # Records are written with "_type" first, so message lines never start this way
+    return line.startswith(b'{"_type": "metadata')
+
+
+def _lines_backwards(f, start: int, end: int):
+    """Yield ``(offset, line)`` for the lines in ``f[start:end]``, last line first."""
+    pos, carry = end, b""
+    while pos > start:
+        step = min(_TAIL_BLOCK, pos - start)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + carry).split(b"\n")
+        offsets = [pos]
+        for line in lines[:-1]:
+            offsets.append(offsets[-1] + len(line) + 1)
+        # The first piece may continue in the previous block, unless the scan is done
+        first = 0 if pos == start else 1
+        for i in range(len(lines) - 1, first - 1, -1):
+            yield offsets[i], lines[i]
+        carry = lines[0]
+
+
+class JsonlStorage(SessionStorage):
+    """
+    Sessions as ``sessions/<key>.jsonl`` files.
+
+    Messages added since the last save are appended to the file, followed by
+    a metadata trailer. The whole file is rewritten only when compacting,
+    after ``clear()``, or when the file is not the one this process last
+    wrote. Listing is served from a SessionCatalog next to the files.
+
+    Consolidated messages are never read by the agent again, so once enough
+    of them build up they are moved from the file into gzip-compressed,
+    immutable segments in ``sessions/<key>.archive/`` (named by the range of
+    message indices they hold) and dropped from memory. The header's
+    ``archived`` field says how many leading messages live there; the file
+    holds the rest. ``iter_messages`` streams the full history for export
+    and reindexing.
+    """
+
+    name = "jsonl"
+
+    def __init__(self, sessions_dir: Path, fsync: bool = False, legacy_dir: Path | None = None):
+        self.sessions_dir = ensure_dir(sessions_dir)
+        self.legacy_dir = legacy_dir
+        self.fsync = fsync
+        self.catalog = SessionCatalog(self.sessions_dir, self._scan_sessions)
+
+    def path(self, key: str) -> Path:
+        """The file a session is stored in."""
+        return self.sessions_dir / f"{safe_filename(key.replace(':', '_'))}.jsonl"
+
+    def load(self, key: str) -> Session | None:
+        path = self.path(key)
+        if not path.exists() and self.legacy_dir is not None:
+            legacy_path = self.legacy_dir / path.name
+            if legacy_path.exists():
+                try:
+                    shutil.move(str(legacy_path), str(path))
+                    logger.info("Migrated session {} from legacy path", key)
+                except Exception:
+                    logger.exception("Failed to migrate session {}", key)
+
+        if not path.exists():
+            return None
+        return self.load_file(path, key, lazy=True)
+
+    def load_full(self, key: str) -> Session | None:
+        path = self.path(key)
+        return self.load_file(path, key) if path.exists() else None
+
+    def load_file(self, path: Path, key: str | None = None, lazy: bool = False) -> Session | None:
+        """
+        Load a session from a JSONL file.
+
+        Args:
+            path: Session file.
+            key: Session key; defaults to the one recorded in the file (or derived from its name).
+            lazy: Read only the unconsolidated messages (found by scanning back from the end
+                of the file); older ones are loaded when first accessed.
+
+        Returns:
+            The session, or None if the file cannot be read.
+        """
+        if lazy:
+            try:
+                session = self._load_tail(path, key)
+            except Exception as e:
+                logger.warning("Failed to read the tail of session {}: {}", key or path.name, e)
+                session = None
+            if session is not None:
+                return session
+        try:
+            messages = []
+            metadata = {}
+            created_at = None
+            updated_at = None
+            last_consolidated = 0
+            archived = 0
+            trailers = 0
+            torn = None
+
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if torn is not None:
+                        raise torn
+
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        # Only the last record may be cut short (by a crash mid-append)
+                        torn = e
+                        continue
+
+                    record_type = data.get("_type")
+                    if record_type in ("metadata", "metadata_update"):
+                        if record_type == "metadata":
+                            key = key or data.get("key")
+                            created_at = datetime.fromisoformat(data["created_at"]) if data.get("created_at") else None
+                            archived = data.get("archived", 0)
+                        else:
+                            trailers += 1
+                        metadata = data.get("metadata", metadata)
+                        updated_at = datetime.fromisoformat(data["updated_at"]) if data.get("updated_at") else updated_at
+                        last_consolidated = data.get("last_consolidated", last_consolidated)
+                    else:
+                        messages.append(Message.from_dict(data))
+                size = f.tell()
+            if archived:
+                messages[:0] = self._read_archive(path, archived)
+
+            session = Session(
+                key=key or path.stem.replace("_", ":", 1),
+                messages=messages,
+                created_at=created_at or datetime.now(),
+                updated_at=updated_at or created_at or datetime.now(),
+                metadata=metadata,
+                last_consolidated=last_consolidated
+            )
+            if torn is None:
+                session._stored = StoredState(messages, len(messages), meta_fields(session), size,
+                                              trailers, archived)
+            else:
+                logger.warning("Session {} ends in a partial record; it will be rewritten on save", session.key)
+            return session
+        except Exception as e:
+            logger.warning("Failed to load session {}: {}", key or path.name, e)
+            return None
+
+    def _load_tail(self, path: Path, key: str | None) -> Session | None:
+        """Load a session's messages from ``last_consolidated`` on, or None if the file predates trailer counts."""
+        with open(path, "rb") as f:
+            header_line = f.readline()
+            header = json.loads(header_line)
+            if header.get("_type") != "metadata" or "count" not in header:
+                return None
+            header_end = f.tell()
+            size = f.seek(0, os.SEEK_END)
+            archived = header.get("archived", 0)
+
+            newest = None  # Newest full metadata record (trailer, else the header)
+            after: list[dict] = []  # Messages after it, newest first
+            before: list[dict] = []  # Messages before it still needed, newest first
+            needed = 0
+            trailers = 0
+            for offset, line in _lines_backwards(f, header_end, size):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    if offset + len(line) < size - 1:
+                        raise
+                    return None  # Torn final record: the full loader deals with it
+                if data.get("_type") == "metadata_update":
+                    trailers += 1
+                    if newest is None:
+                        if "count" not in data:
+                            return None
+                        newest = data
+                        needed = max(0, data["count"] - data["last_consolidated"])
+                elif newest is None:
+                    after.append(Message.from_dict(data))
+                elif len(before) < needed:
+                    before.append(Message.from_dict(data))
+                if newest is not None and len(before) >= needed:
+                    break
+            if newest is None:
+                # No trailer: the whole file was read, and every message is in ``after``
+                newest, start = header, archived
+                if archived + len(after) != header["count"]:
+                    raise ValueError(f"{len(after)} messages after {archived} archived, expected {header['count']}")
+            elif len(before) < needed:
+                raise ValueError(f"{len(before)} messages before the last trailer, expected {needed}")
+            else:
+                start = newest["count"] - needed
+            tail = before[::-1] + after[::-1]
+
+        messages = PagedMessages(tail, start, self._older(path)) if start else tail
+        session = Session(
+            key=key or header.get("key") or path.stem.replace("_", ":", 1),
+            messages=messages,
+            created_at=datetime.fromisoformat(header["created_at"]) if header.get("created_at") else datetime.now(),
+            updated_at=datetime.fromisoformat(newest["updated_at"]),
+            metadata=newest.get("metadata", {}),
+            last_consolidated=newest["last_consolidated"],
+        )
+        session._stored = StoredState(messages, len(messages), meta_fields(session), size,
+                                      trailers, archived)
+        return session
+
+    def _older(self, path: Path):
+        """A PagedMessages loader reading a session's first messages back from storage."""
+        def load_older(stop: int) -> list[dict[str, Any]]:
+            return [Message.from_dict(m) for m in self._iter_path(path, stop)]
+        return load_older
+
+    @staticmethod
+    def _read_archive(path: Path, archived: int) -> list[dict[str, Any]]:
+        messages = []
+        for segment in _segments(path, archived):
+            with gzip.open(segment, "rb") as f:
+                messages.extend(Message.from_dict(json.loads(line)) for line in f if line.strip())
+        if len(messages) != archived:
+            raise ValueError(f"archive of {path.name} holds {len(messages)} messages, expected {archived}")
+        return messages
+
+    def _iter_path(self, path: Path, stop: int | None = None) -> Iterator[dict[str, Any]]:
+        """Messages of a session file and its archive segments, oldest first (up to index ``stop``)."""
+        index = 0
+        with open(path, "rb") as f:
+            header = json.loads(f.readline() or b"{}")
+            if header.get("_type") != "metadata":
+                f.seek(0)
+            for segment in _segments(path, header.get("archived", 0)):
+                with gzip.open(segment, "rb") as archive:
+                    for line in archive:
+                        if stop is not None and index >= stop:
+                            return
+                        if line.strip():
+                            yield json.loads(line)
+                            index += 1
+            torn = None
+            for line in f:
+                if stop is not None and index >= stop:
+                    return
+                if not line.strip() or _is_metadata(line):
+                    continue
+                if torn is not None:
+                    raise torn
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError as e:
+                    torn = e  # Only the last record may be cut short
+                    continue
+                yield data
+                index += 1
+
+    def iter_messages(self, key: str) -> Iterator[dict[str, Any]]:
+        path = self.path(key)
+        if not path.exists():
+            raise KeyError(key)
+        yield from self._iter_path(path)
+
+    def _needs_rewrite(self, session: Session, state: StoredState) -> bool:
+        # Someone else changed the file since this process last wrote it
+        try:
+            return self.path(session.key).stat().st_size != state.size
+        except FileNotFoundError:
+            return True
+
+    def prepare(self, session: Session) -> PendingWrite | None:
+        pending = super().prepare(session)
+        if pending is None or pending.rewrite:
+            return pending
+        state = pending.stored
+        archive_to = min(session.last_consolidated, state.count)
+        if archive_to - state.archived < ARCHIVE_MIN_MESSAGES:
+            archive_to = state.archived
+        # Compact once trailers outnumber messages, and archive consolidated messages
+        if archive_to == state.archived and state.appends < max(COMPACT_MIN_TRAILERS, state.count - state.archived):
+            return pending
+        # Everything before ``archive_to`` can now be read back from storage, so it leaves memory
+        loader = self._older(self.path(session.key))
+        if isinstance(session.messages, PagedMessages):
+            session.messages.release(archive_to, loader)
+        elif archive_to:
+            session.messages = PagedMessages(session.messages[archive_to:], archive_to, loader)
+        return _Compaction(session, session.messages, pending.messages, pending.start, pending.fields,
+                           True, state, archive_to)
+
+    def commit(self, pending: PendingWrite) -> None:
+        session, fields, state = pending.session, pending.fields, pending.stored
+        path = self.path(session.key)
+        data = "".join(json.dumps(as_dict(m), ensure_ascii=False) + "\n" for m in pending.messages).encode("utf-8")
+        if not pending.rewrite:
+            # New messages, then a trailer recording the metadata fields
+            trailer = json.dumps({"_type": "metadata_update", **fields}, ensure_ascii=False) + "\n"
+            with open(path, "ab") as f:
+                f.write(data + trailer.encode("utf-8"))
+                self._sync(f)
+                size = f.tell()
+            session._stored = StoredState(pending.source, pending.start + len(pending.messages), fields,
+                                          size, state.appends + 1, state.archived)
+        else:
+            # Compacted: one metadata record, then the messages not archived
+            archived = pending.archive_to if isinstance(pending, _Compaction) else 0
+            header = {
+                "_type": "metadata",
+                "key": session.key,
+                "created_at": session.created_at.isoformat(),
+                **fields,
+                "archived": archived,
+            }
+            tmp = path.with_suffix(".jsonl.tmp")
+            with open(tmp, "wb") as f:
+                f.write((json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8"))
+                if isinstance(pending, _Compaction):
+                    self._copy_stored(path, f, pending)
+                f.write(data)
+                self._sync(f)
+                size = f.tell()
+            os.replace(tmp, path)
+            self._sync_dir(path.parent)
+            self._drop_stale_segments(path, archived)
+            session._stored = StoredState(pending.source, pending.start + len(pending.messages), fields,
+                                          size, 0, archived)
+        try:
+            self.catalog.update(catalog_entry(session.key, session.created_at.isoformat(), fields))
+        except Exception as e:
+            logger.warning("Failed to update the session catalog for {}: {}", session.key, e)
+
+    def _copy_stored(self, path: Path, out, pending: _Compaction) -> None:
+        """Copy the messages in a session file to ``out``, moving those before ``archive_to`` to a new segment."""
+        state = pending.stored
+        archive, raw, segment = None, None, None
+        if pending.archive_to > state.archived:
+            segment = ensure_dir(archive_dir(path)) / f"{state.archived:010d}-{pending.archive_to:010d}.jsonl.gz"
+            raw = open(segment.with_suffix(".tmp"), "wb")
+            archive = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0)
+        index = state.archived
+        try:
+            with open(path, "rb") as src:
+                src.readline()  # Header
+                for line in src:
+                    if not line.strip() or _is_metadata(line):
+                        continue
+                    (archive if index < pending.archive_to else out).write(line)
+                    index += 1
+            if index != state.count:
+                raise ValueError(f"{path.name} holds {index} messages, expected {state.count}")
+            if archive is not None:
+                archive.close()
+                self._sync(raw)
+        finally:
+            if raw is not None:
+                raw.close()
+        if segment is not None:
+            os.replace(raw.name, segment)
+            self._sync_dir(segment.parent)
+
+    @staticmethod
+    def _drop_stale_segments(path: Path, archived: int) -> None:
+        """Delete archive segments the session file no longer refers to (after clear(), or a failed archival)."""
+        directory = archive_dir(path)
+        if not directory.exists():
+            return
+        keep = set(_segments(path, archived))
+        for segment in directory.iterdir():
+            if segment not in keep:
+                segment.unlink(missing_ok=True)
+        if not keep:
+            directory.rmdir()
+
+    def _sync(self, f) -> None:
+        if self.fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync_dir(self, directory: Path) -> None:
+        if self.fsync and hasattr(os, "O_DIRECTORY"):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)  # Make a rename itself durable
+            finally:
+                os.close(fd)
+
+    def list(self) -> list[dict[str, Any]]:
+        return [{**entry, "path": str(self.path(entry["key"]))} for entry in self.catalog.entries()]
+
+    def stamps(self) -> dict[str, Any]:
+        stamps = {}
+        for path in sorted(self.sessions_dir.glob("*.jsonl")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    header = json.loads(f.readline() or "{}")
+                stat = path.stat()
+            except (OSError, ValueError):
+                continue
+            key = header.get("key") or path.stem.replace("_", ":", 1)
+            stamps[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        return stamps
+
+    def _scan_sessions(self):
+        """Catalog entries read from the session files themselves (to rebuild the catalog)."""
+        for path in self.sessions_dir.glob("*.jsonl"):
+            try:
+                # Read the metadata line, plus the trailer ending the file if there is one
+                with open(path, encoding="utf-8") as f:
+                    first_line = f.readline().strip()
+                if not first_line:
+                    continue
+                data = json.loads(first_line)
+                if data.get("_type") != "metadata":
+                    continue
+                key = data.get("key") or path.stem.replace("_", ":", 1)
+                latest = self._last_trailer(path) or data
+                count = latest.get("count")
+                if count is None:  # Written before message counts were recorded
+                    session = self.load_file(path, key)
+                    count = len(session.messages) if session else 0
+                yield catalog_entry(key, data.get("created_at"), {
+                    "updated_at": latest.get("updated_at", data.get("updated_at")),
+                    "count": count,
+                })
+            except Exception:
+                continue
+
+    @staticmethod
+    def _last_trailer(path: Path) -> dict[str, Any] | None:
+        """The metadata trailer ending a session file, if its last record is one."""
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - 4096))
+            tail = f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+        if b'"metadata_update"' not in tail:
+            return None
+        try:
+            data = json.loads(tail)
+        except ValueError:
+            return None
+        return data if data.get("_type") == "metadata_update" else None
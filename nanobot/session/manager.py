@@ -1,96 +1,95 @@
 """Session management for conversation history."""
 
-import json
-import shutil
+import asyncio
+import weakref
+from collections import OrderedDict
 from pathlib import Path
-from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 from loguru import logger
 
-from nanobot.utils.helpers import ensure_dir, safe_filename
+from nanobot.session.base import PagedMessages, PendingWrite, Session, SessionStorage, meta_fields
 
+if TYPE_CHECKING:
+    from nanobot.config.schema import SessionsConfig
 
-@dataclass
-class Session:
-    """
-    A conversation session.
+__all__ = ["PagedMessages", "Session", "SessionManager", "open_storage"]
 
-    Stores messages in JSONL format for easy reading and persistence.
+BACKENDS = ("jsonl", "sqlite")
 
-    Important: Messages are append-only for LLM cache efficiency.
-    The consolidation process writes summaries to MEMORY.md/HISTORY.md
-    but does NOT modify the messages list or get_history() output.
-    """
 
-    key: str  # channel:chat_id
-    messages: list[dict[str, Any]] = field(default_factory=list)
-    created_at: datetime = field(default_factory=datetime.now)
-    updated_at: datetime = field(default_factory=datetime.now)
-    metadata: dict[str, Any] = field(default_factory=dict)
-    last_consolidated: int = 0  # Number of messages already consolidated to files
-    
-    def add_message(self, role: str, content: str, **kwargs: Any) -> None:
-        """Add a message to the session."""
-        msg = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat(),
-            **kwargs
-        }
-        self.messages.append(msg)
-        self.updated_at = datetime.now()
-    
-    def get_history(self, max_messages: int = 500) -> list[dict[str, Any]]:
-        """Return unconsolidated messages for LLM input, aligned to a user turn."""
-        unconsolidated = self.messages[self.last_consolidated:]
-        sliced = unconsolidated[-max_messages:]
-
-        # Drop leading non-user messages to avoid orphaned tool_result blocks
-        for i, m in enumerate(sliced):
-            if m.get("role") == "user":
-                sliced = sliced[i:]
-                break
-
-        out: list[dict[str, Any]] = []
-        for m in sliced:
-            entry: dict[str, Any] = {"role": m["role"], "content": m.get("content", "")}
-            for k in ("tool_calls", "tool_call_id", "name"):
-                if k in m:
-                    entry[k] = m[k]
-            out.append(entry)
-        return out
-    
-    def clear(self) -> None:
-        """Clear all messages and reset session to initial state."""
-        self.messages = []
-        self.last_consolidated = 0
-        self.updated_at = datetime.now()
+def open_storage(workspace: Path, backend: str = "jsonl", fsync: bool = False) -> SessionStorage:
+    """The session storage of a workspace: ``jsonl`` files or a ``sqlite`` database."""
+    sessions_dir = workspace / "sessions"
+    if backend == "jsonl":
+        from nanobot.session.jsonl import JsonlStorage
+
+        return JsonlStorage(sessions_dir, fsync=fsync, legacy_dir=Path.home() / ".nanobot" / "sessions")
+    if backend == "sqlite":
+        from nanobot.session.sqlite import SqliteStorage
+
+        return SqliteStorage(sessions_dir / SqliteStorage.FILE_NAME, fsync=fsync)
+    raise ValueError(f"unknown session backend '{backend}', expected one of {', '.join(BACKENDS)}")
 
 
 class SessionManager:
     """
     Manages conversation sessions.
 
-    Sessions are stored as JSONL files in the sessions directory.
+    Sessions are stored by a SessionStorage backend: JSONL files in the
+    sessions directory (the default) or a SQLite database. Loaded sessions are kept in an LRU cache bounded by count and by estimated size;
+    a session with unsaved changes is saved when it is evicted.
+
+    With ``write_behind`` set, ``save()`` only marks the session as unsaved
+    and a background task writes unsaved sessions at least that often (and
+    promptly after an eviction), so turns do not wait for the disk. Writes
+    are serialized on the event loop and done in a worker thread. ``close()``
+    writes whatever is left. Outside an event loop, saves write immediately.
     """
 
-    def __init__(self, workspace: Path):
+    MAX_CACHED = 256
+    MAX_CACHE_BYTES = 64 * 1024 * 1024
+    # Rough ratio of a session's in-memory size to its JSONL size
+    OBJECT_OVERHEAD = 2
+
+    def __init__(self, workspace: Path, max_cached: int | None = None,
+                 max_cache_bytes: int | None = None, write_behind: float = 0,
+                 fsync: bool = False, backend: str = "jsonl"):
         self.workspace = workspace
-        self.sessions_dir = ensure_dir(self.workspace / "sessions")
-        self.legacy_sessions_dir = Path.home() / ".nanobot" / "sessions"
-        self._cache: dict[str, Session] = {}
-    
-    def _get_session_path(self, key: str) -> Path:
-        """Get the file path for a session."""
-        safe_key = safe_filename(key.replace(":", "_"))
-        return self.sessions_dir / f"{safe_key}.jsonl"
-
-    def _get_legacy_session_path(self, key: str) -> Path:
-        """Legacy global session path (~/.nanobot/sessions/)."""
-        safe_key = safe_filename(key.replace(":", "_"))
-        return self.legacy_sessions_dir / f"{safe_key}.jsonl"
+        self.storage = open_storage(workspace, backend, fsync)
+        self.max_cached = max_cached or self.MAX_CACHED
+        self.max_cache_bytes = max_cache_bytes or self.MAX_CACHE_BYTES
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+        # Cached sessions, least recently used first, with their estimated sizes
+        self._cache: OrderedDict[str, Session] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._cache_bytes = 0
+        # Evicted sessions something else still holds (a turn in progress, a consolidation
+        # task): handed back as they are, so a live session never gets a second copy
+        self._evicted: weakref.WeakValueDictionary[str, Session] = weakref.WeakValueDictionary()
+
+        self.write_behind = write_behind  # Seconds a saved change may wait (0 writes at once)
+        self._dirty: dict[str, Session] = {}  # Saved but not yet written (write-behind)
+        self._inflight: dict[str, Session] = {}  # Being written by the background writer
+        self._writer: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, workspace: Path, config: "SessionsConfig") -> "SessionManager":
+        """Build the manager described by ``memory.sessions`` in the config."""
+        return cls(
+            workspace,
+            max_cached=config.max_cached,
+            max_cache_bytes=config.max_cache_mb * 1024 * 1024,
+            write_behind=config.write_behind_seconds,
+            fsync=config.fsync,
+            backend=config.backend,
+        )
     
     def get_or_create(self, key: str) -> Session:
         """
@@ -102,111 +101,191 @@ class SessionManager:
         Returns:
             The session.
         """
-        if key in self._cache:
-            return self._cache[key]
-        
-        session = self._load(key)
+        session = self._cache.get(key)
+        if session is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return session
+
+        self.cache_misses += 1
+        # A session still on its way to storage is handed back as it is, not reloaded from the old file
+        session = (self._dirty.get(key) or self._inflight.get(key) or self._evicted.pop(key, None)
+                   or self.storage.load(key))
         if session is None:
             session = Session(key=key)
-        
-        self._cache[key] = session
+
+        self._remember(session)
         return session
+
+    def _remember(self, session: Session) -> None:
+        """Put a session at the most recently used end of the cache and evict to fit."""
+        key = session.key
+        size = 0
+        if session._stored:
+            size = session._stored.size * self.OBJECT_OVERHEAD
+            if isinstance(session.messages, PagedMessages):
+                # Only part of what is stored is in memory (archived messages are not counted in size)
+                stored = max(len(session.messages) - session._stored.archived, 1)
+                size = size * min(session.messages.loaded, stored) // stored
+        self._cache_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._cache[key] = session
+        self._cache.move_to_end(key)
+
+        while len(self._cache) > 1 and (len(self._cache) > self.max_cached
+                                        or self._cache_bytes > self.max_cache_bytes):
+            old_key, old = self._cache.popitem(last=False)
+            self._cache_bytes -= self._sizes.pop(old_key)
+            self.cache_evictions += 1
+            if self.is_dirty(old):
+                if self._defer(old):
+                    self._wake.set()  # Write it now rather than at the next interval
+                else:
+                    try:
+                        self._write(old)
+                    except Exception:
+                        logger.exception("Failed to save evicted session {}", old_key)
+            self._evicted[old_key] = old
+
+    @staticmethod
+    def is_dirty(session: Session) -> bool:
+        """Whether the session has changes its storage does not have yet."""
+        state = session._stored
+        if state is None:
+            return bool(session.messages)
+        return (state.messages is not session.messages or state.count != len(session.messages)
+                or state.fields != meta_fields(session))
     
-    def _load(self, key: str) -> Session | None:
-        """Load a session from disk."""
-        path = self._get_session_path(key)
-        if not path.exists():
-            legacy_path = self._get_legacy_session_path(key)
-            if legacy_path.exists():
+    def save(self, session: Session) -> None:
+        """
+        Save a session to storage (or, in write-behind mode, mark it for the background writer).
+
+        Only messages added since the last save, and the metadata fields, are
+        written; the whole session is rewritten only after ``clear()``, when
+        the storage backend compacts it, or when another process changed it.
+        """
+        if not self._defer(session):
+            self._write(session)
+        self._remember(session)
+
+    def _defer(self, session: Session) -> bool:
+        """Leave the session to the background writer, if write-behind is on and can run."""
+        if not self.write_behind:
+            return False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._writer is None or self._writer.done() or self._writer.get_loop() is not loop:
+            self._writer = loop.create_task(self._run_writer())
+        self._dirty[session.key] = session
+        return True
+
+    async def _run_writer(self) -> None:
+        """Write unsaved sessions every interval or when woken, until close() sets the stop event."""
+        while not self._stop.is_set():
+            waits = [asyncio.ensure_future(self._wake.wait()), asyncio.ensure_future(self._stop.wait())]
+            try:
+                await asyncio.wait(waits, timeout=self.write_behind, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for wait in waits:
+                    wait.cancel()
+            self._wake.clear()
+            try:
+                await self.flush_async()
+            except Exception:
+                logger.exception("Background session write failed")
+
+    async def flush_async(self) -> int:
+        """Write every session marked by save(), off the event loop; returns how many were written."""
+        async with self._flush_lock:
+            sessions, self._dirty = list(self._dirty.values()), {}
+            self._inflight = {session.key: session for session in sessions}
+            writes = []
+            for session in sessions:
                 try:
-                    shutil.move(str(legacy_path), str(path))
-                    logger.info("Migrated session {} from legacy path", key)
+                    pending = self._prepare(session)
                 except Exception:
-                    logger.exception("Failed to migrate session {}", key)
+                    logger.exception("Failed to save session {}", session.key)
+                    continue
+                if pending is not None:
+                    writes.append(pending)
+            try:
+                if writes:
+                    failed = await asyncio.to_thread(self._commit_all, writes)
+                    for session in failed:
+                        self._dirty.setdefault(session.key, session)  # Retried next time
+            finally:
+                self._inflight = {}
+            return len(writes)
 
-        if not path.exists():
-            return None
+    def _commit_all(self, writes: list[PendingWrite]) -> list[Session]:
+        failed = []
+        for pending in writes:
+            try:
+                self.storage.commit(pending)
+            except Exception:
+                logger.exception("Failed to save session {}", pending.session.key)
+                failed.append(pending.session)
+        return failed
 
-        try:
-            messages = []
-            metadata = {}
-            created_at = None
-            last_consolidated = 0
-
-            with open(path, encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    data = json.loads(line)
-
-                    if data.get("_type") == "metadata":
-                        metadata = data.get("metadata", {})
-                        created_at = datetime.fromisoformat(data["created_at"]) if data.get("created_at") else None
-                        last_consolidated = data.get("last_consolidated", 0)
-                    else:
-                        messages.append(data)
-
-            return Session(
-                key=key,
-                messages=messages,
-                created_at=created_at or datetime.now(),
-                metadata=metadata,
-                last_consolidated=last_consolidated
-            )
-        except Exception as e:
-            logger.warning("Failed to load session {}: {}", key, e)
-            return None
-    
-    def save(self, session: Session) -> None:
-        """Save a session to disk."""
-        path = self._get_session_path(session.key)
-
-        with open(path, "w", encoding="utf-8") as f:
-            metadata_line = {
-                "_type": "metadata",
-                "key": session.key,
-                "created_at": session.created_at.isoformat(),
-                "updated_at": session.updated_at.isoformat(),
-                "metadata": session.metadata,
-                "last_consolidated": session.last_consolidated
-            }
-            f.write(json.dumps(metadata_line, ensure_ascii=False) + "\n")
-            for msg in session.messages:
-                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
-
-        self._cache[session.key] = session
+    async def close(self) -> None:
+        """Stop the background writer and write every unsaved session."""
+        if self._writer is not None:
+            if not self._writer.done() and self._writer.get_loop() is asyncio.get_running_loop():
+                self._stop.set()  # The writer finishes its write, flushes once more and returns
+                await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+            # Nothing waits on these now; fresh ones bind to whichever loop starts the next writer
+            self._wake, self._stop = asyncio.Event(), asyncio.Event()
+            if not self._flush_lock.locked():
+                self._flush_lock = asyncio.Lock()
+        self.flush()
+
+    def flush(self) -> int:
+        """Write every session with unsaved changes now; returns how many were written."""
+        dirty = {key: s for key, s in self._cache.items() if self.is_dirty(s)}
+        dirty.update(self._dirty)
+        self._dirty = {}
+        for session in dirty.values():
+            self._write(session)
+        return len(dirty)
+
+    def _write(self, session: Session) -> None:
+        pending = self._prepare(session)
+        if pending is not None:
+            self.storage.commit(pending)
+
+    def _prepare(self, session: Session) -> PendingWrite | None:
+        """Capture what storage is missing of a session (on the thread that owns the session)."""
+        return self.storage.prepare(session)
+
+    def cache_stats(self) -> dict:
+        """Session cache size and counters since startup."""
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "sessions": len(self._cache),
+            "bytes": self._cache_bytes,
+            "unsaved": len(self._dirty),
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "evictions": self.cache_evictions,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+        }
     
     def invalidate(self, key: str) -> None:
-        """Remove a session from the in-memory cache."""
+        """Remove a session from the in-memory cache (one not yet written stays until it is)."""
         self._cache.pop(key, None)
+        self._cache_bytes -= self._sizes.pop(key, 0)
+        self._evicted.pop(key, None)
     
     def list_sessions(self) -> list[dict[str, Any]]:
         """
-        List all sessions.
-        
+        List all sessions, most recently updated first.
+
+        Served from the backend's catalog, without loading any session.
+
         Returns:
-            List of session info dicts.
+            List of session info dicts (key, created_at, updated_at, messages, channel, path).
         """
-        sessions = []
-        
-        for path in self.sessions_dir.glob("*.jsonl"):
-            try:
-                # Read just the metadata line
-                with open(path, encoding="utf-8") as f:
-                    first_line = f.readline().strip()
-                    if first_line:
-                        data = json.loads(first_line)
-                        if data.get("_type") == "metadata":
-                            key = data.get("key") or path.stem.replace("_", ":", 1)
-                            sessions.append({
-                                "key": key,
-                                "created_at": data.get("created_at"),
-                                "updated_at": data.get("updated_at"),
-                                "path": str(path)
-                            })
-            except Exception:
-                continue
-        
-        return sorted(sessions, key=lambda x: x.get("updated_at", ""), reverse=True)
+        return self.storage.list()
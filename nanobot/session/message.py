@@ -0,0 +1,170 @@
+"""Compact in-memory record for session messages."""
+
+import sys
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime, timedelta
+from typing import Any, Iterator
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_DAY = _EPOCH.toordinal()
+_MICROSECOND = timedelta(microseconds=1)
+_ABSENT: Any = object()  # A key the message does not have
+
+# Keys copied into provider messages besides role and content
+PROVIDER_KEYS = ("tool_calls", "tool_call_id", "name")
+
+
+def _micros(value: datetime) -> int:
+    """Microseconds since 1970-01-01 of a naive datetime."""
+    days = value.toordinal() - _EPOCH_DAY
+    seconds = days * 86400 + value.hour * 3600 + value.minute * 60 + value.second
+    return seconds * 1_000_000 + value.microsecond
+
+
+class Message(MutableMapping):
+    """
+    A session message held in slots rather than a dict.
+
+    It reads and writes like the message dict it replaces (``m["role"]``,
+    ``m.get("content")``, ``"tool_calls" in m``, ``dict(m)``), so code that
+    handles messages does not need to know. Role and name strings are
+    interned, a timestamp string is kept as loaded (a naive ``datetime`` is
+    kept as integer microseconds and read back as its ISO string), and keys
+    other than the common ones go to an ``extra`` dict that only exists when
+    there are any.
+    """
+
+    __slots__ = ("role", "content", "name", "_stamp", "extra")
+
+    def __init__(self, role: str, content: Any = _ABSENT, **fields: Any):
+        self.role = sys.intern(role)
+        self.content = content
+        self.name = _ABSENT
+        self._stamp: str | int | None = None  # The timestamp string, or microseconds of a datetime
+        self.extra: dict[str, Any] | None = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any], skip: tuple[str, ...] = ()) -> "Message":
+        """Build a record from a message dict (as loaded from storage or returned by a provider)."""
+        msg = cls.__new__(cls)
+        msg.role = msg.content = msg.name = _ABSENT
+        msg._stamp = None
+        msg.extra = None
+        for key, value in data.items():
+            # The common keys inline: this runs for every message loaded
+            if key == "role" and isinstance(value, str):
+                msg.role = sys.intern(value)
+            elif key == "content":
+                msg.content = value
+            elif key == "timestamp" and isinstance(value, str):
+                msg._stamp = value
+            elif key not in skip:
+                msg[key] = value
+        return msg
+
+    def copy(self) -> "Message":
+        """A shallow copy, as ``dict.copy()`` would make."""
+        msg = Message.__new__(Message)
+        msg.role, msg.content, msg.name, msg._stamp = self.role, self.content, self.name, self._stamp
+        msg.extra = dict(self.extra) if self.extra is not None else None
+        return msg
+
+    def to_dict(self) -> dict[str, Any]:
+        """The message as a plain dict, e.g. to serialize it."""
+        return dict(self.items())
+
+    def to_provider(self) -> dict[str, Any]:
+        """The message as sent to the LLM: role, content and any tool-call fields."""
+        out: dict[str, Any] = {"role": self.role, "content": "" if self.content is _ABSENT else self.content}
+        if self.extra:
+            for key in ("tool_calls", "tool_call_id"):
+                if key in self.extra:
+                    out[key] = self.extra[key]
+        if self.name is not _ABSENT:
+            out["name"] = self.name
+        return out
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role" or key == "content" or key == "name":
+            value = getattr(self, key)
+            if value is _ABSENT:
+                raise KeyError(key)
+            return value
+        if key == "timestamp" and self._stamp is not None:
+            stamp = self._stamp
+            return stamp if isinstance(stamp, str) else (_EPOCH + stamp * _MICROSECOND).isoformat()
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == "role" or key == "name":
+            setattr(self, key, sys.intern(value) if isinstance(value, str) else value)
+        elif key == "content":
+            self.content = value
+        elif key == "timestamp" and (isinstance(value, str) or (isinstance(value, datetime) and value.tzinfo is None)):
+            self._stamp = value if isinstance(value, str) else _micros(value)
+            if self.extra:
+                self.extra.pop("timestamp", None)
+        else:
+            if key == "timestamp":
+                self._stamp = None  # Kept as given in extra, e.g. an aware datetime
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in ("role", "content", "name"):
+            if getattr(self, key) is _ABSENT:
+                raise KeyError(key)
+            setattr(self, key, _ABSENT)
+        elif key == "timestamp" and self._stamp is not None:
+            self._stamp = None
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.role is not _ABSENT:
+            yield "role"
+        if self.content is not _ABSENT:
+            yield "content"
+        if self.name is not _ABSENT:
+            yield "name"
+        if self.extra:
+            yield from self.extra
+        if self._stamp is not None:
+            yield "timestamp"
+
+    def __len__(self) -> int:
+        return ((self.role is not _ABSENT) + (self.content is not _ABSENT) + (self.name is not _ABSENT)
+                + (self._stamp is not None) + len(self.extra or ()))
+
+    def __contains__(self, key: object) -> bool:
+        if key in ("role", "content", "name"):
+            return getattr(self, key) is not _ABSENT  # type: ignore[arg-type]
+        if key == "timestamp" and self._stamp is not None:
+            return True
+        return self.extra is not None and key in self.extra
+
+    def __repr__(self) -> str:
+        return f"Message({self.to_dict()!r})"
+
+
+def as_dict(message: Mapping[str, Any]) -> Mapping[str, Any]:
+    """A message in a form ``json.dumps`` accepts."""
+    return message.to_dict() if isinstance(message, Message) else message
+
+
+def provider_message(message: Mapping[str, Any]) -> dict[str, Any]:
+    """A session message as sent to the LLM."""
+    if isinstance(message, Message):
+        return message.to_provider()
+    entry: dict[str, Any] = {"role": message["role"], "content": message.get("content", "")}
+    for key in PROVIDER_KEYS:
+        if key in message:
+            entry[key] = message[key]
+    return entry
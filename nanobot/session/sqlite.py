@@ -0,0 +1,210 @@
+"""Session storage in a single SQLite database."""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+
+from nanobot.session.base import (
+    PagedMessages,
+    PendingWrite,
+    Session,
+    SessionStorage,
+    StoredState,
+    catalog_entry,
+    meta_fields,
+)
+from nanobot.session.message import Message, as_dict
+from nanobot.utils.helpers import ensure_dir
+
+SCHEMA_VERSION = 1
+
+# Rows fetched per query when streaming a session's messages
+_BATCH = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    last_consolidated INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_updated ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    session_key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    timestamp TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (session_key, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_by_time ON messages (session_key, timestamp);
+"""
+
+# Statements are constant strings, so sqlite3's statement cache prepares each once per connection
+_SELECT_SESSION = (
+    "SELECT created_at, updated_at, metadata, last_consolidated, message_count, bytes "
+    "FROM sessions WHERE key = ?"
+)
+_SELECT_MESSAGES = "SELECT data FROM messages WHERE session_key = ? AND idx >= ? AND idx < ? ORDER BY idx"
+_SELECT_COUNT = "SELECT message_count FROM sessions WHERE key = ?"
+_DELETE_MESSAGES = "DELETE FROM messages WHERE session_key = ? AND idx >= ?"
+_INSERT_MESSAGE = "INSERT INTO messages (session_key, idx, timestamp, data) VALUES (?, ?, ?, ?)"
+_UPSERT_SESSION = """
+INSERT INTO sessions (key, created_at, updated_at, metadata, last_consolidated, message_count, bytes, version)
+VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+ON CONFLICT (key) DO UPDATE SET
+    created_at = excluded.created_at,
+    updated_at = excluded.updated_at,
+    metadata = excluded.metadata,
+    last_consolidated = excluded.last_consolidated,
+    message_count = excluded.message_count,
+    bytes = excluded.bytes,
+    version = sessions.version + 1
+"""
+_LIST_SESSIONS = "SELECT key, created_at, updated_at, message_count FROM sessions ORDER BY updated_at DESC"
+_SESSION_VERSIONS = "SELECT key, version FROM sessions"
+
+
+class SqliteStorage(SessionStorage):
+    """
+    Sessions in ``sessions/sessions.db``: a row per session and a row per message.
+
+    The database runs in WAL mode, so loads and listings proceed while a save
+    is being written, and every save is a single transaction: it inserts the
+    new message rows and updates the session row, so a crash leaves the
+    session as it was either before or after. Reads and writes use separate
+    connections (each behind its own lock), so a save on the background
+    writer thread does not hold up a load on the event loop.
+    """
+
+    name = "sqlite"
+    FILE_NAME = "sessions.db"
+
+    def __init__(self, db_path: Path, fsync: bool = False):
+        ensure_dir(db_path.parent)
+        self.db_path = db_path
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = self._connect(fsync)
+        with self._write_lock:
+            if self._writer.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self._writer.executescript(_SCHEMA)
+                self._writer.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._reader = self._connect(fsync)
+
+    def _connect(self, fsync: bool) -> sqlite3.Connection:
+        # Autocommit mode: transactions are opened explicitly where they are needed
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        # NORMAL only risks the last transactions on power loss, never corruption
+        conn.execute(f"PRAGMA synchronous = {'FULL' if fsync else 'NORMAL'}")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _read_rows(self, key: str, start: int, stop: int) -> list[tuple[str]]:
+        with self._read_lock:
+            return self._reader.execute(_SELECT_MESSAGES, (key, start, stop)).fetchall()
+
+    def _read_messages(self, key: str, start: int, stop: int) -> list[dict[str, Any]]:
+        return [Message.from_dict(json.loads(data)) for (data,) in self._read_rows(key, start, stop)]
+
+    def load(self, key: str) -> Session | None:
+        with self._read_lock:
+            conn = self._reader
+            conn.execute("BEGIN")  # The session row and its messages from one snapshot
+            try:
+                row = conn.execute(_SELECT_SESSION, (key,)).fetchone()
+                if row is None:
+                    return None
+                created_at, updated_at, metadata, last_consolidated, count, size = row
+                start = min(last_consolidated, count)
+                tail = [Message.from_dict(json.loads(data)) for (data,) in
+                        conn.execute(_SELECT_MESSAGES, (key, start, count)).fetchall()]
+            finally:
+                conn.execute("COMMIT")
+
+        messages = PagedMessages(tail, start, lambda stop: self._read_messages(key, 0, stop)) if start else tail
+        session = Session(
+            key=key,
+            messages=messages,
+            created_at=datetime.fromisoformat(created_at),
+            updated_at=datetime.fromisoformat(updated_at),
+            metadata=json.loads(metadata),
+            last_consolidated=last_consolidated,
+        )
+        session._stored = StoredState(messages, count, meta_fields(session), size)
+        return session
+
+    def iter_messages(self, key: str) -> Iterator[dict[str, Any]]:
+        with self._read_lock:
+            row = self._reader.execute(_SELECT_COUNT, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        for start in range(0, row[0], _BATCH):
+            for (data,) in self._read_rows(key, start, min(start + _BATCH, row[0])):
+                yield json.loads(data)
+
+    def _needs_rewrite(self, session: Session, state: StoredState) -> bool:
+        # Another process saved the session since it was loaded here
+        with self._read_lock:
+            row = self._reader.execute(_SELECT_COUNT, (session.key,)).fetchone()
+        return row is None or row[0] != state.count
+
+    def commit(self, pending: PendingWrite) -> None:
+        session, fields = pending.session, pending.fields
+        key = session.key
+        rows = [
+            (key, pending.start + i, msg.get("timestamp"), json.dumps(as_dict(msg), ensure_ascii=False))
+            for i, msg in enumerate(pending.messages)
+        ]
+        size = sum(len(row[3]) for row in rows)
+        if not pending.rewrite:
+            size += pending.stored.size
+        count = pending.start + len(rows)
+
+        with self._write_lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(_DELETE_MESSAGES, (key, pending.start))
+                conn.executemany(_INSERT_MESSAGE, rows)
+                conn.execute(_UPSERT_SESSION, (
+                    key,
+                    session.created_at.isoformat(),
+                    fields["updated_at"],
+                    json.dumps(fields["metadata"], ensure_ascii=False),
+                    fields["last_consolidated"],
+                    count,
+                    size,
+                ))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        session._stored = StoredState(pending.source, count, fields, size)
+
+    def list(self) -> list[dict[str, Any]]:
+        with self._read_lock:
+            rows = self._reader.execute(_LIST_SESSIONS).fetchall()
+        return [
+            {**catalog_entry(key, created_at, {"updated_at": updated_at, "count": count}),
+             "path": str(self.db_path)}
+            for key, created_at, updated_at, count in rows
+        ]
+
+    def stamps(self) -> dict[str, Any]:
+        with self._read_lock:
+            rows = self._reader.execute(_SESSION_VERSIONS).fetchall()
+        return {key: {"version": version} for key, version in rows}
+
+    def close(self) -> None:
+        with self._read_lock:
+            self._reader.close()
+        with self._write_lock:
+            self._writer.close()
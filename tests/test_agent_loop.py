@@ -0,0 +1,108 @@
+"""Tests for the per-session message index on the bus and the agent's session workers."""
+
+import asyncio
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from nanobot.agent.loop import AgentLoop
+from nanobot.bus.events import InboundMessage, OutboundMessage
+from nanobot.bus.queue import MessageBus
+
+
+@pytest.mark.asyncio
+async def test_bus_indexes_pending_messages_by_session() -> None:
+    bus = MessageBus()
+    for chat_id, content in [("a", "a1"), ("b", "b1"), ("a", "a2"), ("a", "a3"), ("b", "b2")]:
+        await bus.publish_inbound(InboundMessage(channel="telegram", sender_id="u", chat_id=chat_id, content=content))
+
+    assert (await bus.consume_inbound()).content == "a1"
+    bus.hold_session("telegram:a")
+    # Messages of a held session are passed over and stay in its index
+    assert (await bus.consume_inbound()).content == "b1"
+    assert bus.next_for_session("telegram:a").content == "a2"
+    assert [m.content for m in bus.drain_for_session("telegram:a")] == ["a3"]
+    assert bus.drain_for_session("telegram:a") == [] and bus.inbound_size == 1
+    bus.release_session("telegram:a")
+
+    await bus.publish_inbound(InboundMessage(channel="telegram", sender_id="u", chat_id="a", content="a4"))
+    assert [(await bus.consume_inbound()).content for _ in range(2)] == ["b2", "a4"]
+    assert bus.inbound_size == 0
+
+
+@pytest.mark.asyncio
+async def test_sessions_run_concurrently_and_in_order(tmp_path: Path) -> None:
+    bus = MessageBus()
+    provider = MagicMock()
+    provider.get_default_model.return_value = "test-model"
+    loop = AgentLoop(bus=bus, provider=provider, workspace=tmp_path, max_concurrent_sessions=2)
+
+    release = asyncio.Event()
+    active = peak = 0
+
+    async def _fake_process(msg, session_key=None, on_progress=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        if msg.content == "a1":
+            await release.wait()  # A slow turn in chat a
+        else:
+            await asyncio.sleep(0.01)
+        active -= 1
+        return OutboundMessage(channel=msg.channel, chat_id=msg.chat_id, content=f"re:{msg.content}")
+
+    loop._process_message = _fake_process  # type: ignore[method-assign]
+    runner = asyncio.create_task(loop.run())
+    for chat_id, content in [("a", "a1"), ("a", "a2"), ("b", "b1"), ("c", "c1"), ("b", "b2")]:
+        await bus.publish_inbound(InboundMessage(channel="telegram", sender_id="u", chat_id=chat_id, content=content))
+
+    async def _replies(n: int) -> list[str]:
+        return [(await asyncio.wait_for(bus.consume_outbound(), timeout=2)).content for _ in range(n)]
+
+    # Chats b and c are answered while chat a's turn is still running
+    first = await _replies(3)
+    assert set(first) == {"re:b1", "re:b2", "re:c1"}
+    assert first.index("re:b1") < first.index("re:b2")
+    release.set()
+    assert await _replies(2) == ["re:a1", "re:a2"]
+    assert peak == 2
+
+    loop.stop()
+    await asyncio.wait_for(runner, timeout=3)
+    assert not loop._session_workers and not loop._session_queues
+
+
+@pytest.mark.asyncio
+async def test_system_messages_keep_their_place_in_the_session(tmp_path: Path) -> None:
+    bus = MessageBus()
+    provider = MagicMock()
+    provider.get_default_model.return_value = "test-model"
+    loop = AgentLoop(bus=bus, provider=provider, workspace=tmp_path)
+
+    release = asyncio.Event()
+    handled = []
+
+    async def _fake_process(msg, session_key=None, on_progress=None):
+        if msg.content == "a1":
+            await release.wait()
+        handled.append(msg.content)
+        return OutboundMessage(channel=msg.channel, chat_id=msg.chat_id, content=f"re:{msg.content}")
+
+    loop._process_message = _fake_process  # type: ignore[method-assign]
+    runner = asyncio.create_task(loop.run())
+    await bus.publish_inbound(InboundMessage(channel="telegram", sender_id="u", chat_id="a", content="a1"))
+    await bus.publish_inbound(InboundMessage(channel="telegram", sender_id="u", chat_id="a", content="a2"))
+    # A subagent reports back to chat a after a2 arrived, while a1 is still running
+    await bus.publish_inbound(InboundMessage(channel="system", sender_id="subagent", chat_id="telegram:a",
+                                             content="done"))
+    while bus.inbound_size > 1:
+        await asyncio.sleep(0.01)
+    release.set()
+
+    for _ in range(3):
+        await asyncio.wait_for(bus.consume_outbound(), timeout=2)
+    assert handled == ["a1", "a2", "done"]
+
+    loop.stop()
+    await asyncio.wait_for(runner, timeout=3)
@@ -0,0 +1,53 @@
+"""Tests for the vector memory benchmark."""
+
+import json
+from pathlib import Path
+
+from nanobot.agent.benchmark import (
+    BenchmarkSpec,
+    SyntheticCorpus,
+    compare,
+    run_benchmark,
+    save_results,
+)
+
+
+def _small_spec(**kwargs) -> BenchmarkSpec:
+    return BenchmarkSpec(messages=250, messages_per_session=100, burst=7, vocabulary=400, queries=20, **kwargs)
+
+
+def test_corpus_is_deterministic_and_interleaves_sessions() -> None:
+    spec = _small_spec()
+    messages = list(SyntheticCorpus(spec).messages())
+
+    assert messages == list(SyntheticCorpus(spec).messages())
+    assert len(messages) == 250
+    assert [key for key, _, _ in messages[:8]] == ["bench:000000"] * 7 + ["bench:000001"]
+    by_session: dict[str, list[int]] = {}
+    for key, _, idx in messages:
+        by_session.setdefault(key, []).append(idx)
+    assert {key: len(idxs) for key, idxs in by_session.items()} == {
+        "bench:000000": 84, "bench:000001": 83, "bench:000002": 83,
+    }
+    assert all(idxs == list(range(len(idxs))) for idxs in by_session.values())
+
+
+def test_benchmark_writes_comparable_results(tmp_path: Path) -> None:
+    result = run_benchmark(_small_spec(), workdir=tmp_path)
+    out = tmp_path / "bench.json"
+    save_results([result], out)
+    data = json.loads(out.read_text(encoding="utf-8"))
+
+    run = data["results"][0]
+    assert run["spec"]["sessions"] == 3
+    assert run["add"]["indexed"] == 250 and run["add"]["messages_per_second"] > 0
+    assert run["search"]["queries"] == 20 and run["search"]["p99_ms"] >= run["search"]["p50_ms"]
+    assert run["cold"]["sessions_loaded"] == 3
+    assert run["disk"]["bytes"] > 0
+    assert list(tmp_path.iterdir()) == [out]  # The scratch workspace is removed
+
+    faster = json.loads(json.dumps(data))
+    faster["results"][0]["search"]["p50_ms"] = run["search"]["p50_ms"] / 2
+    changes = {metric: change for _, metric, _, _, change in compare(data, faster)}
+    assert changes["search.p50_ms"] == 0.5
+    assert changes["add.messages_per_second"] == 0.0
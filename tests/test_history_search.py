@@ -0,0 +1,60 @@
+"""Tests for the HISTORY.md index and the search_history tool."""
+
+import asyncio
+from pathlib import Path
+
+from nanobot.agent.history import HistoryIndex
+from nanobot.agent.memory import MemoryStore
+from nanobot.agent.tools.history import SearchHistoryTool
+
+
+def _store(tmp_path: Path) -> MemoryStore:
+    store = MemoryStore(tmp_path)
+    store.append_history("[2026-01-05 09:30] Planned the database migration to Postgres with Alice.")
+    store.append_history("[2026-01-20 14:00] User asked about the weather in Lisbon.\nThey travel next week.")
+    store.append_history("[2026-02-02 18:15] Finished the Postgres migration; rollback plan kept for a month.")
+    return store
+
+
+def test_ranked_search_with_date_filters(tmp_path: Path) -> None:
+    index = HistoryIndex(_store(tmp_path).history_file)
+
+    hits, total = index.search("postgres rollback")
+    assert total == 2
+    assert [h.stamp for h in hits] == ["2026-02-02 18:15", "2026-01-05 09:30"]
+    assert hits[0].text.startswith("[2026-02-02 18:15] Finished")
+
+    hits, total = index.search("migration", until="2026-01-31")
+    assert (total, hits[0].stamp) == (1, "2026-01-05 09:30")
+    hits, _ = index.search("Lisbon")
+    assert hits[0].text.endswith("They travel next week.")
+
+    hits, total = index.search("", since="2026-01-20")
+    assert [h.stamp for h in hits] == ["2026-02-02 18:15", "2026-01-20 14:00"]
+
+
+def test_index_catches_up_with_appends_and_rewrites(tmp_path: Path) -> None:
+    store = _store(tmp_path)
+    index = HistoryIndex(store.history_file)
+    assert index.update() == 3
+
+    store.append_history("[2026-03-01 08:00] Renewed the TLS certificates.")
+    assert index.search("certificates")[1] == 1
+    assert len(index) == 4
+
+    # A rewrite (e.g. the user pruning the log) is detected and re-indexed
+    store.history_file.write_text("[2026-04-01 10:00] Fresh start.\n\n", encoding="utf-8")
+    assert index.search("postgres")[1] == 0
+    assert index.search("fresh")[0][0].stamp == "2026-04-01 10:00"
+
+
+def test_search_history_tool(tmp_path: Path) -> None:
+    _store(tmp_path)
+    tool = SearchHistoryTool(workspace=tmp_path)
+
+    result = asyncio.run(tool.execute(query="postgres", limit=1))
+    assert result.startswith("1 of 2 matching entries:")
+    assert "[2026-01-05 09:30] Planned the database migration to Postgres" in result
+
+    assert asyncio.run(tool.execute(query="kubernetes")) == "No matching history entries."
+    assert asyncio.run(tool.execute(query="x", since="last week")).startswith("Error: invalid date")
@@ -0,0 +1,119 @@
+"""Tests for the background vector memory indexer."""
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from nanobot.agent.embeddings import HashingEmbedder
+from nanobot.agent.indexer import BackgroundIndexer
+from nanobot.agent.vectordb import LocalVectorDB
+
+
+@pytest.fixture
+def paused(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Keep the worker thread idle so queued writes stay pending."""
+    monkeypatch.setattr(BackgroundIndexer, "_run", lambda self: None)
+
+
+def test_search_reads_its_own_pending_writes(tmp_path: Path, paused: None) -> None:
+    indexer = BackgroundIndexer(LocalVectorDB(tmp_path))
+    indexer.add_message("cli:a", {"role": "user", "content": "book the flight to lisbon"}, 0)
+    indexer.add_message("cli:a", {"role": "assistant", "content": "flight booked"}, 1)
+    indexer.add_message("cli:b", {"role": "user", "content": "another flight"}, 0)
+    assert indexer.pending() == 3
+
+    results = indexer.search_messages("cli:a", "flight", top_k=5)
+
+    assert [r["content"] for r in results] == [
+        "[From Past Context]: book the flight to lisbon",
+        "[From Past Context]: flight booked",
+    ]
+    assert indexer.pending("cli:a") == 0
+    assert indexer.pending("cli:b") == 1
+
+
+def test_close_indexes_remaining_writes(tmp_path: Path, paused: None) -> None:
+    indexer = BackgroundIndexer(LocalVectorDB(tmp_path))
+    for i in range(600):
+        indexer.add_message("cli:a", {"role": "user", "content": f"note number {i:04d}"}, i)
+
+    indexer.close()
+
+    shard = LocalVectorDB(tmp_path)._shard("cli:a")
+    assert len(shard.index) == 600
+    with pytest.raises(RuntimeError):
+        indexer.add_message("cli:a", {"role": "user", "content": "too late"}, 600)
+
+
+def test_worker_drains_queue_in_batches(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    batches = []
+    add_messages = db.add_messages
+    db.add_messages = lambda key, items: batches.append(len(items)) or add_messages(key, items)
+    indexer = BackgroundIndexer(db)
+    with indexer._db_lock:  # Hold the worker back until everything is queued
+        for i in range(BackgroundIndexer.BATCH + 10):
+            indexer.add_message("cli:a", {"role": "user", "content": f"note number {i:04d}"}, i)
+
+    deadline = time.monotonic() + 5
+    while indexer.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert indexer.pending() == 0
+    assert batches == [BackgroundIndexer.BATCH, 10]
+    assert len(db.session_documents("cli:a")) == BackgroundIndexer.BATCH + 10
+    indexer.close()
+
+
+def test_indexing_errors_do_not_stop_the_worker(tmp_path: Path, paused: None) -> None:
+    db = LocalVectorDB(tmp_path)
+    indexer = BackgroundIndexer(db)
+    indexer.add_message("cli:a", {"role": "user", "content": "lost"}, 0)
+    add_messages = db.add_messages
+
+    def fail(key, items):
+        raise OSError("disk full")
+
+    db.add_messages = fail
+    indexer.flush()
+    db.add_messages = add_messages
+    indexer.add_message("cli:a", {"role": "user", "content": "kept"}, 1)
+
+    assert [r["content"] for r in indexer.search_messages("cli:a", "kept")] == ["[From Past Context]: kept"]
+
+
+def test_worker_embeds_dense_vectors(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    for i in range(100):
+        db.add_message("cli:a", {"role": "user", "content": f"note number {i:04d}"}, i)
+    db.close()
+    indexer = BackgroundIndexer(LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder()))
+
+    assert indexer.search_messages("cli:a", "note number 0042", top_k=1)  # Lexical until embedded
+    deadline = time.monotonic() + 5
+    while indexer.db._shard("cli:a").dense_missing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with indexer._db_lock:
+        assert len(indexer.db._shard("cli:a").dense) == 100
+    assert indexer.search_messages("cli:a", "note number 0042", top_k=1)[0]["content"].endswith("0042")
+    indexer.close()
+
+
+def test_queries_are_embedded_outside_the_lock(tmp_path: Path) -> None:
+    locked = []
+
+    class RecordingEmbedder(HashingEmbedder):
+        def embed(self, texts):
+            if threading.current_thread() is threading.main_thread():
+                locked.append(indexer._db_lock.locked())
+            return super().embed(texts)
+
+    indexer = BackgroundIndexer(LocalVectorDB(tmp_path, retrieval="hybrid", embedder=RecordingEmbedder()))
+    indexer.add_message("cli:a", {"role": "user", "content": "book the flight to lisbon"}, 0)
+    indexer.search_messages("cli:a", "flight", top_k=1)
+    indexer.close()
+
+    assert locked == [False]
@@ -0,0 +1,62 @@
+"""Tests for rebuilding vector memory from saved sessions."""
+
+from pathlib import Path
+
+import pytest
+
+from nanobot.agent.reindex import Reindexer
+from nanobot.agent.vectordb import LocalVectorDB
+from nanobot.session.manager import SessionManager
+
+
+def _save_sessions(workspace: Path) -> SessionManager:
+    manager = SessionManager(workspace)
+    for key, texts in {
+        "telegram:1": ["book a table in lisbon", "table booked for friday", "[From Past Context]: old echo"],
+        "telegram:2": ["water the garden plants", "garden watered"],
+        "cli:direct": ["summarize the quarterly report"],
+    }.items():
+        session = manager.get_or_create(key)
+        for i, text in enumerate(texts):
+            session.add_message("user" if i % 2 == 0 else "assistant", text)
+        manager.save(session)
+    return manager
+
+
+def test_reindex_rebuilds_every_session_in_one_snapshot(tmp_path: Path) -> None:
+    _save_sessions(tmp_path)
+    db = LocalVectorDB(tmp_path)
+
+    report = Reindexer(tmp_path, db, workers=2).run()
+
+    assert (report.sessions, report.messages, report.documents) == (3, 6, 5)
+    assert [d["content"] for d in db.session_documents("telegram:1")] == [
+        "book a table in lisbon", "table booked for friday",
+    ]
+    assert [r["content"] for r in db.search_messages("telegram:2", "garden plants")][0] == (
+        "[From Past Context]: water the garden plants"
+    )
+    shards = sorted(p.name for p in db.shards_dir.iterdir())
+    assert shards == ["cli_direct.vec", "telegram_1.vec", "telegram_2.vec"]  # No logs to replay
+
+
+def test_reindex_resumes_and_only_redoes_changed_files(tmp_path: Path) -> None:
+    manager = _save_sessions(tmp_path)
+    db = LocalVectorDB(tmp_path)
+
+    def interrupt(key: str, done: int, total: int) -> None:
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        Reindexer(tmp_path, db, workers=1).run(progress=interrupt)
+    resumed = Reindexer(tmp_path, db, workers=1).run()
+    assert (resumed.sessions, resumed.skipped) == (2, 1)
+
+    session = manager.get_or_create("telegram:2")
+    session.add_message("user", "buy new garden hose")
+    manager.save(session)
+    again = Reindexer(tmp_path, db, workers=1).run()
+
+    assert (again.sessions, again.skipped) == (1, 2)
+    assert len(db.session_documents("telegram:2")) == 3
+    assert Reindexer(tmp_path, db, workers=1).run(restart=True).sessions == 3
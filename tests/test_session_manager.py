@@ -0,0 +1,383 @@
+"""Tests for session file persistence."""
+
+import asyncio
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from nanobot.session.jsonl import COMPACT_MIN_TRAILERS, archive_dir
+from nanobot.session.manager import PagedMessages, Session, SessionManager
+
+
+def _records(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_save_appends_messages_and_metadata_trailers(tmp_path: Path) -> None:
+    manager = SessionManager(tmp_path)
+    session = manager.get_or_create("telegram:1")
+    session.add_message("user", "hello")
+    manager.save(session)
+    path = manager.storage.path(session.key)
+    header = path.read_text(encoding="utf-8").splitlines()[0]
+    inode = path.stat().st_ino
+
+    session.add_message("assistant", "hi")
+    session.add_message("user", "remember this")
+    session.last_consolidated = 1
+    manager.save(session)
+    manager.save(session)  # Nothing new: nothing written
+
+    records = _records(path)
+    assert path.stat().st_ino == inode
+    assert path.read_text(encoding="utf-8").splitlines()[0] == header
+    assert [r.get("content") for r in records[1:4]] == ["hello", "hi", "remember this"]
+    assert records[-1]["_type"] == "metadata_update"
+    assert records[-1]["count"] == 3 and records[-1]["last_consolidated"] == 1
+
+    loaded = SessionManager(tmp_path).get_or_create(session.key)
+    assert [m["content"] for m in loaded.messages] == ["hello", "hi", "remember this"]
+    assert loaded.last_consolidated == 1
+    assert loaded.updated_at == session.updated_at
+    assert SessionManager(tmp_path).list_sessions()[0]["updated_at"] == session.updated_at.isoformat()
+
+    # Appending continues after a reload
+    loaded.add_message("assistant", "noted")
+    SessionManager(tmp_path).save(loaded)
+    assert [r.get("content") for r in _records(path)].count("noted") == 1
+
+
+def test_rewrites_on_clear_compaction_and_torn_tail(tmp_path: Path) -> None:
+    manager = SessionManager(tmp_path)
+    session = Session(key="cli:direct")
+    for i in range(3):
+        session.add_message("user", f"m{i}")
+    manager.save(session)
+    path = manager.storage.path(session.key)
+
+    for i in range(COMPACT_MIN_TRAILERS + 1):
+        session.metadata["n"] = i
+        manager.save(session)
+    assert len(_records(path)) < COMPACT_MIN_TRAILERS
+    assert _records(path)[0]["metadata"] == {"n": COMPACT_MIN_TRAILERS}
+
+    session.clear()
+    manager.save(session)
+    assert len(_records(path)) == 1
+
+    session.add_message("user", "after clear")
+    manager.save(session)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"role": "assistant", "cont')  # Crash mid-append
+    loaded = SessionManager(tmp_path).get_or_create(session.key)
+    assert [m["content"] for m in loaded.messages] == ["after clear"]
+    loaded.add_message("assistant", "recovered")
+    SessionManager(tmp_path).save(loaded)
+    assert [r.get("content") for r in _records(path)[1:]] == ["after clear", "recovered"]
+
+
+def test_cache_evicts_least_recently_used_and_flushes(tmp_path: Path) -> None:
+    manager = SessionManager(tmp_path, max_cached=2)
+    a = manager.get_or_create("chat:a")
+    a.add_message("user", "unsaved")  # Dirty when evicted
+    manager.get_or_create("chat:b")
+    assert manager.get_or_create("chat:a") is a  # Hit: a is now most recent
+    manager.get_or_create("chat:c")  # Evicts b (empty: no file written)
+    assert not manager.storage.path("chat:b").exists()
+    manager.get_or_create("chat:d")  # Evicts a, saving it
+
+    assert manager.cache_stats() | {"bytes": 0} == {
+        "sessions": 2, "bytes": 0, "unsaved": 0, "hits": 1, "misses": 4, "evictions": 2, "hit_rate": 0.2,
+    }
+    assert [m["content"] for m in SessionManager(tmp_path).get_or_create("chat:a").messages] == ["unsaved"]
+    # Still referenced here, so the same object comes back rather than a second copy
+    assert manager.get_or_create("chat:a") is a
+
+
+def test_cache_respects_byte_budget(tmp_path: Path) -> None:
+    manager = SessionManager(tmp_path, max_cache_bytes=10_000)
+    for i in range(5):
+        session = manager.get_or_create(f"chat:{i}")
+        session.add_message("user", "x" * 2000)
+        manager.save(session)
+    stats = manager.cache_stats()
+    assert stats["sessions"] < 5 and 0 < stats["bytes"] <= 10_000
+    assert stats["evictions"] == 5 - stats["sessions"]
+
+
+def test_lazy_load_reads_only_unconsolidated_tail(tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setattr("nanobot.session.jsonl._TAIL_BLOCK", 100)  # Many backward steps
+    manager = SessionManager(tmp_path)
+    session = manager.get_or_create("chat:long")
+    for turn in range(40):
+        session.add_message("user", f"question {turn}")
+        session.add_message("assistant", f"answer {turn} " + "é" * turn)
+        if turn == 30:
+            session.last_consolidated = 50
+        manager.save(session)
+    expected = list(session.messages)
+
+    loaded = SessionManager(tmp_path).get_or_create("chat:long")
+    assert isinstance(loaded.messages, PagedMessages)
+    assert (len(loaded.messages), loaded.messages.loaded, loaded.last_consolidated) == (80, 30, 50)
+    assert loaded.get_history(max_messages=500) == session.get_history(max_messages=500)
+    assert loaded.messages[-1] == expected[-1] and loaded.messages.loaded == 30
+
+    # Appending and saving stays within the tail
+    loaded.add_message("user", "one more")
+    SessionManager(tmp_path).save(loaded)
+    assert loaded.messages.loaded == 31
+
+    # Older messages are read in when needed (e.g. by consolidation or export)
+    assert loaded.messages[:2] == expected[:2]
+    assert loaded.messages.loaded == 81
+    assert loaded.messages == SessionManager(tmp_path).storage.load_file(manager.storage.path("chat:long")).messages
+
+
+def test_consolidated_messages_move_to_compressed_archive(tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setattr("nanobot.session.jsonl.ARCHIVE_MIN_MESSAGES", 20)
+    manager = SessionManager(tmp_path)
+    session = manager.get_or_create("chat:long")
+    for turn in range(30):
+        session.add_message("user", f"question {turn}")
+        session.add_message("assistant", f"answer {turn}")
+        session.last_consolidated = max(0, len(session.messages) - 10)
+        manager.save(session)
+    expected = [f"{kind} {turn}" for turn in range(30) for kind in ("question", "answer")]
+
+    path = manager.storage.path(session.key)
+    segments = sorted(p.name for p in archive_dir(path).iterdir())
+    assert segments == ["0000000000-0000000020.jsonl.gz", "0000000020-0000000040.jsonl.gz"]
+    assert _records(path)[0]["archived"] == 40 and len(_records(path)) < 30
+    # Only the hot tail stays in memory, and the rest reads back when needed
+    assert isinstance(session.messages, PagedMessages) and session.messages.loaded == 20
+    assert [m["content"] for m in manager.storage.iter_messages(session.key)] == expected
+
+    loaded = SessionManager(tmp_path).get_or_create(session.key)
+    assert loaded.get_history() == session.get_history() and loaded.messages.loaded == 10
+    assert [m["content"] for m in loaded.messages] == expected
+    assert [m["content"] for m in SessionManager(tmp_path).storage.load_full(session.key).messages] == expected
+
+    session.clear()
+    manager.save(session)
+    assert not archive_dir(path).exists()
+    assert list(manager.storage.iter_messages(session.key)) == []
+
+
+def test_list_sessions_uses_the_catalog(tmp_path: Path) -> None:
+    gateway, cli = SessionManager(tmp_path), SessionManager(tmp_path)
+    for key, n in (("telegram:1", 2), ("discord:9", 1)):
+        session = gateway.get_or_create(key)
+        for i in range(n):
+            session.add_message("user", f"{key} {i}")
+        gateway.save(session)
+    direct = cli.get_or_create("heartbeat")
+    direct.add_message("user", "tick")
+    cli.save(direct)  # Another manager on the same workspace
+
+    listed = gateway.list_sessions()
+    assert [(s["key"], s["messages"], s["channel"]) for s in listed] == [
+        ("heartbeat", 1, None), ("discord:9", 1, "discord"), ("telegram:1", 2, "telegram"),
+    ]
+    assert listed[2]["path"] == str(gateway.storage.path("telegram:1"))
+
+    # Listing does not read session files...
+    gateway.storage.path("discord:9").write_text("", encoding="utf-8")
+    assert len(gateway.list_sessions()) == 3
+    # ...unless the catalog is lost, when it is rebuilt from them
+    gateway.storage.catalog.path.unlink()
+    rebuilt = SessionManager(tmp_path).list_sessions()
+    assert [(s["key"], s["messages"]) for s in rebuilt] == [("heartbeat", 1), ("telegram:1", 2)]
+
+
+def test_catalog_log_is_compacted(tmp_path: Path) -> None:
+    manager = SessionManager(tmp_path)
+    session = manager.get_or_create("slack:c1")
+    for i in range(manager.storage.catalog.COMPACT_MIN_LINES + 10):
+        session.add_message("user", str(i))
+        manager.save(session)
+    lines = manager.storage.catalog.path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) < manager.storage.catalog.COMPACT_MIN_LINES
+    assert SessionManager(tmp_path).list_sessions()[0]["messages"] == manager.storage.catalog.COMPACT_MIN_LINES + 10
+
+
+def test_write_behind_saves_in_the_background(tmp_path: Path) -> None:
+    async def main() -> None:
+        manager = SessionManager(tmp_path, max_cached=1, write_behind=60)
+        session = manager.get_or_create("telegram:1")
+        path = manager.storage.path(session.key)
+        for text in ("hi", "hello"):
+            session.add_message("user", text)
+            manager.save(session)
+        assert not path.exists() and manager.cache_stats()["unsaved"] == 1
+        assert manager.get_or_create(session.key) is session
+
+        manager.get_or_create("telegram:2")  # Evicting an unsaved session writes it promptly
+        await asyncio.sleep(0.1)
+        assert [r.get("content") for r in _records(path)[1:3]] == ["hi", "hello"]
+        assert manager.cache_stats()["unsaved"] == 0
+
+        session.add_message("user", "bye")
+        manager.save(session)
+        await manager.close()
+        assert [r.get("content") for r in _records(path)[1:4]] == ["hi", "hello", "bye"]
+
+    asyncio.run(main())
+    # Without a running event loop, saves are written immediately
+    manager = SessionManager(tmp_path, write_behind=60)
+    session = manager.get_or_create("telegram:1")
+    session.add_message("assistant", "sync")
+    manager.save(session)
+    assert SessionManager(tmp_path).get_or_create("telegram:1").messages[-1]["content"] == "sync"
+
+
+def test_sqlite_backend_appends_in_transactions(tmp_path: Path) -> None:
+    manager = SessionManager(tmp_path, backend="sqlite")
+    session = manager.get_or_create("telegram:1")
+    for turn in range(10):
+        session.add_message("user", f"q{turn}")
+        session.add_message("assistant", f"a{turn}")
+        if turn == 6:
+            session.last_consolidated = 12
+        manager.save(session)
+    session.metadata["topic"] = "tests"
+    manager.save(session)
+    db = manager.storage._reader
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 20
+
+    # A second manager reads while the first keeps writing
+    reader = SessionManager(tmp_path, backend="sqlite")
+    loaded = reader.get_or_create("telegram:1")
+    assert isinstance(loaded.messages, PagedMessages) and loaded.messages.loaded == 8
+    assert (loaded.metadata, loaded.last_consolidated) == ({"topic": "tests"}, 12)
+    assert loaded.get_history() == session.get_history()
+    session.add_message("user", "later")
+    manager.save(session)
+    assert loaded.messages == session.messages[:20]
+    assert reader.list_sessions()[0]["messages"] == 21
+
+    # Saving the stale copy rewrites the session rather than mixing the two
+    loaded.add_message("assistant", "from the reader")
+    reader.save(loaded)
+    assert [m["content"] for m in SessionManager(tmp_path, backend="sqlite").storage.load_full("telegram:1").messages][-2:] == [
+        "a9", "from the reader",
+    ]
+    session.clear()
+    manager.save(session)
+    assert db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+
+
+def test_migrate_sessions_between_backends(tmp_path: Path) -> None:
+    from unittest.mock import patch
+
+    from typer.testing import CliRunner
+
+    from nanobot.cli.commands import app
+    from nanobot.config.schema import Config
+
+    manager = SessionManager(tmp_path)
+    for key in ("telegram:1", "cli:direct"):
+        session = manager.get_or_create(key)
+        session.add_message("user", f"hello from {key}")
+        session.last_consolidated = 1
+        manager.save(session)
+    config = Config()
+    config.agents.defaults.workspace = str(tmp_path)
+
+    with patch("nanobot.config.loader.load_config", return_value=config), \
+         patch("nanobot.config.loader.save_config") as save_config:
+        result = CliRunner().invoke(app, ["sessions", "migrate", "--to", "sqlite"])
+
+    assert result.exit_code == 0, result.stdout
+    assert "Copied 2 session(s)" in result.stdout
+    assert save_config.call_args[0][0].memory.sessions.backend == "sqlite"
+    migrated = SessionManager(tmp_path, backend="sqlite")
+    assert [s["key"] for s in migrated.list_sessions()] == [s["key"] for s in manager.list_sessions()]
+    session = migrated.get_or_create("telegram:1")
+    assert ([m["content"] for m in session.messages], session.last_consolidated) == (["hello from telegram:1"], 1)
+
+
+def test_messages_are_compact_records(tmp_path: Path) -> None:
+    from nanobot.session.benchmark import run_message_benchmark
+    from nanobot.session.message import Message
+
+    call = {"role": "assistant", "content": "", "timestamp": "2026-01-01T09:00:00.250000",
+            "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "exec", "arguments": "{}"}}]}
+    reply = {"role": "tool", "tool_call_id": "c1", "name": "exec", "content": "ok",
+             "timestamp": "2026-01-01 09:00:01"}
+    records = [Message.from_dict(call), Message.from_dict(reply)]
+    # Timestamps are kept exactly as given, without being parsed on load
+    assert [dict(m) for m in records] == [call, reply]
+    assert [m._stamp for m in records] == [call["timestamp"], reply["timestamp"]]
+    now = Message("user", "hi", timestamp=datetime(2026, 1, 1, 9, 0, 0, 250000))
+    assert isinstance(now._stamp, int) and now["timestamp"] == "2026-01-01T09:00:00.250000"
+
+    manager = SessionManager(tmp_path)
+    session = manager.get_or_create("cli:direct")
+    session.add_message("user", "run it")
+    session.messages.extend(records)
+    manager.save(session)
+    manager.invalidate("cli:direct")
+    loaded = manager.get_or_create("cli:direct")
+    assert all(isinstance(m, Message) for m in loaded.messages)
+    assert [dict(m) for m in loaded.messages] == [dict(m) for m in session.messages]
+    assert loaded.get_history() == [
+        {"role": "user", "content": "run it"},
+        {"role": "assistant", "content": "", "tool_calls": call["tool_calls"]},
+        {"role": "tool", "content": "ok", "tool_call_id": "c1", "name": "exec"},
+    ]
+
+    as_dicts, as_records = run_message_benchmark(2000, history=100, calls=5)
+    assert as_records.bytes < as_dicts.bytes
+
+
+def test_close_after_evicting_an_unsaved_session(tmp_path: Path) -> None:
+    async def main() -> None:
+        manager = SessionManager(tmp_path, max_cached=1, write_behind=5)
+        session = manager.get_or_create("telegram:1")
+        session.add_message("user", "hi")
+        manager.save(session)
+        manager.get_or_create("telegram:2")  # Wakes the writer while it is still idle
+        await asyncio.wait_for(manager.close(), 2)
+        assert manager.cache_stats()["unsaved"] == 0
+        assert [r.get("content") for r in _records(manager.storage.path(session.key))[1:]] == ["hi"]
+
+    asyncio.run(main())
+
+
+def test_session_being_written_is_not_reloaded(tmp_path: Path) -> None:
+    async def main() -> None:
+        manager = SessionManager(tmp_path, write_behind=60)
+        session = manager.get_or_create("telegram:1")
+        for i in range(5):
+            session.add_message("user", f"m{i}")
+        manager.save(session)
+        await manager.flush_async()
+
+        committing, proceed = threading.Event(), threading.Event()
+        commit = manager.storage.commit
+
+        def slow_commit(pending):
+            committing.set()
+            proceed.wait(5)
+            commit(pending)
+
+        manager.storage.commit = slow_commit
+        session.clear()  # As /new does
+        manager.save(session)
+        manager.invalidate(session.key)
+        flush = asyncio.create_task(manager.flush_async())
+        await asyncio.to_thread(committing.wait, 5)
+
+        assert manager.get_or_create(session.key) is session and not session.messages
+        proceed.set()
+        await flush
+        session.add_message("user", "next")
+        manager.save(session)
+        await manager.close()
+        records = _records(manager.storage.path(session.key))
+        assert [r["content"] for r in records if "role" in r] == ["next"]
+
+    asyncio.run(main())
@@ -0,0 +1,733 @@
+"""Tests for the local vector memory used for retrieval-augmented context."""
+
+import json
+import math
+import random
+import struct
+from array import array
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import pytest
+
+from nanobot.agent import embeddings, vectordb
+from nanobot.agent.embeddings import HashingEmbedder, OpenAIEmbedder
+from nanobot.agent.vectordb import LocalVectorDB, RetentionPolicy
+
+
+def _brute_force(db: LocalVectorDB, session_key: str, query: str, top_k: int) -> list[str]:
+    """Reference ranking: lnc.ltc cosine computed from scratch over every session document."""
+    docs = db.session_documents(session_key)
+    n = len(docs)
+    q = db._tokenize(query)
+    weights = {}
+    for term, tf in q.items():
+        df = sum(1 for doc in docs if term in doc["vector"])
+        if df:
+            weights[term] = (1 + math.log(tf)) * (math.log((n + 1) / (df + 1)) + 1)
+    q_norm = math.sqrt(sum(w * w for w in weights.values()))
+    scored = []
+    for i, doc in enumerate(docs):
+        v = {t: 1 + math.log(tf) for t, tf in doc["vector"].items()}
+        dot = sum(w * v[t] for t, w in weights.items() if t in v)
+        mag = q_norm * math.sqrt(sum(x * x for x in v.values()))
+        score = dot / mag if mag else 0.0
+        if score > 0.05:
+            scored.append((score, i, doc))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    top = sorted(scored[:top_k], key=lambda x: int(x[2]["id"].split("_")[-1]))
+    return [f"[From Past Context]: {doc['content']}" for _, _, doc in top]
+
+
+def _fill(db: LocalVectorDB) -> None:
+    texts = [
+        "the weather in madrid is sunny today",
+        "remind me to buy coffee beans tomorrow",
+        "coffee with milk and sugar please",
+        "python asyncio event loop internals",
+        "the event was moved to friday because of weather",
+        "sugar free coffee tastes bitter",
+    ]
+    for i, text in enumerate(texts):
+        db.add_message("telegram:1", {"role": "user", "content": text}, i)
+    db.add_message("telegram:2", {"role": "user", "content": "coffee coffee coffee"}, 0)
+
+
+def test_search_only_returns_matching_session(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+
+    results = db.search_messages("telegram:1", "coffee", top_k=10)
+
+    assert results
+    assert all("coffee" in r["content"] for r in results)
+    assert all(r["is_from_vector"] for r in results)
+    assert "[From Past Context]: coffee coffee coffee" not in [r["content"] for r in results]
+    assert db.search_messages("telegram:3", "coffee") == []
+
+
+def test_inverted_index_matches_linear_scan(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+
+    for query in ("coffee sugar", "weather event friday", "asyncio", "nothing matches here"):
+        got = [r["content"] for r in db.search_messages("telegram:1", query, top_k=3)]
+        assert got == _brute_force(db, "telegram:1", query, top_k=3)
+
+
+def test_index_survives_reload(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    before = db.search_messages("telegram:1", "coffee beans", top_k=2)
+
+    reloaded = LocalVectorDB(tmp_path)
+
+    assert reloaded.search_messages("telegram:1", "coffee beans", top_k=2) == before
+
+
+def test_duplicate_ids_are_not_reindexed(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    db.add_message("cli:x", {"role": "user", "content": "first version"}, 0)
+    db.add_message("cli:x", {"role": "user", "content": "second version"}, 0)
+
+    results = db.search_messages("cli:x", "version", top_k=5)
+
+    assert [r["content"] for r in results] == ["[From Past Context]: first version"]
+
+
+def test_add_appends_to_log_instead_of_rewriting_snapshot(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    shard = db._shard("telegram:1")
+
+    assert not shard.snapshot_file.exists()
+    assert len(shard.wal_file.read_text(encoding="utf-8").splitlines()) == 6
+
+
+def test_startup_replays_snapshot_and_log_tail(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.compact()
+    db.add_message("telegram:1", {"role": "assistant", "content": "espresso coffee is strong"}, 6)
+    wal_file = db._shard("telegram:1").wal_file
+    db.close()
+    # Simulate a crash in the middle of writing a record
+    with open(wal_file, "a", encoding="utf-8") as f:
+        f.write('{"seq": 99, "doc": {"id"')
+
+    reloaded = LocalVectorDB(tmp_path)
+
+    assert len(reloaded.session_documents("telegram:1")) == 7
+    assert len(wal_file.read_text(encoding="utf-8").splitlines()) == 2
+    contents = [r["content"] for r in reloaded.search_messages("telegram:1", "coffee", top_k=10)]
+    assert "[From Past Context]: espresso coffee is strong" in contents
+
+
+def test_background_compaction_folds_log_into_snapshot(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, compact_every=3)
+    _fill(db)
+    shard = db._shard("telegram:1")
+    db.wait_for_compaction()
+    db.close()
+
+    assert shard.snapshot_file.exists()
+    assert not shard.compacting_file.exists()
+    reloaded = LocalVectorDB(tmp_path)
+    for key in ("telegram:1", "telegram:2"):
+        assert reloaded.session_documents(key) == db.session_documents(key)
+
+
+def test_interrupted_compaction_is_recovered(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    shard = db._shard("telegram:1")
+    db.close()
+    shard.wal_file.rename(shard.compacting_file)
+
+    reloaded = LocalVectorDB(tmp_path)
+
+    assert len(reloaded.session_documents("telegram:1")) == 6
+    assert shard.snapshot_file.exists()
+    assert not shard.compacting_file.exists()
+
+
+def test_legacy_global_index_is_split_into_shards(tmp_path: Path) -> None:
+    legacy = [{
+        "id": "cli:old_0", "session": "cli:old", "role": "user",
+        "content": "legacy coffee note", "vector": {"legacy": 1, "coffee": 1, "note": 1},
+    }]
+    db_path = tmp_path / "vector_memory"
+    db_path.mkdir()
+    (db_path / "index.json").write_text(json.dumps(legacy), encoding="utf-8")
+    wal_doc = {
+        "id": "cli:new_0", "session": "cli:new", "role": "user",
+        "content": "logged coffee note", "vector": {"logged": 1, "coffee": 1, "note": 1},
+    }
+    (db_path / "wal.jsonl").write_text(json.dumps({"seq": 1, "doc": wal_doc}) + "\n", encoding="utf-8")
+
+    db = LocalVectorDB(tmp_path)
+
+    assert db.search_messages("cli:old", "coffee") == [{
+        "role": "user", "content": "[From Past Context]: legacy coffee note", "is_from_vector": True,
+    }]
+    assert [d["id"] for d in db.session_documents("cli:new")] == ["cli:new_0"]
+    assert not (db_path / "index.json").exists()
+    assert not (db_path / "wal.jsonl").exists()
+
+
+def test_append_after_torn_record_starts_a_new_line(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    wal_file = db._shard("cli:x").wal_file
+    db.close()
+    wal_file.write_text('{"seq": 1, "doc": {"id"', encoding="utf-8")
+
+    db = LocalVectorDB(tmp_path)
+    db.add_message("cli:x", {"role": "user", "content": "survives the torn record"}, 0)
+    db.close()
+
+    assert [d["id"] for d in LocalVectorDB(tmp_path).session_documents("cli:x")] == ["cli:x_0"]
+
+
+def test_sessions_are_partitioned(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.add_message("telegram:2", {"role": "user", "content": "coffee again"}, 0)  # duplicate id
+
+    assert [d["id"] for d in db.session_documents("telegram:2")] == ["telegram:2_0"]
+    assert len(db.session_documents("telegram:1")) == 6
+    assert db.session_documents("telegram:9") == []
+
+
+def _fill_common_word(db: LocalVectorDB) -> None:
+    # "the" appears everywhere; "invoice" only once.
+    texts = [
+        "the the the meeting with the team about the roadmap",
+        "the the the the lunch the place the time",
+        "send the invoice",
+        "the the the weekend the plans",
+    ]
+    for i, text in enumerate(texts):
+        db.add_message("cli:c", {"role": "user", "content": text}, i)
+
+
+def test_tfidf_downweights_common_terms(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill_common_word(db)
+
+    top = db.search_messages("cli:c", "the invoice", top_k=1)
+
+    assert top[0]["content"] == "[From Past Context]: send the invoice"
+
+
+def test_bm25_ranking(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, ranking="bm25")
+    _fill_common_word(db)
+    _fill(db)
+
+    assert db.search_messages("cli:c", "the invoice", top_k=1)[0]["content"] == (
+        "[From Past Context]: send the invoice"
+    )
+    contents = [r["content"] for r in db.search_messages("telegram:1", "coffee", top_k=10)]
+    assert len(contents) == 3
+    assert all("coffee" in c for c in contents)
+
+
+def test_unknown_ranking_mode_is_rejected(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        LocalVectorDB(tmp_path, ranking="random")
+
+
+def test_shards_are_loaded_lazily_and_evicted_lru(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.close()
+
+    db = LocalVectorDB(tmp_path, max_resident=1)
+    assert db.resident_sessions() == []
+
+    assert db.search_messages("telegram:2", "coffee")
+    assert db.resident_sessions() == ["telegram:2"]
+    assert db.search_messages("telegram:1", "coffee")
+    assert db.resident_sessions() == ["telegram:1"]
+    assert db.search_messages("telegram:404", "coffee") == []
+    assert db.resident_sessions() == ["telegram:1"]
+    assert not any(p.name.startswith("telegram_404") for p in db.shards_dir.iterdir())
+
+
+def test_binary_snapshot_round_trip(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.add_message("telegram:1", {"role": "assistant", "content": "café con leche ☕ por favor"}, 10)
+    before = db.session_documents("telegram:1")
+    db.compact()
+    db.close()
+
+    reloaded = LocalVectorDB(tmp_path)
+
+    assert reloaded.session_documents("telegram:1") == before
+    assert reloaded.search_messages("telegram:1", "café", top_k=1) == [{
+        "role": "assistant", "content": "[From Past Context]: café con leche ☕ por favor",
+        "is_from_vector": True,
+    }]
+
+
+def test_json_shard_snapshot_is_converted(tmp_path: Path) -> None:
+    shards = tmp_path / "vector_memory" / "shards"
+    shards.mkdir(parents=True)
+    (shards / "cli_old.json").write_text(json.dumps({"key": "cli:old", "seq": 1, "documents": [{
+        "id": "cli:old_3", "session": "cli:old", "role": "user",
+        "content": "legacy coffee note", "vector": {"legacy": 1, "coffee": 1, "note": 1},
+    }]}), encoding="utf-8")
+
+    db = LocalVectorDB(tmp_path)
+
+    assert [d["id"] for d in db.session_documents("cli:old")] == ["cli:old_3"]
+    assert (shards / "cli_old.vec").exists()
+    assert not (shards / "cli_old.json").exists()
+
+
+def test_snapshot_is_mapped_and_read_lazily(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.compact()
+    db.add_message("telegram:1", {"role": "user", "content": "espresso after lunch"}, 6)
+    db.close()
+
+    index = LocalVectorDB(tmp_path)._shard("telegram:1").index
+
+    assert index.base is not None and index.n_base == 6
+    assert index.new_contents == ["espresso after lunch"]  # Only the log tail is held in RAM
+    assert index.vocab == {"espresso": index.term_id("espresso"), "after": index.term_id("after"),
+                           "lunch": index.term_id("lunch")}
+    assert index.content(1) == "remind me to buy coffee beans tomorrow"
+    assert index.term_id("zzz") is None
+
+
+def test_compaction_moves_documents_out_of_ram(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, compact_every=4)
+    _fill(db)
+    db.wait_for_compaction()
+    db.add_message("telegram:1", {"role": "user", "content": "espresso after lunch"}, 6)
+    db._shard("telegram:1").remove_many([2])
+
+    index = db._shard("telegram:1").index
+
+    assert index.n_base == 4
+    assert index.new_contents == ["the event was moved to friday because of weather",
+                                  "sugar free coffee tastes bitter", "espresso after lunch"]
+    assert [d["id"].split("_")[1] for d in db.session_documents("telegram:1")] == ["0", "1", "3", "4", "5", "6"]
+    assert [r["content"] for r in db.search_messages("telegram:1", "coffee", top_k=5)] == [
+        "[From Past Context]: remind me to buy coffee beans tomorrow",
+        "[From Past Context]: sugar free coffee tastes bitter",
+    ]
+
+
+def test_version_2_snapshot_is_converted(tmp_path: Path) -> None:
+    def arr(f, typecode, values):
+        values = array(typecode, values)
+        f.write(struct.pack("<cQ", typecode.encode(), len(values)) + values.tobytes())
+
+    def strings(f, values):
+        encoded = [v.encode("utf-8") for v in values]
+        arr(f, "I", [len(b) for b in encoded])
+        f.write(b"".join(encoded))
+
+    shards = tmp_path / "vector_memory" / "shards"
+    shards.mkdir(parents=True)
+    with open(shards / "cli_old.vec", "wb") as f:
+        f.write(struct.pack("<5sHQII", b"NBVEC", 2, 2, 2, 0))
+        strings(f, ["cli:old"])
+        strings(f, ["legacy", "coffee", "note", "tea"])
+        strings(f, ["user"])
+        arr(f, "B", [0, 0])
+        strings(f, ["legacy coffee note", "tea"])
+        arr(f, "I", [3, 4])  # Positions
+        arr(f, "I", [0, 3, 4])
+        arr(f, "I", [0, 1, 2, 3])
+        arr(f, "I", [1, 1, 1, 1])
+        arr(f, "d", [1000.0, 2000.0])
+        arr(f, "B", [0, 1])  # The second document is dead
+
+    db = LocalVectorDB(tmp_path)
+
+    assert db.session_keys() == ["cli:old"]
+    assert db.session_documents("cli:old") == [{
+        "id": "cli:old_3", "session": "cli:old", "role": "user", "content": "legacy coffee note",
+        "vector": {"legacy": 1, "coffee": 1, "note": 1}, "timestamp": 1000.0,
+    }]
+    assert db._shard("cli:old").index.base is not None
+    assert (shards / "cli_old.vec").read_bytes()[5:7] == struct.pack("<H", 3)
+
+
+def test_json_export_and_import_round_trip(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path / "a")
+    _fill(db)
+    before = db.session_documents("telegram:1")
+    out = tmp_path / "telegram_1.json"
+
+    assert db.export_json("telegram:1", out) == 6
+    data = json.loads(out.read_text(encoding="utf-8"))
+    assert data["key"] == "telegram:1" and data["documents"] == before
+
+    other = LocalVectorDB(tmp_path / "b")
+    other.add_message("telegram:1", {"role": "user", "content": "replaced by the import"}, 0)
+    assert other.import_json(out) == ("telegram:1", 6)
+    assert other.session_documents("telegram:1") == before
+    other.close()
+    assert LocalVectorDB(tmp_path / "b").session_documents("telegram:1") == before
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_search_with_no_results_requested(tmp_path: Path, backend: str) -> None:
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    db = LocalVectorDB(tmp_path, backend=backend)
+    for i in range(10):
+        db.add_message("cli:k", {"role": "user", "content": f"deploy notes {i}"}, i)
+    assert db.search_messages("cli:k", "deploy", top_k=0) == []
+    assert db.search_messages("cli:k", "deploy", top_k=-1) == []
+    assert len(db.search_messages("cli:k", "deploy", top_k=3)) == 3
+
+
+@pytest.mark.parametrize("ranking", ["tfidf", "bm25"])
+def test_numpy_backend_matches_python_rankings(tmp_path: Path, ranking: str) -> None:
+    pytest.importorskip("numpy")
+    rng = random.Random(7)
+    words = [f"term{i}" for i in range(300)]
+    py_db = LocalVectorDB(tmp_path / "py", ranking=ranking, backend="python")
+    np_db = LocalVectorDB(tmp_path / "np", ranking=ranking, backend="numpy")
+
+    def add(start: int, count: int) -> None:
+        for i in range(start, start + count):
+            text = " ".join(rng.choices(words, k=rng.randint(1, 30)))
+            for db in (py_db, np_db):
+                db.add_message("cli:r", {"role": "user", "content": text}, i)
+
+    def check() -> None:
+        for _ in range(30):
+            query = " ".join(rng.choices(words, k=rng.randint(1, 4)))
+            assert np_db.search_messages("cli:r", query, top_k=5) == \
+                py_db.search_messages("cli:r", query, top_k=5)
+
+    add(0, 400)
+    check()
+    add(400, 50)  # Served from the array postings on top of the cached matrix
+    check()
+    add(450, 2000)  # Forces a rebuild of the matrix
+    check()
+
+
+def test_numpy_backend_requires_numpy(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(vectordb, "np", None)
+
+    with pytest.raises(ValueError):
+        LocalVectorDB(tmp_path, backend="numpy")
+    assert LocalVectorDB(tmp_path).backend == "python"
+
+
+def test_dense_retrieval_matches_inflections(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder())
+    _fill(db)
+
+    # No exact term overlap with "coffee beans", so lexical search finds nothing
+    assert LocalVectorDB(tmp_path).search_messages("telegram:1", "cofee bean", top_k=1) == []
+    top = db.search_messages("telegram:1", "cofee bean", top_k=1)
+
+    assert top[0]["content"] == "[From Past Context]: remind me to buy coffee beans tomorrow"
+
+
+def test_hybrid_retrieval_fuses_both_rankings(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, retrieval="hybrid", embedder=HashingEmbedder())
+    _fill(db)
+
+    contents = [r["content"] for r in db.search_messages("telegram:1", "sugar coffee", top_k=2)]
+
+    assert contents == [
+        "[From Past Context]: coffee with milk and sugar please",
+        "[From Past Context]: sugar free coffee tastes bitter",
+    ]
+
+
+def test_dense_vectors_are_backfilled_and_persisted(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.close()
+
+    db = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder())
+    shard = db._shard("telegram:1")
+    assert len(shard.dense) == 6
+    db.add_message("telegram:1", {"role": "user", "content": "espresso please"}, 6)
+    db.close()
+
+    reloaded = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder())
+    assert len(reloaded._shard("telegram:1").dense) == 7
+    # A different embedding dimension invalidates the stored vectors
+    resized = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder(dim=64))
+    assert resized._shard("telegram:1").dense.dim == 64
+    assert len(resized._shard("telegram:1").dense) == 7
+
+
+class _CountingEmbedder(HashingEmbedder):
+    def __init__(self, dim: int = 256):
+        super().__init__(dim)
+        self.calls = 0
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        return super().embed(texts)
+
+
+def test_loading_stale_vectors_does_not_embed(tmp_path: Path) -> None:
+    _fill(LocalVectorDB(tmp_path))
+    embedder = _CountingEmbedder()
+    db = LocalVectorDB(tmp_path, retrieval="hybrid", embedder=embedder, embed_inline=False)
+
+    # No vectors yet: served lexically, without a single embedding call
+    lexical = LocalVectorDB(tmp_path).search_messages("telegram:1", "cofee bean sugar", top_k=2)
+    assert db.search_messages("telegram:1", "cofee bean sugar", top_k=2) == lexical
+    assert embedder.calls == 0 and db._shard("telegram:1").dense.stale
+
+    assert db.embed_pending(limit=4) and db._shard("telegram:1").dense_missing == 2
+    assert db.embed_pending() and not db.embed_pending()
+    assert len(db._shard("telegram:1").dense) == 6
+    db.close()
+
+    # A stored file gives the dimension, so an OpenAI embedder is not probed on load
+    openai = OpenAIEmbedder("embed-small", api_base="http://127.0.0.1:9")
+    reloaded = LocalVectorDB(tmp_path, retrieval="dense", embedder=openai, embed_inline=False)
+    shard = reloaded._shard("telegram:1")
+    assert not shard.dense.stale and shard.dense.dim == 256 and openai.known_dim is None
+
+
+def test_dense_retrieval_requires_embedder(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        LocalVectorDB(tmp_path, retrieval="dense")
+
+
+def test_openai_embedder_posts_batches(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    def fake_post(url, json, headers, timeout):
+        calls.append((url, json, headers))
+        data = [{"index": i, "embedding": [3.0, 4.0]} for i in reversed(range(len(json["input"])))]
+        return httpx.Response(200, json={"data": data}, request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(embeddings.httpx, "post", fake_post)
+    embedder = OpenAIEmbedder("embed-small", api_base="http://localhost:8000/v1/", api_key="k")
+
+    assert embedder.embed(["a", "b"]) == [[0.6, 0.8], [0.6, 0.8]]
+    assert embedder.dim == 2
+    assert calls == [(
+        "http://localhost:8000/v1/embeddings",
+        {"model": "embed-small", "input": ["a", "b"]},
+        {"Authorization": "Bearer k"},
+    )]
+
+
+def test_ivf_index_finds_near_duplicates(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(embeddings.IVFIndex, "MIN_ROWS", 64)
+    rng = random.Random(3)
+    words = [f"word{i}" for i in range(500)]
+    db = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder())
+    texts = [" ".join(rng.choices(words, k=8)) for _ in range(600)]
+    for i, text in enumerate(texts):
+        db.add_message("cli:ivf", {"role": "user", "content": text}, i)
+
+    for i in (0, 123, 599):
+        top = db.search_messages("cli:ivf", texts[i], top_k=1)
+        assert top[0]["content"] == f"[From Past Context]: {texts[i]}"
+    assert db._shard("cli:ivf").dense._ivf is not None
+
+
+def test_ivf_index_is_built_off_the_search_path_and_saved(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(embeddings.IVFIndex, "MIN_ROWS", 64)
+    db = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder(), embed_inline=False)
+    db.add_messages("cli:ivf", [({"role": "user", "content": f"entry {i} of {i % 7}"}, i) for i in range(300)])
+    while db.embed_pending(limit=64):
+        pass
+    dense = db._shard("cli:ivf").dense
+    assert dense.index_path.exists() and not dense.needs_index
+    db.close()
+
+    def no_build(rows):
+        raise AssertionError("searches must not build the index")
+
+    monkeypatch.setattr(embeddings.IVFIndex, "build", no_build)
+    reloaded = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder(), embed_inline=False)
+    query = reloaded.embed_query("entry 42 of 0")
+    top = reloaded.search_messages("cli:ivf", "entry 42 of 0", top_k=1, query_embedding=query)
+    assert top[0]["content"] == "[From Past Context]: entry 42 of 0"
+    assert reloaded._shard("cli:ivf").dense._ivf.count == 300
+
+
+def _days_ago(days: float) -> str:
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+def test_past_context_echoes_are_not_indexed(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    db.add_message("cli:a", {"role": "user", "content": "[From Past Context]: coffee beans"}, 0)
+    db.add_message("cli:a", {"role": "assistant", "content": "As noted: [From Past Context]: coffee"}, 1)
+
+    assert db.session_documents("cli:a") == []
+
+
+def test_retention_caps_documents_per_session(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, retention=RetentionPolicy(max_documents=3, dead_ratio=1.0))
+    _fill(db)
+
+    kept = [d["id"] for d in db.session_documents("telegram:1")]
+    db.close()
+
+    assert kept == ["telegram:1_3", "telegram:1_4", "telegram:1_5"]
+    # Removals are logged, so they survive a reload
+    assert [d["id"] for d in LocalVectorDB(tmp_path).session_documents("telegram:1")] == kept
+
+
+def test_retention_drops_old_and_old_tool_documents(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(LocalVectorDB, "RETENTION_INTERVAL", 0)
+    db = LocalVectorDB(tmp_path, retention=RetentionPolicy(max_age_days=90, tool_max_age_days=7))
+    db.add_message("cli:a", {"role": "user", "content": "ancient history", "timestamp": _days_ago(100)}, 0)
+    db.add_message("cli:a", {"role": "tool", "content": "old tool output", "timestamp": _days_ago(10)}, 1)
+    db.add_message("cli:a", {"role": "user", "content": "older question", "timestamp": _days_ago(10)}, 2)
+    db.add_message("cli:a", {"role": "tool", "content": "fresh tool output", "timestamp": _days_ago(1)}, 3)
+
+    assert [d["content"] for d in db.session_documents("cli:a")] == ["older question", "fresh tool output"]
+    assert db.search_messages("cli:a", "history") == []
+
+
+def test_near_duplicates_are_collapsed(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, retention=RetentionPolicy(collapse_duplicates=True))
+    db.add_message("cli:a", {"role": "user", "content": "Remind me to water the plants"}, 0)
+    db.add_message("cli:a", {"role": "user", "content": "remind me: water the plants!"}, 1)
+    db.add_message("cli:a", {"role": "user", "content": "remind me to water the garden"}, 2)
+
+    assert [d["id"] for d in db.session_documents("cli:a")] == ["cli:a_1", "cli:a_2"]
+    assert len(LocalVectorDB(tmp_path).session_documents("cli:a")) == 2
+
+    keep_all = LocalVectorDB(tmp_path / "all")  # Off by default
+    keep_all.add_message("cli:a", {"role": "user", "content": "water the plants"}, 0)
+    keep_all.add_message("cli:a", {"role": "user", "content": "Water the plants."}, 1)
+    assert len(keep_all.session_documents("cli:a")) == 2
+
+
+def test_dead_entries_trigger_a_rewrite(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, retention=RetentionPolicy(max_documents=4, dead_ratio=0.25))
+    for i in range(10):
+        db.add_message("cli:a", {"role": "user", "content": f"entry number {i:04d}"}, i)
+    shard = db._shard("cli:a")
+
+    assert shard.dead_ratio <= 0.25
+    assert shard.epoch > 0
+    assert len(shard.index) < 10
+    kept = db.session_documents("cli:a")
+    assert [d["id"] for d in kept] == [f"cli:a_{i}" for i in range(6, 10)]
+    db.close()
+    assert LocalVectorDB(tmp_path).session_documents("cli:a") == kept
+
+
+def test_clear_session_allows_reusing_message_indices(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+
+    assert db.clear_session("telegram:1") == 6
+    db.add_message("telegram:1", {"role": "user", "content": "fresh start with tea"}, 0)
+
+    assert [d["content"] for d in db.session_documents("telegram:1")] == ["fresh start with tea"]
+    assert db.search_messages("telegram:1", "coffee") == []
+    assert [d["content"] for d in LocalVectorDB(tmp_path).session_documents("telegram:1")] == ["fresh start with tea"]
+
+
+def test_compact_all_applies_retention_to_every_shard(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    db.add_message("cli:t", {"role": "tool", "content": "stale tool output", "timestamp": _days_ago(60)}, 0)
+    db.close()
+
+    db = LocalVectorDB(tmp_path, retention=RetentionPolicy(max_documents=2, tool_max_age_days=30))
+    assert db.session_keys() == ["cli:t", "telegram:1", "telegram:2"]
+    report = db.compact_all()
+    db.close()
+
+    assert report == [("cli:t", 1, 0), ("telegram:1", 4, 2), ("telegram:2", 0, 1)]
+    reloaded = LocalVectorDB(tmp_path)
+    assert len(reloaded.session_documents("telegram:1")) == 2
+    shard = reloaded._shard("telegram:1")
+    assert shard.snapshot_file.exists() and not shard.wal_file.exists()
+
+
+def test_rewrite_keeps_dense_vectors_aligned(tmp_path: Path) -> None:
+    policy = RetentionPolicy(max_documents=3, dead_ratio=0.1)
+    db = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder(), retention=policy)
+    _fill(db)
+    shard = db._shard("telegram:1")
+
+    assert len(shard.dense) == len(shard.index) == 3
+    top = db.search_messages("telegram:1", "sugar free coffee bitter", top_k=1)
+    assert top[0]["content"] == "[From Past Context]: sugar free coffee tastes bitter"
+    db.close()
+    reloaded = LocalVectorDB(tmp_path, retrieval="dense", embedder=HashingEmbedder(), retention=policy)
+    assert reloaded.search_messages("telegram:1", "sugar free coffee bitter", top_k=1) == top
+
+
+def test_rebuild_session_replaces_documents_in_one_snapshot(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, retrieval="hybrid", embedder=HashingEmbedder(),
+                       retention=RetentionPolicy(collapse_duplicates=True))
+    _fill(db)
+    docs = vectordb.message_documents([
+        ({"role": "user", "content": "plan the trip to porto"}, 0),
+        ({"role": "assistant", "content": "[From Past Context]: echo"}, 1),
+        ({"role": "user", "content": "plan the trip to porto"}, 2),
+        ({"role": "tool", "content": "train tickets reserved"}, 3),
+    ])
+
+    assert db.rebuild_session("telegram:1", docs) == 2
+    shard = db._shard("telegram:1")
+    assert [d["id"] for d in db.session_documents("telegram:1")] == ["telegram:1_2", "telegram:1_3"]
+    assert not shard.wal_file.exists()
+    assert len(shard.dense) == len(shard.index) == 2
+    assert db.search_messages("telegram:1", "coffee") == []
+
+
+def test_repeated_queries_are_served_from_cache(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+
+    first = db.search_messages("telegram:1", "Coffee with sugar?")
+    again = db.search_messages("telegram:1", "sugar, coffee with")  # Same tokens once normalized
+    assert again == first
+    assert db.cache_stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+    again[0]["content"] = "mutated by the caller"
+    assert db.search_messages("telegram:1", "coffee sugar with") == first
+    assert db.search_messages("telegram:1", "coffee sugar with", top_k=1) != first  # top_k is part of the key
+    assert db.cache_hits == 2
+
+
+def test_adding_a_message_invalidates_cached_results(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path)
+    _fill(db)
+    before = db.search_messages("telegram:1", "espresso")
+    db.search_messages("telegram:2", "coffee")
+
+    db.add_message("telegram:1", {"role": "user", "content": "a double espresso please"}, 6)
+
+    assert before == []
+    assert db.search_messages("telegram:1", "espresso") == [{
+        "role": "user", "content": "[From Past Context]: a double espresso please", "is_from_vector": True,
+    }]
+    db.search_messages("telegram:2", "coffee")  # Other sessions keep their entries
+    assert (db.cache_hits, db.cache_misses) == (1, 3)
+
+
+def test_query_cache_can_be_disabled(tmp_path: Path) -> None:
+    db = LocalVectorDB(tmp_path, query_cache_size=0)
+    _fill(db)
+
+    db.search_messages("telegram:1", "coffee")
+    db.search_messages("telegram:1", "coffee")
+
+    assert db.cache_stats()["hits"] == 0